@@ -0,0 +1,33 @@
+from __future__ import print_function
+
+import timeit
+
+from koala.Spreadsheet import Spreadsheet
+
+# Compares the string backend (compile/eval of python_expressions) with the closure backend
+
+filename = "./examples/basic.xlsx"
+dumpname = filename.replace("xlsx", "gzip")
+repeat = 20
+
+print(filename)
+
+sp = Spreadsheet(filename)
+sp.dump(dumpname)
+addresses = list(sp.cellmap.keys())
+
+for backend in ['string', 'closure']:
+    load_time = timeit.timeit(lambda: Spreadsheet.load(dumpname, backend = backend), number = repeat) / repeat
+
+    sp = Spreadsheet.load(dumpname, backend = backend)
+    def evaluate():
+        sp.cell_set_value('Sheet1!A1', 10)
+        for address in addresses:
+            sp.cell_evaluate(address)
+        sp.cell_set_value('Sheet1!A1', 1)
+        for address in addresses:
+            sp.cell_evaluate(address)
+    evaluate() # closures are built on first evaluation
+    evaluate_time = timeit.timeit(evaluate, number = repeat) / repeat
+
+    print('%s backend: load %.4fs, evaluate %.4fs' % (backend, load_time, evaluate_time))
@@ -70,6 +70,9 @@ class Cell(CellBase):
 
         self.__value = value
         self.python_expression = None
+        self.formula_template = None # FormulaTemplate shared by the cells of a shared formula
+        self.closure = None # python_expression compiled by the closure backend
+        self.reset_generation = 0 # generation of the last Spreadsheet.reset_cells sweep that reached the cell
         if (formula is not None) or is_range:
             self.need_update = True
         else:
@@ -101,6 +104,7 @@ class Cell(CellBase):
             self.__value.values = new_value
         else:
             self.__value = new_value
+            self.value_changed()
 
     @property
     def range(self):
@@ -137,6 +141,7 @@ class Cell(CellBase):
     def formula(self, new_formula):
         # maybe some kind of check is necessary
         self.__formula = new_formula
+        self.formula_template = None
 
     @property
     def id(self):
@@ -154,12 +159,13 @@ class Cell(CellBase):
     def compiled_expression(self, ce):
         self.__compiled_expression = ce
 
-    # code objects are not serializable
+    # code objects and closures are not serializable
     def __getstate__(self):
         d = dict(self.__dict__)
         f = '__compiled_expression'
         if f in d:
             del d[f]
+        d['closure'] = None
         return d
 
     def __setstate__(self, d):
@@ -181,6 +187,7 @@ class Cell(CellBase):
         return (self.__sheet, self.__col, self.__row, self.__col_idx)
 
     def compile(self):
+        self.closure = None # python_expression might have changed
         if not self.python_expression:
             return
 
@@ -2,4 +2,10 @@
 
 
 class CellBase(object):
-    pass
+    # range name -> version of the Ranges holding the cell, see RangeCore.version
+    range_versions = None
+
+    def value_changed(self):
+        if self.range_versions:
+            for version in self.range_versions.values():
+                version[0] += 1
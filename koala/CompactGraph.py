@@ -0,0 +1,195 @@
+# cython: profile=True
+
+from __future__ import absolute_import
+
+from array import array
+from itertools import chain
+
+import numpy as np
+import networkx
+
+
+class CompactGraph(object):
+    """
+    Dependency graph offering the part of the networkx.DiGraph interface used by Spreadsheet.
+
+    Nodes are numbered with dense integer ids and successors/predecessors are stored in CSR form:
+    an array of offsets per node and an array of neighbour ids, sorted for each node.
+
+    Until the graph is first read, edges are only recorded as pairs of ids, so that it can be built edge by edge
+    (see graph_from_seeds) without adjacency lists. Edges added afterwards are kept in adjacency lists until
+    compact() is called.
+    """
+
+    def __init__(self, nodes = [], edges = []):
+        self.__nodes = [] # id -> node
+        self.__ids = {} # node -> id
+        self.__succ = (np.zeros(1, dtype = np.int64), np.zeros(0, dtype = np.int32)) # (offsets, ids)
+        self.__pred = (np.zeros(1, dtype = np.int64), np.zeros(0, dtype = np.int32))
+        self.__extra_succ = {} # id -> list of ids, for edges added after construction
+        self.__extra_pred = {}
+        self.__extra_edges = set()
+        self.__nb_edges = 0
+        self.__pending = (array('l'), array('l')) # (sources, targets) of the edges not built yet, None once read
+
+        self.add_nodes_from(nodes)
+        self.add_edges_from(edges)
+
+    @staticmethod
+    def from_networkx(G):
+        return CompactGraph(G.nodes(), G.edges())
+
+    def to_networkx(self):
+        G = networkx.DiGraph()
+        G.add_nodes_from(self.__nodes)
+        G.add_edges_from(self.edges())
+        return G
+
+    def __flush(self):
+        # builds the CSR arrays from the recorded edges, when the graph is read for the first time
+        if self.__pending is not None:
+            sources, targets = self.__pending
+            self.__pending = None
+            self.__build(np.array(sources, dtype = np.int64), np.array(targets, dtype = np.int64))
+
+    def __build(self, sources, targets):
+        size = len(self.__nodes)
+
+        # remove duplicate edges
+        keys = np.unique(sources * size + targets)
+        sources = keys // size if size else keys
+        targets = keys % size if size else keys
+
+        self.__succ = self.__csr(sources, targets, size)
+        self.__pred = self.__csr(targets, sources, size)
+        self.__extra_succ = {}
+        self.__extra_pred = {}
+        self.__extra_edges = set()
+        self.__nb_edges = len(keys)
+
+    @staticmethod
+    def __csr(rows, cols, size):
+        order = np.lexsort((cols, rows))
+        offsets = np.zeros(size + 1, dtype = np.int64)
+        np.cumsum(np.bincount(rows, minlength = size), out = offsets[1:])
+        return (offsets, cols[order].astype(np.int32))
+
+    def compact(self):
+        """
+        Moves the edges added since construction to the CSR arrays.
+        """
+        self.__flush()
+        if self.__extra_edges:
+            edges = np.array(self.__edge_ids(), dtype = np.int64).reshape(-1, 2)
+            self.__build(edges[:, 0], edges[:, 1])
+
+    @staticmethod
+    def __neighbour_ids(csr, extra, i):
+        offsets, ids = csr
+        if i + 1 < len(offsets):
+            result = ids[offsets[i]:offsets[i + 1]] # a view, not a copy
+        else: # node added after construction
+            result = ids[:0]
+        if i in extra:
+            return chain(result, extra[i])
+        return result
+
+    def successor_ids(self, i):
+        """
+        :return: array of the ids of the successors, or iterator if edges were added to the node since construction
+        """
+        self.__flush()
+        return CompactGraph.__neighbour_ids(self.__succ, self.__extra_succ, i)
+
+    def predecessor_ids(self, i):
+        self.__flush()
+        return CompactGraph.__neighbour_ids(self.__pred, self.__extra_pred, i)
+
+    def successors(self, n):
+        nodes = self.__nodes
+        return (nodes[j] for j in self.successor_ids(self.__ids[n]))
+
+    def predecessors(self, n):
+        nodes = self.__nodes
+        return (nodes[j] for j in self.predecessor_ids(self.__ids[n]))
+
+    def node_id(self, n):
+        return self.__ids[n]
+
+    def node(self, i):
+        return self.__nodes[i]
+
+    def add_node(self, n, **attr):
+        # attributes are not stored, they are not used on Spreadsheet graphs
+        if n not in self.__ids:
+            self.__ids[n] = len(self.__nodes)
+            self.__nodes.append(n)
+
+    def add_nodes_from(self, nodes):
+        for n in nodes:
+            self.add_node(n)
+
+    def add_edge(self, u, v):
+        self.add_node(u)
+        self.add_node(v)
+        i = self.__ids[u]
+        j = self.__ids[v]
+
+        if self.__pending is not None: # duplicates are removed when building
+            self.__pending[0].append(i)
+            self.__pending[1].append(j)
+        elif not self.__has_edge_ids(i, j):
+            self.__extra_succ.setdefault(i, []).append(j)
+            self.__extra_pred.setdefault(j, []).append(i)
+            self.__extra_edges.add((i, j))
+            self.__nb_edges += 1
+
+    def add_edges_from(self, edges):
+        for u, v in edges:
+            self.add_edge(u, v)
+
+    def __has_edge_ids(self, i, j):
+        if (i, j) in self.__extra_edges:
+            return True
+        offsets, ids = self.__succ
+        if i + 1 >= len(offsets):
+            return False
+        start, end = offsets[i], offsets[i + 1]
+        k = start + np.searchsorted(ids[start:end], j)
+        return k < end and ids[k] == j
+
+    def has_edge(self, u, v):
+        self.__flush()
+        return u in self.__ids and v in self.__ids and self.__has_edge_ids(self.__ids[u], self.__ids[v])
+
+    def has_node(self, n):
+        return n in self.__ids
+
+    def __edge_ids(self):
+        offsets, ids = self.__succ
+        sources = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        return list(zip(sources.tolist(), ids.tolist())) + list(self.__extra_edges)
+
+    def nodes(self):
+        return list(self.__nodes)
+
+    def edges(self):
+        self.__flush()
+        nodes = self.__nodes
+        return [(nodes[i], nodes[j]) for i, j in self.__edge_ids()]
+
+    def number_of_nodes(self):
+        return len(self.__nodes)
+
+    def number_of_edges(self):
+        self.__flush()
+        return self.__nb_edges
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def __iter__(self):
+        return iter(self.__nodes)
+
+    def __contains__(self, n):
+        return n in self.__ids
@@ -1,5 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
+import collections
+import itertools
+import numbers
+
+import numpy as np
+
 from koala.CellBase import CellBase
 from koala.ExcelError import ErrorCodes, ExcelError
 from koala.utils import *
@@ -73,7 +79,139 @@ def check_value(a):
             return 0
 
 
+# kinds of values, see RangeCore.as_array
+EMPTY, NUMBER, BOOLEAN, TEXT, OTHER = range(5)
+
+
+def value_kind(value):
+    if value is None:
+        return EMPTY
+    elif isinstance(value, bool):
+        return BOOLEAN
+    elif isinstance(value, numbers.Number):
+        return NUMBER
+    elif isinstance(value, (unicode, str)):
+        return TEXT
+    else:  # ExcelErrors, dates...
+        return OTHER
+
+
+class Values(list):
+    """
+    Values of a Range, shared by the readers inside RangeCore (values_at, criteria_mask...) until they change, so they
+    can't be modified. Range.values returns a copy.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Values of a Range can\'t be modified, set Range.values instead')
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (Values, (list(self),))
+
+
+ViewCacheInfo = collections.namedtuple('ViewCacheInfo', ['hits', 'misses'])
+LookupKeys = collections.namedtuple('LookupKeys', ['keys', 'positions', 'ascending', 'descending'])
+
+
+class GroupIndex(object):
+    """
+    Rows of Ranges grouped by their values, so that the *IFS functions find the rows matching criteria which compare
+    values for equality without going through the Ranges.
+    """
+
+    def __init__(self, ranges):
+        columns = [range.values for range in ranges]
+        self.length = min(len(column) for column in columns)  # the Ranges are compared on their common length
+
+        self.representatives = []  # for each Range, a value of each class of identical values
+        classes = []
+        for column in columns:
+            ids = {}
+            representatives = []
+            for value in column[:self.length]:
+                key = (type(value), value)
+                if key not in ids:
+                    ids[key] = len(representatives)
+                    representatives.append(value)
+            self.representatives.append(representatives)
+            classes.append([ids[(type(value), value)] for value in column[:self.length]])
+
+        self.groups = {}  # tuple of classes -> rows
+        for row, key in enumerate(zip(*classes)):
+            self.groups.setdefault(key, []).append(row)
+
+        self.__numbers = [None] * len(ranges)
+        self.__texts = [None] * len(ranges)
+
+    def __by_number(self, column):
+        # float(value) -> classes, like the checks of criteria_parser for numbers
+        if self.__numbers[column] is None:
+            self.__numbers[column] = {}
+            for index, value in enumerate(self.representatives[column]):
+                try:
+                    self.__numbers[column].setdefault(float(value), []).append(index)
+                except:
+                    pass
+        return self.__numbers[column]
+
+    def __by_text(self, column):
+        # criteria_text(value) -> classes, like the checks of criteria_parser for text
+        if self.__texts[column] is None:
+            self.__texts[column] = {}
+            for index, value in enumerate(self.representatives[column]):
+                self.__texts[column].setdefault(criteria_text(value), []).append(index)
+        return self.__texts[column]
+
+    def classes(self, column, criteria):
+        """
+        Classes of the values of a Range matching criteria, see criteria_parser.
+
+        :return: list of classes, None if criteria doesn't compare values for equality
+        """
+        check = criteria_parser(criteria)
+        if check.number is not None:
+            return self.__by_number(column).get(check.number, [])
+        elif check.operator not in ('', '='):
+            return None
+        elif isinstance(check.value, float):
+            representatives = self.representatives[column]
+            return [index for index in self.__by_number(column).get(check.value, []) if representatives[index] == check.value]
+        elif check.pattern is not None:
+            return [index for index, value in enumerate(self.representatives[column]) if check(value)]
+        else:
+            return self.__by_text(column).get(check.value, [])
+
+    def rows(self, criteria):
+        """
+        :param criteria: a criteria for each Range
+        :return: sorted list of the rows matching all criteria, None if one of them doesn't compare values for equality
+        """
+        classes = []
+        for column, criterion in enumerate(criteria):
+            matching = self.classes(column, criterion)
+            if matching is None:
+                return None
+            classes.append(matching)
+
+        if np.prod([len(matching) for matching in classes]) <= len(self.groups):
+            keys = [key for key in itertools.product(*classes) if key in self.groups]
+        else:
+            classes = [set(matching) for matching in classes]
+            keys = [key for key in self.groups if all(index in matching for index, matching in zip(key, classes))]
+
+        if len(keys) == 1:
+            return self.groups[keys[0]]
+        else:
+            return sorted(itertools.chain(*[self.groups[key] for key in keys]))
+
+
 class RangeCore(dict):
+    view_hits = 0
+    view_misses = 0
+    bounded_views = 16  # views kept per Range for each kind of argument, see __view
 
     def __init__(
             self, reference,
@@ -102,6 +240,11 @@ class RangeCore(dict):
         self.__type = None
         self.__sheet = None
         self.__empty = None
+        self.__version = [0]
+        self.__version_key = None
+        self.__storage = None
+        self.__cell_list = None
+        self.__positions = None
 
         if not is_pointer:
             self.__build(
@@ -127,7 +270,12 @@ class RangeCore(dict):
 
         origin = parse_cell_address(cells[0]) if len(cells) > 0 else None  # origin of Range
 
-        if cellmap:
+        keys = None
+        if isinstance(cells, RangeAddresses):  # (row, col) are given along with the addresses
+            items = cells.select(cellmap) if cellmap else list(cells.items())
+            cells = [address for address, _ in items]
+            keys = [key for _, key in items]
+        elif cellmap:
             cells = [cell for cell in cells if cell in cellmap]
 
         if values:
@@ -142,7 +290,7 @@ class RangeCore(dict):
         empty = True
 
         for index, cell in enumerate(cells):
-            row, col = parse_cell_address(cell)
+            row, col = keys[index] if keys is not None else parse_cell_address(cell)
             order.append((row, col))
             try:
                 if cellmap:
@@ -178,6 +326,14 @@ class RangeCore(dict):
         self.__nrows = nrows
         self.__ncols = ncols
         self.__empty = empty
+        if cellmap:
+            self.__version_key = '%s:%s' % (cells[0], cells[-1]) if type(reference) == list and cells else self.__name
+            self.__version = RangeCore.__watch(self.__version_key, [cell for _, cell in result])
+        else:
+            self.__version = [0]
+        self.__storage = None
+        self.__cell_list = None
+        self.__positions = None
 
         if ncols == 1 and nrows == 1:
             self.__type = 'scalar'
@@ -199,6 +355,50 @@ class RangeCore(dict):
             cellmap=self.__cellmap,
             nrows=nrows, ncols=ncols, name=name, debug=debug)
 
+    def append(self, items):
+        """
+        Adds cells of the cellmap at the end of the Range, without building it again, e.g. the new rows of A:A.
+
+        :param items: list of (address, (row, col)), following the order of the Range
+        """
+        cells = [self.__cellmap[address] for address, _ in items]
+        if not cells:
+            return
+
+        # new lists, the Ranges built by __like share the ones of self
+        self.__addresses = self.__addresses + [address for address, _ in items]
+        self.__order = self.__order + [key for _, key in items]
+        positions = None if self.__positions is None else dict(self.__positions)
+        for index, ((_, key), cell) in enumerate(zip(items, cells), len(self.__order) - len(items)):
+            self[key] = cell
+            if positions is not None:
+                positions.setdefault(key, index)
+            self.__empty = self.__empty and cell.value is None
+        self.__positions = positions
+
+        if self.__origin is None:
+            self.__origin = items[0][1]
+            self.__sheet = items[0][0].split('!')[0]
+        self.__length = len(self.__addresses)
+        self.__cell_list = None
+
+        # the new cells share the version of the others
+        version = self.__version
+        if version is not None:
+            for cell in cells:
+                if not isinstance(cell, CellBase):
+                    version = None
+                    break
+                if cell.range_versions is None:
+                    cell.range_versions = {}
+                if cell.range_versions.setdefault(self.__version_key, version) is not version:
+                    version = None
+                    break
+            if version is not None:
+                version[0] += 1
+            self.__version = version
+        self.__storage = None
+
     @property
     def reference(self):
         return self.__reference
@@ -223,6 +423,19 @@ class RangeCore(dict):
     def length(self):
         return self.__length
 
+    def position(self, key):
+        """
+        Index of a cell in the Range.
+
+        :param key: (row, col) tuple
+        :return: index in order and addresses, None if the cell isn't in the Range
+        """
+        if self.__positions is None:
+            self.__positions = {}
+            for index, order in enumerate(self.__order):
+                self.__positions.setdefault(order, index)
+        return self.__positions.get(key)
+
     @property
     def is_pointer(self):
         return self.__pointer
@@ -248,32 +461,130 @@ class RangeCore(dict):
         return self.__sheet
 
     @property
-    def values(self):
+    def version(self):
+        # changes whenever a value of the Range changes, None when it can't be tracked
+        return self.__version[0] if self.__version is not None else None
+
+    @staticmethod
+    def __watch(key, cells):
+        # Ranges of the same name share a version, incremented by the cells when their value changes. The key is a
+        # short string, as it is hashed for each cell.
+        version = None
+        for cell in cells:
+            if cell is not None and cell.range_versions and key in cell.range_versions:
+                version = cell.range_versions[key]
+                break
+        if version is None:
+            version = [0]
+
+        for cell in cells:
+            if not isinstance(cell, CellBase):
+                return None
+            if cell.range_versions is None:
+                cell.range_versions = {}
+            if cell.range_versions.setdefault(key, version) is not version:
+                return None  # cells shared by several cellmaps
+
+        return version
+
+    def __view(self, key, build, bounded=False):
+        # views of the values (values, NumPy arrays, slices...), kept until the version changes
+        version = self.version
+        if self.__storage is None or version is None or self.__storage[0] != version:
+            self.__storage = (version, {})
+
+        views = self.__storage[1]
+        if bounded:
+            # one view per argument (criteria, indexes...), only the last used ones are kept
+            views = views.setdefault(key[0], collections.OrderedDict())
+        if key in views:
+            RangeCore.view_hits += 1
+            view = views[key]
+            if bounded:
+                del views[key]
+                views[key] = view
+            return view
+
+        RangeCore.view_misses += 1
+        view = views[key] = build()
+        if bounded and len(views) > RangeCore.bounded_views:
+            views.popitem(last = False)
+        return view
+
+    @staticmethod
+    def cache_info():
+        """Hits and misses of the views cached by the Ranges"""
+        return ViewCacheInfo(RangeCore.view_hits, RangeCore.view_misses)
+
+    @staticmethod
+    def cache_clear():
+        RangeCore.view_hits = 0
+        RangeCore.view_misses = 0
+
+    def __values(self):
+        # shared Values, cached until they change
         if self.__cellmap:
-            return [cell.value for cell in self.cells]
+            return self.__view('values', lambda: Values(cell.value for cell in self.__cells()))
         else:
-            return self.cells
+            return self.__cells()
+
+    @property
+    def values(self):
+        # a list the caller can modify, RangeCore reads the shared Values
+        return list(self.__values())
+
+    def values_at(self, indexes):
+        """
+        Values at indexes, without copying all the values.
+
+        :param indexes: indexes in values, those out of the Range being ignored
+        """
+        values = self.__values()
+        return [values[index] for index in indexes if index < len(values)]
+
+    def as_array(self):
+        """
+        Values of the Range as NumPy arrays, cached until one of them changes.
+
+        :return: (numbers, kinds), numbers holding the numeric values (0 for the others) and kinds the kind of each value (EMPTY, NUMBER, BOOLEAN, TEXT or OTHER)
+        """
+        def build():
+            values = self.__values()
+            kinds = np.array([value_kind(value) for value in values], dtype = np.int8)
+            return (np.array([value if kind == NUMBER else 0 for value, kind in zip(values, kinds)]), kinds)
+
+        return self.__view('array', build)
 
     @values.setter
     def values(self, new_values):
         if self.__cellmap:
-            for index, cell in enumerate(self.cells):
+            for index, cell in enumerate(self.__cells()):
                 if index < len(new_values):
                     cell.value = new_values[index]
         else:
             for index, value in enumerate(self.order):
                 if index < len(new_values):
                     self[value] = new_values[index]
+            self.__version[0] += 1
+
+    def __cells(self):
+        # shared list, not to be modified
+        if self.__cellmap:  # Cells don't change along with their values
+            if self.__cell_list is None:
+                self.__cell_list = [self[c] for c in self.order]
+            return self.__cell_list
+        else:
+            return self.__view('cells', lambda: Values(self[c] for c in self.order))
 
     @property
     def cells(self):
-        return [self[c] for c in self.order]
+        return list(self.__cells())
 
     def get(self, row, col=None):
         nr = self.nrows
         nc = self.ncols
 
-        values = self.values
+        values = self.__values()
         cells = self.addresses
 
         if nr == 1 or nc == 1:  # 1-dim range
@@ -284,59 +595,63 @@ class RangeCore(dict):
                 return values[row - 1]
 
         else:  # could be optimised
-            origin_col = col2num(self.origin[1])
-            origin_row = self.origin[0]
+            if row == 0 or col == 0:  # get column or row
+                return self.__view(('get', row, col), lambda: self.__slice(row, col))
 
-            if row == 0:  # get column
+            else:
+                base_col_number = col2num(cells[0][0])
+                new_ref = num2col(col + base_col_number - 1) + str(row)
+                new_value = values[(row - 1) * nc + (col - 1)]
 
-                out_col = num2col(int(col2num(self.origin[1]) + col - 1))
+                return new_value
 
-                tuples = [
-                    (r, out_col)
-                    for r in range(origin_row, origin_row + self.nrows)
-                ]
+    def __slice(self, row, col):
+        origin_col = col2num(self.origin[1])
+        origin_row = self.origin[0]
 
-                cells = []
-                values = []
+        if row == 0:  # get column
 
-                for t in tuples:
-                    if t in self:
-                        values.append(self[t].value)
-                    else:
-                        values.append(None)
-                    cells.append(get_cell_address(self.sheet, t))
+            out_col = num2col(int(col2num(self.origin[1]) + col - 1))
 
-                return RangeCore(
-                    cells, values=values, nrows=len(cells), ncols=1)
+            tuples = [
+                (r, out_col)
+                for r in range(origin_row, origin_row + self.nrows)
+            ]
 
-            elif col == 0:  # get row
+            cells = []
+            values = []
 
-                out_row = self.origin[0] + row - 1
+            for t in tuples:
+                if t in self:
+                    values.append(self[t].value)
+                else:
+                    values.append(None)
+                cells.append(get_cell_address(self.sheet, t))
 
-                tuples = [
-                    (out_row, c)
-                    for c in range(origin_col, origin_col + self.ncols)
-                ]
+            return RangeCore(
+                cells, values=values, nrows=len(cells), ncols=1)
 
-                cells = []
-                values = []
+        else:  # get row
 
-                for t in tuples:
-                    if t in self:
-                        values.append(self[t].value)
-                    else:
-                        values.append(None)
-                    cells.append(get_cell_address(self.sheet, t))
+            out_row = self.origin[0] + row - 1
 
-                return RangeCore(
-                    cells, values=values, nrows=1, ncols=len(cells))
+            tuples = [
+                (out_row, c)
+                for c in range(origin_col, origin_col + self.ncols)
+            ]
 
-            else:
-                base_col_number = col2num(cells[0][0])
-                new_ref = num2col(col + base_col_number - 1) + str(row)
-                new_value = values[(row - 1) * nc + (col - 1)]
+            cells = []
+            values = []
 
-                return new_value
+            for t in tuples:
+                if t in self:
+                    values.append(self[t].value)
+                else:
+                    values.append(None)
+                cells.append(get_cell_address(self.sheet, t))
+
+            return RangeCore(
+                cells, values=values, nrows=1, ncols=len(cells))
 
     @staticmethod
     def filter(range, bool_range):
@@ -344,11 +659,21 @@ class RangeCore(dict):
         if range.type == 'bidimensional':
             raise Exception('Cant use filter on bidimensional Ranges')
 
+        if bool_range.version is None:
+            return RangeCore.__filter(range, bool_range)
+
+        # bool_range is kept along with the view, so that its id isn't reused
+        key = ('filter', id(bool_range), bool_range.version)
+        return range.__view(key, lambda: (bool_range, RangeCore.__filter(range, bool_range)), bounded = True)[1]
+
+    @staticmethod
+    def __filter(range, bool_range):
         filtered_addresses = []
         filtered_values = []
+        test_values = bool_range.__values()
 
-        for index, value in enumerate(range.values):
-            test_value = bool_range.values[index]
+        for index, value in enumerate(range.__values()):
+            test_value = test_values[index]
 
             if type(test_value) != bool:
                 raise Exception(
@@ -369,6 +694,130 @@ class RangeCore(dict):
         return RangeCore(
             filtered_addresses, filtered_values, nrows=nrows, ncols=ncols)
 
+    def subset(self, indexes):
+        """
+        Range of the values at indexes, cached until the values change.
+
+        :param indexes: sorted list of indexes, those out of the Range being ignored
+        """
+        def build():
+            values = self.__values()
+            kept = [index for index in indexes if index < len(values)]
+            return RangeCore([self.addresses[index] for index in kept], [values[index] for index in kept])
+
+        return self.__view(('subset', tuple(indexes)), build, bounded = True)
+
+    def lookup_index(self, key=None):
+        """
+        Index of the values for exact lookups, cached until the values change.
+
+        :param key: (optional) function normalizing the values, those it normalizes to None being left out of the
+                    index and of the positions
+        :return: dict of normalized value -> position of its first occurrence
+        """
+        def build():
+            index = {}
+            position = 0
+            for value in self.__values():
+                if key is not None:
+                    value = key(value)
+                    if value is None:
+                        continue
+                if value not in index:
+                    index[value] = position
+                position += 1
+            return index
+
+        return self.__view(('lookup', key), build)
+
+    def lookup_keys(self, key):
+        """
+        Keys of the values for approximate lookups, cached until the values change.
+
+        :param key: function normalizing the values into comparable keys, those it normalizes to None being left out
+        :return: LookupKeys of the keys, their positions in values, and whether they are sorted ascending or descending
+        """
+        def build():
+            keys = []
+            positions = []
+            for position, value in enumerate(self.__values()):
+                value = key(value)
+                if value is not None:
+                    keys.append(value)
+                    positions.append(position)
+
+            pairs = list(zip(keys, keys[1:]))
+            return LookupKeys(
+                keys, positions,
+                all(previous <= next for previous, next in pairs),
+                all(previous >= next for previous, next in pairs))
+
+        return self.__view(('lookup keys', key), build)
+
+    def __texts(self):
+        # lowercase text values, '' for the others
+        def build():
+            kinds = self.as_array()[1]
+            return np.array([str(value).lower() if kind == TEXT else '' for value, kind in zip(self.__values(), kinds)], dtype = object)
+
+        return self.__view('texts', build)
+
+    @staticmethod
+    def group_index(ranges):
+        """
+        GroupIndex of Ranges, cached until one of them changes. It is only built when the Ranges are used again with
+        the same values, a single lookup being cheaper with criteria_mask.
+
+        :return: GroupIndex, None when it isn't built
+        """
+        versions = tuple(range.version for range in ranges)
+        if None in versions:
+            return None
+
+        # the Ranges are kept along with the GroupIndex, so that their ids aren't reused
+        group = ranges[0].__view(('group', tuple(id(range) for range in ranges[1:])), lambda: [None, None, None])
+        if group[1] != versions:
+            group[:] = [ranges, versions, None]
+        elif group[2] is None:
+            try:
+                group[2] = GroupIndex(ranges)
+            except TypeError:  # unhashable values
+                group[2] = False
+
+        return group[2] or None
+
+    def criteria_mask(self, criteria):
+        """
+        Values matching criteria, see criteria_parser, cached until the values change.
+
+        :return: NumPy array of booleans
+        """
+        check = criteria_parser(criteria)
+
+        def build():
+            numbers, kinds = self.as_array()
+            mask = np.zeros(len(kinds), dtype = bool)
+            todo = np.ones(len(kinds), dtype = bool)
+
+            selected = kinds == NUMBER
+            matched = check.numbers_mask(numbers[selected])
+            if matched is not None:
+                mask[selected] = matched
+                todo &= ~selected
+            if check.on_texts:
+                selected = kinds == TEXT
+                mask[selected] = check.texts_mask(self.__texts()[selected])
+                todo &= ~selected
+
+            # other values are checked one by one
+            values = self.__values()
+            for index in np.flatnonzero(todo):
+                mask[index] = check(values[index])
+
+            return mask
+
+        return self.__view(('criteria', criteria), build, bounded = True)
+
     @staticmethod
     def find_associated_cell(ref, range):
         # This function retrieves the cell associated to ref in a Range
@@ -381,37 +830,19 @@ class RangeCore(dict):
             if (range.length) == 0:  # if a Range is empty, it means normally that all its cells are empty
                 return None
             elif range.type == "vertical":
-                if (row, range.origin[1]) in range.order:
-                    return range.addresses[
-                        range.order.index((row, range.origin[1]))
-                    ]
-                else:
-                    return None
+                index = range.position((row, range.origin[1]))
             elif range.type == "horizontal":
-                if (range.origin[0], col) in range.order:
-                    return range.addresses[
-                        range.order.index((range.origin[0], col))
-                    ]
-                else:
-                    return None
+                index = range.position((range.origin[0], col))
             elif range.type == "scalar":
-                if (row, range.origin[1]) in range.order:
-                    return range.addresses[
-                        range.order.index((row, range.origin[1]))
-                    ]
-                elif (range.origin[0], col) in range.order:
-                    return range.addresses[
-                        range.order.index((range.origin[0], col))
-                    ]
-                elif (row, col) in range.order:
-                    return range.addresses[
-                        range.order.index((row, col))
-                    ]
-                else:
-                    return None
-
+                index = range.position((row, range.origin[1]))
+                if index is None:
+                    index = range.position((range.origin[0], col))
+                if index is None:
+                    index = range.position((row, col))
             else:
                 return None
+
+            return range.addresses[index] if index is not None else None
         else:
             return None
 
@@ -499,6 +930,10 @@ class RangeCore(dict):
 
         function = func_dict[func]
 
+        vectorized = RangeCore.__apply_vector(func, first, second)
+        if vectorized is not None:
+            return vectorized
+
         # Here, the first arg of RangeCore() has little importance: TBC
         if isinstance(first, RangeCore) and isinstance(second, RangeCore):
             if first.length != second.length:
@@ -533,6 +968,64 @@ class RangeCore(dict):
         else:
             return function(first, second)
 
+    @staticmethod
+    def __apply_vector(func, first, second):
+        # apply_all on NumPy arrays, when the Ranges only hold numbers and empty cells, None otherwise
+        if func not in vector_func_dict:
+            return None
+
+        operands = []
+        template = None
+        for operand in (first, second):
+            if isinstance(operand, RangeCore):
+                values, kinds = operand.as_array()
+                if template is not None and template.length != operand.length or ((kinds != NUMBER) & (kinds != EMPTY)).any():
+                    return None
+                if template is None:
+                    template = operand
+                # floats stay floats, other numbers are computed as python numbers, like check_value gives them
+                operands.append(values if values.dtype.kind == 'f' else values.astype(object))
+            elif operand is None:
+                operands.append(0)
+            elif isinstance(operand, numbers.Number) and not isinstance(operand, bool):
+                operands.append(operand)
+            else:
+                return None
+
+        if template is None:
+            return None
+        if func == 'divide':
+            operands = [np.asarray(operand, dtype = float) for operand in operands]
+            if (operands[1] == 0).any():  # #DIV/0!
+                return None
+
+        result = vector_func_dict[func](*operands)
+        if np.shape(result) != (template.length,):  # minus of a number
+            return None
+        if result.dtype.kind == 'b' or func.startswith('is_'):
+            result = result.astype(bool)
+            kinds = np.full(len(result), BOOLEAN, dtype = np.int8)
+            return template.__like(result.tolist(), (np.zeros(len(result), dtype = int), kinds))
+        else:
+            kinds = np.full(len(result), NUMBER, dtype = np.int8)
+            return template.__like(result.tolist(), (result, kinds))
+
+    def __like(self, values, array):
+        # Range of the cells of self holding values, without parsing the addresses again, like RangeCore(self.addresses, values)
+        result = RangeCore.__new__(RangeCore)
+        result.__dict__.update(self.__dict__)
+        result.__reference = self.addresses
+        result.__cellmap = None
+        result.__name = None
+        result.__pointer = False
+        result.__empty = False
+        result.__version = [0]
+        result.__storage = None
+        result.__cell_list = None
+        dict.__init__(result, zip(self.order, values))
+        result.__view('array', lambda: array)
+        return result
+
     @staticmethod
     def add(a, b):
         try:
@@ -639,6 +1132,20 @@ class RangeCore(dict):
         except Exception as e:
             return ExcelError('#N/A', e)
 
+# operators of func_dict for numbers held in NumPy arrays, see RangeCore.apply_all
+vector_func_dict = {
+    "multiply": np.multiply,
+    "divide": np.true_divide,
+    "add": np.add,
+    "substract": np.subtract,
+    "minus": lambda a, b: np.negative(a),
+    "is_equal": lambda a, b: np.abs(np.asarray(a, dtype = float) - np.asarray(b, dtype = float)) <= 0.00001,
+    "is_strictly_superior": np.greater,
+    "is_strictly_inferior": np.less,
+    "is_superior_or_equal": lambda a, b: np.greater(a, b) | (np.abs(np.asarray(a, dtype = float) - np.asarray(b, dtype = float)) <= 0.0001),
+    "is_inferior_or_equal": lambda a, b: np.less(a, b) | (np.abs(np.asarray(a, dtype = float) - np.asarray(b, dtype = float)) <= 0.0001),
+}
+
 func_dict = {
     "multiply": RangeCore.multiply,
     "divide": RangeCore.divide,
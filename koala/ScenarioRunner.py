@@ -0,0 +1,153 @@
+from __future__ import absolute_import
+
+import os
+import multiprocessing
+
+from koala.codegen import dynamic_cells
+from koala.ExcelError import ExcelError
+
+
+class ScenarioRunner(object):
+    """
+    Evaluates a Spreadsheet for many scenarios (dicts {address: value} of inputs) in worker processes.
+
+    Workers are forked from the current process, so they share the loaded Spreadsheet copy-on-write instead of
+    receiving a copy of it. Scenarios are sent in chunks, and every chunk starts from the state the Spreadsheet
+    had when the runner was created. Without fork (e.g. on Windows) or with a single worker, scenarios are
+    evaluated in the current process, the Spreadsheet being restored afterwards.
+    """
+
+    def __init__(self, spreadsheet, workers=None, chunksize=64):
+        """
+        :param spreadsheet: a Spreadsheet, with its inputs set to their baseline values
+        :param workers: number of processes, defaults to the number of CPUs
+        :param chunksize: number of scenarios sent at once to a worker
+        """
+        self.spreadsheet = spreadsheet
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunksize = chunksize
+
+    def run(self, scenarios, outputs=None, ordered=True):
+        """
+        Evaluate outputs for each scenario.
+
+        Scenarios in which an output raises get an ExcelError('#VALUE!') for it.
+
+        :param scenarios: iterable of dicts {address: value}
+        :param outputs: list of addresses, defaults to the outputs of the Spreadsheet
+        :param ordered: if False, results are given as soon as they are ready, along with the index of their scenario
+        :return: generator of dicts {address: value}, or of (index, dict) if ordered is False
+        """
+        outputs = list(self.spreadsheet.outputs if outputs is None else outputs)
+        jobs = ((start, chunk, outputs) for start, chunk in chunks(scenarios, self.chunksize))
+
+        if self.workers <= 1 or not hasattr(os, 'fork'):
+            results = self.run_serial(jobs)
+        else:
+            results = self.run_pool(jobs, ordered)
+
+        for start, chunk_results in results:
+            for index, result in enumerate(chunk_results):
+                yield result if ordered else (start + index, result)
+
+    def run_serial(self, jobs):
+        global _worker
+        _worker = ScenarioWorker(self.spreadsheet)
+        try:
+            for job in jobs:
+                yield _run_chunk(job)
+        finally:
+            _worker.restore_all()
+            _worker = None
+
+    def run_pool(self, jobs, ordered):
+        global _worker
+        # set before forking, so that workers inherit it
+        _worker = ScenarioWorker(self.spreadsheet)
+        if hasattr(multiprocessing, 'get_context'):
+            pool = multiprocessing.get_context('fork').Pool(self.workers)
+        else: # Python 2 always forks on posix
+            pool = multiprocessing.Pool(self.workers)
+
+        try:
+            for result in (pool.imap if ordered else pool.imap_unordered)(_run_chunk, jobs):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+            _worker = None
+
+
+def chunks(iterable, size):
+    chunk = []
+    start = 0
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield start, chunk
+            start += size
+            chunk = []
+    if chunk:
+        yield start, chunk
+
+
+class ScenarioWorker(object):
+    """
+    Sets the inputs of scenarios on a Spreadsheet, restoring its baseline state between them.
+    """
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        self.baseline = dict((cell, (cell.value if not cell.is_range else None, cell.need_update, cell.should_eval))
+            for cell in spreadsheet.cellmap.values())
+        self.fixed_cells = dict(spreadsheet.fixed_cells)
+        self.changed = set() # addresses set since the last restore
+        self.dynamic = {} # frozenset of addresses -> cells impacted by them
+
+    def resolve(self, address):
+        # same as cell_set_value
+        if address in self.spreadsheet.named_ranges:
+            address = self.spreadsheet.named_ranges[address]
+        return address.replace('$', '').replace("'", '')
+
+    def restore(self, addresses):
+        key = frozenset(addresses)
+        if key not in self.dynamic:
+            self.dynamic[key] = dynamic_cells(self.spreadsheet, [a for a in key if a in self.spreadsheet.cellmap])
+
+        for cell in self.dynamic[key]:
+            value, need_update, should_eval = self.baseline[cell]
+            if not cell.is_range:
+                cell.value = value
+            cell.need_update = need_update
+            cell.should_eval = should_eval
+        self.spreadsheet.fixed_cells = dict(self.fixed_cells)
+
+    def restore_all(self):
+        if self.changed:
+            self.restore(self.changed)
+            self.changed = set()
+
+    def evaluate(self, scenario, outputs):
+        addresses = set(self.resolve(address) for address in scenario)
+        if not self.changed <= addresses: # values of the previous scenario would remain
+            self.restore_all()
+
+        self.spreadsheet.set_values(scenario)
+        self.changed |= addresses
+
+        result = {}
+        for address in outputs:
+            try:
+                result[address] = self.spreadsheet.cell_evaluate(address)
+            except Exception as e:
+                result[address] = ExcelError('#VALUE!', e)
+        return result
+
+
+_worker = None
+
+def _run_chunk(job):
+    start, scenarios, outputs = job
+    _worker.restore_all()
+    return start, [_worker.evaluate(scenario, outputs) for scenario in scenarios]
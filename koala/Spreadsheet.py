@@ -4,26 +4,41 @@ from __future__ import absolute_import, print_function
 from koala.Range import get_cell_address, parse_cell_address
 
 from koala.ast import *
+from koala.CompactGraph import CompactGraph
 from koala.reader import read_archive, read_named_ranges, read_cells
 # This import equivalent functions defined in Excel.
 from koala.excellib import *
 from openpyxl.formula.translate import Translator
 from koala.serializer import *
+from koala.codegen import export_module
+from koala.closures import build_closure, branch_references, UnsupportedExpression
+from koala.batch import evaluate_batch
 from koala.tokenizer import reverse_rpn
 from koala.utils import *
 
+import itertools
 import warnings
 import os.path
+from contextlib import contextmanager
+from io import BytesIO
 import networkx
 from networkx.readwrite import json_graph
 
 from openpyxl.compat import unicode
 
+# generations of the reset sweeps, shared by all Spreadsheets as they can share their Cells
+reset_generations = itertools.count(1)
+
 
 class Spreadsheet(object):
-    def __init__(self, file=None, ignore_sheets=[], ignore_hidden=False, debug=False):
+    def __init__(self, file=None, ignore_sheets=[], ignore_hidden=False, debug=False, stream=False, workers=None, outputs=None, lazy=False, compact_graph=False, backend='string'):
         # print("___### Initializing Excel Compiler ###___")
 
+        if backend not in ('string', 'closure'):
+            raise Exception('Unknown backend %s, use string or closure' % backend)
+        self.backend = backend # how python_expressions are evaluated
+        self.compact_graph = compact_graph # G is a CompactGraph, built without networkx, see graph_from_seeds
+
         if file is None:
             # create empty version of this object
             self.cells = None  # precursor for cellmap: dict that link addresses (str) to Cell objects.
@@ -45,18 +60,22 @@ class Spreadsheet(object):
             self.range = RangeFactory(cellmap)
             self.pointer_to_remove = None
             self.pointers_to_reset = set()
-            self.reset_buffer = None
+            self.whole_ranges = {} # sheet -> range cells like A:A or 1:1, see extend_ranges
+            self.pending_resets = None # cells set inside a batch(), reset when leaving it
+            self.branch_references = {} # python_expression -> addresses only read in an IF branch, see dirty_dependencies
             self.fixed_cells = {}
         else:
             # fill in what the ExcelCompiler used to do
             super(Spreadsheet, self).__init__() # generate an empty spreadsheet
             # Decompose subfiles structure in zip file
             if hasattr(file, 'read'):   # file-like object
+                if lazy: # sheets are read later on, don't depend on the file staying open
+                    file = BytesIO(file.read())
                 archive = read_archive(file)
             else:                       # assume file path
                 archive = read_archive(os.path.abspath(file))
-            # Parse cells
-            self.cells = read_cells(archive, ignore_sheets, ignore_hidden)
+            # Parse cells, in lazy mode sheets are only read when the graph reaches them
+            self.cells = read_cells(archive, ignore_sheets, ignore_hidden, stream, workers, lazy)
             # Parse named_range { name (ExampleName) -> address (Sheet!A1:A10)}
             self.named_ranges = read_named_ranges(archive)
             self.range = RangeFactory(self.cells)
@@ -64,7 +83,11 @@ class Spreadsheet(object):
             self.debug = debug
 
             # now add the stuff what was originally done by the Spreadsheet
-            self.gen_graph()
+            if outputs:
+                sp = self.gen_graph(outputs = outputs)
+                self.build_spreadsheet(sp.G, sp.cellmap, sp.named_ranges, pointers = sp.pointers, outputs = sp.outputs, inputs = sp.inputs, debug = debug)
+            else:
+                self.gen_graph()
 
     def clean_pointer(self):
         spreadsheet = Spreadsheet()
@@ -178,7 +201,7 @@ class Spreadsheet(object):
         if inputs == [] and outputs == []:
             self.build_spreadsheet(G, cellmap, self.named_ranges, pointers = self.pointers, outputs = outputs, inputs = inputs, debug = self.debug)
         else:
-            sp = Spreadsheet()
+            sp = Spreadsheet(backend = self.backend)
             sp.build_spreadsheet(G, cellmap, self.named_ranges, pointers = self.pointers, outputs = outputs, inputs = inputs, debug = self.debug)
             return sp
     
@@ -196,6 +219,7 @@ class Spreadsheet(object):
         """
 
         self.G = G
+        self.compact_graph = isinstance(G, CompactGraph)
         self.cellmap = cellmap
         self.named_ranges = named_ranges
 
@@ -226,7 +250,9 @@ class Spreadsheet(object):
         self.pointers = pointers
         self.pointers_to_reset = pointers
         self.range = RangeFactory(cellmap)
-        self.reset_buffer = set()
+        self.whole_ranges = {}
+        self.pending_resets = None
+        self.branch_references = {}
         self.debug = debug
         self.fixed_cells = {}
 
@@ -234,6 +260,7 @@ class Spreadsheet(object):
         for cell in self.cellmap.values():
             if cell.value is None and cell.formula is not None:
                 cell.needs_update = True
+            self.index_range(cell)
 
 
     def activate_history(self):
@@ -277,7 +304,83 @@ class Spreadsheet(object):
         self.cellmap = cellmap
         self.G = G
 
-        print("Graph construction updated, %s nodes, %s edges, %s cellmap entries" % (len(G.nodes()),len(G.edges()),len(cellmap)))
+        self.extend_ranges(cell)
+
+        if self.debug: # counting the edges goes through the whole graph
+            print("Graph construction updated, %s nodes, %s edges, %s cellmap entries" % (len(G.nodes()),len(G.edges()),len(cellmap)))
+
+    def index_range(self, range_cell):
+        """
+        Keeps track of the ranges like A:A or 1:1, by sheet, for extend_ranges.
+
+        :param range_cell: a Cell of the cellmap
+        """
+        if not range_cell.is_range or range_cell.range.is_pointer or range_cell.range.name is None:
+            return
+        if not is_whole_range(range_cell.range.name):
+            return
+
+        sheet = resolve_range(range_cell.range.name, should_flatten=True)[0].sheet[:-1]
+        ranges = self.whole_ranges.setdefault(sheet, [])
+        if range_cell not in ranges:
+            ranges.append(range_cell)
+
+    def extend_ranges(self, cell):
+        """
+        Ranges like A:A or 1:1 only hold the cells of the used area of their sheet, see graph_from_seeds. Extends them
+        when a cell added to the sheet grows this area, with empty cells up to the new one.
+
+        :param cell: the Cell added to the cellmap
+        """
+        if cell.row is None:
+            return
+
+        for range_cell in self.whole_ranges.get(cell.sheet, []):
+            rng = range_cell.range
+            addresses = resolve_range(rng.name, should_flatten=True)[0]
+
+            # the Range holds a rectangle of addresses, up to its last cell
+            if rng.length:
+                last_row, last_col = rng.order[-1]
+                rows, cols = last_row - addresses.start_row + 1, col2num(last_col) - addresses.start_col + 1
+            else:
+                rows, cols = 0, 0
+            grown = addresses.clip(max(addresses.start_row + rows - 1, cell.row), max(addresses.start_col + cols - 1, col2num(cell.col)))
+            if (grown.nrows, grown.ncols) == (rows, cols):
+                continue
+
+            # the new cells come after the others, unless columns are added to several rows
+            if rows == 0:
+                new = grown
+            elif grown.ncols == cols:
+                new = RangeAddresses(grown.sheet, grown.start_row + rows, grown.start_col, grown.nrows - rows, cols)
+            elif grown.nrows == 1:
+                new = RangeAddresses(grown.sheet, grown.start_row, grown.start_col + cols, 1, grown.ncols - cols)
+            else:
+                new = None
+
+            added = []
+            for address, key in (grown if new is None else new).items():
+                if new is None and rng.position(key) is not None:
+                    continue
+                if address not in self.cellmap:
+                    empty_cell = Cell(address, cell.sheet, value="", should_eval='False')
+                    self.cellmap[address] = empty_cell
+                    self.G.add_node(empty_cell)
+                added.append(self.cellmap[address])
+
+            if new is None:
+                rng.build(reference=rng.reference)
+            else:
+                rng.append(list(new.items()))
+
+            name = range_cell.address() if range_cell.is_named_range else rng.name
+            for c in added:
+                self.G.add_edge(c, range_cell)
+                if self.addr_to_range is not None:
+                    self.addr_to_range.setdefault(c.address(), []).append(name)
+
+            self.reset_cells([range_cell])
 
     def set_formula(self, addr, formula):
         # previously set_formula was used. Capture this behaviour.
@@ -346,7 +449,7 @@ class Spreadsheet(object):
         # print "%s cells depending on inputs" % str(len(dependencies))
 
         # prune the graph and set all cell independent of input to const
-        subgraph = networkx.DiGraph()
+        subgraph = CompactGraph() if isinstance(G, CompactGraph) else networkx.DiGraph()
         new_cellmap = {}
         for output_address in self.outputs:
             new_cellmap[output_address] = self.cellmap[output_address]
@@ -393,8 +496,7 @@ class Spreadsheet(object):
                     subgraph.add_edge(const_node, current)
 
 
-        print("Graph pruning done, %s nodes, %s edges, %s cellmap entries" % (len(subgraph.nodes()),len(subgraph.edges()),len(new_cellmap)))
-        undirected = networkx.Graph(subgraph)
+        print("Graph pruning done, %s nodes, %s edges, %s cellmap entries" % (len(subgraph),subgraph.number_of_edges(),len(new_cellmap)))
         # print "Number of connected components %s", str(number_connected_components(undirected))
         # print map(lambda x: x.address(), subgraph.nodes())
 
@@ -426,7 +528,7 @@ class Spreadsheet(object):
                         subgraph.add_node(self.cellmap[i]) # edges are not needed here since the input here is not in the calculation chain
 
 
-        spreadsheet = Spreadsheet()
+        spreadsheet = Spreadsheet(backend = self.backend)
         return spreadsheet.build_spreadsheet(subgraph, new_cellmap, self.named_ranges, self.pointers, self.outputs, self.inputs, debug = self.debug)
 
     def clean_pointer(self):
@@ -663,10 +765,64 @@ class Spreadsheet(object):
     def dump(self, fname):
         dump(self, fname)
 
+    def export_module(self, fname, inputs=None, outputs=None):
+        """
+        Write a standalone Python module computing outputs from inputs, with an evaluate(inputs) function
+        taking a dict {address: value} and returning a dict {address: value}.
+
+        :param fname: path of the module
+        :param inputs: defaults to the inputs of the Spreadsheet
+        :param outputs: defaults to the outputs of the Spreadsheet
+        """
+        export_module(self, fname,
+            self.inputs if inputs is None else inputs,
+            self.outputs if outputs is None else outputs)
+
     @staticmethod
-    def load(fname):
-        spreadsheet = Spreadsheet()
-        spreadsheet.build_spreadsheet(*load(fname))
+    def load(fname, compact_graph=False, backend='string'):
+        spreadsheet = Spreadsheet(backend = backend)
+        # the closure backend builds its own code from python_expressions, when cells are evaluated
+        spreadsheet.build_spreadsheet(*load(fname, compact_graph, compile = backend == 'string'))
+        return spreadsheet
+
+    @staticmethod
+    def from_file(file, cache_dir=None, ignore_sheets=[], ignore_hidden=False, inputs=[], outputs=[], max_cache_size=CACHE_MAX_SIZE, debug=False, compact_graph=False, backend='string'):
+        """
+        Compile file into a Spreadsheet, reusing the compiled graph stored in cache_dir if the same workbook
+        was already compiled with the same options.
+
+        :param cache_dir: directory of the cache, no cache is used if None.
+        :param inputs: same as gen_graph.
+        :param outputs: same as gen_graph.
+        :param max_cache_size: size in bytes above which the least recently used entries are removed.
+        :param compact_graph: same as Spreadsheet.
+        :param backend: same as Spreadsheet.
+        """
+        def compile_file():
+            spreadsheet = Spreadsheet(file, ignore_sheets, ignore_hidden, debug, compact_graph = compact_graph, backend = backend)
+            if inputs or outputs:
+                spreadsheet = spreadsheet.gen_graph(outputs = outputs, inputs = inputs)
+            return spreadsheet
+
+        if cache_dir is None:
+            return compile_file()
+
+        key = workbook_hash(file,
+            ignore_sheets = sorted(ignore_sheets),
+            ignore_hidden = ignore_hidden,
+            inputs = sorted(inputs),
+            outputs = sorted(outputs))
+        fname = cache_path(cache_dir, key)
+
+        if os.path.exists(fname):
+            cache_touch(fname)
+            return Spreadsheet.load(fname, compact_graph, backend)
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        spreadsheet = compile_file()
+        cache_store(spreadsheet, fname)
+        cache_evict(cache_dir, max_cache_size, keep = fname)
         return spreadsheet
 
     @staticmethod
@@ -690,7 +846,7 @@ class Spreadsheet(object):
         :param address: the address of a cell
         :param value: the new value
         """
-        self.reset_buffer = set()
+        deferred = self.pending_resets is not None # inside batch(), cells are reset when leaving it
 
         if address in self.named_ranges.keys(): # if cell is named range get real address
             address = self.named_ranges[address]
@@ -710,7 +866,10 @@ class Spreadsheet(object):
                 if not isinstance(value, list):
                     value = [value] * len(cells_to_set)
 
-                self.cell_reset(cell.address())
+                if deferred:
+                    self.pending_resets.append(cell)
+                else:
+                    self.cell_reset(cell.address())
                 cell.range.values = value
 
             # case where the address refers to a single value
@@ -728,7 +887,10 @@ class Spreadsheet(object):
 
                     ref_cell.value = value
 
-                if cell.value != value:
+                if cell.value != value and deferred:
+                    cell.value = value
+                    self.pending_resets.append(cell)
+                elif cell.value != value:
                     if cell.value is None:
                         cell.value = 'notNone'  # hack to avoid the direct return in reset() when value is None
                     # reset the node + its dependencies
@@ -736,11 +898,49 @@ class Spreadsheet(object):
                     # set the value
                     cell.value = value
 
-            for vol in self.pointers_to_reset:  # reset all pointers
-                self.cell_reset(self.cellmap[vol].address())
+            if not deferred:  # reset all pointers
+                self.reset_cells([self.cellmap[vol] for vol in self.pointers_to_reset])
         except KeyError:
             raise Exception('Cell %s not in cellmap' % address)
 
+    def set_values(self, values):
+        """
+        Set the values of several cells, resetting the cells depending on them in a single pass.
+
+        :param values: dict {address: value}
+        """
+        with self.batch():
+            for address, value in values.items():
+                self.cell_set_value(address, value)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context in which cell_set_value only sets values. The cells depending on them, and the pointers, are reset
+        once when leaving it, instead of once per cell_set_value.
+
+        with sp.batch():
+            sp.cell_set_value('Sheet1!A1', 1)
+            sp.cell_set_value('Sheet1!A2', 2)
+        """
+        if self.pending_resets is not None: # nested batch
+            yield
+            return
+
+        self.pending_resets = []
+        try:
+            yield
+        finally:
+            cells, self.pending_resets = self.pending_resets, None
+
+            if cells:
+                empty = [cell for cell in cells if not cell.is_range and cell.value is None]
+                for cell in empty:
+                    cell.value = 'notNone'  # hack to avoid the direct return in reset_cells() when value is None
+                self.reset_cells(cells + [self.cellmap[vol] for vol in self.pointers_to_reset])
+                for cell in empty:
+                    cell.value = None
+
     def reset(self, depricated=None):
         """
         Resets all the cells in a spreadsheet and indicates that an update is required.
@@ -768,29 +968,35 @@ class Spreadsheet(object):
         :param address: the address of the cell to be reset.
         :return: nothing
         """
-
         if address in self.cellmap:
-            cell = self.cellmap[address]
-        else:
-            return
-        if cell.value is None and address not in self.named_ranges:
-            return
+            self.reset_cells([self.cellmap[address]])
 
-        # check if cell has to be reset
-        if cell.value is None and cell.need_update:
-            return
+    def reset_cells(self, cells):
+        """
+        Resets cells and all of their dependents in a single iterative sweep. The cells reached are stamped with the
+        generation of the sweep, so that each of them is visited once, whatever the number of paths leading to it.
 
-        # update cells
-        if cell.should_eval != 'never':
-            if not cell.is_range:
-                cell.value = None
+        :param cells: list of Cell
+        """
+        generation = next(reset_generations)
+        todo = list(cells)
 
-            self.reset_buffer.add(cell)
-            cell.need_update = True
+        while todo:
+            cell = todo.pop()
+            if cell.reset_generation == generation:
+                continue
+            cell.reset_generation = generation
 
-        for child in self.G.successors(cell):
-            if child not in self.reset_buffer:
-                self.cell_reset(child.address())
+            # empty cell, or already reset along with its dependents (the values of a range are never None)
+            if not cell.is_range and cell.value is None and (cell.need_update or cell.address() not in self.named_ranges):
+                continue
+
+            if cell.should_eval != 'never':
+                if not cell.is_range:
+                    cell.value = None
+                cell.need_update = True
+
+            todo.extend(self.G.successors(cell))
 
     def fix_cell(self, address):
         warnings.warn(
@@ -965,6 +1171,84 @@ class Spreadsheet(object):
             address = cell.address
         return self.cell_evaluate(address)
 
+    def evaluate_batch(self, inputs, outputs=None):
+        """
+        Evaluate the outputs for many values of the inputs at once, without changing the Spreadsheet.
+
+        Cells depending on the inputs hold numpy arrays of values, one per scenario. Operators and the
+        vectorizable functions work on whole arrays, the other cells are evaluated scenario by scenario.
+        Scenarios in which a cell raises get an ExcelError('#VALUE!') for it.
+
+        :param inputs: dict {address: 1 dimensional array}, all arrays having the same length
+        :param outputs: list of addresses, defaults to the outputs of the Spreadsheet
+        :return: dict {address: numpy array of values}
+        """
+        return evaluate_batch(self, inputs, self.outputs if outputs is None else outputs, globals())
+
+    def needs_evaluation(self, cell):
+        return not (cell.should_eval == 'normal' and not cell.need_update and cell.value is not None or not cell.formula or cell.should_eval == 'never')
+
+    def parents(self, cell):
+        """
+        Predecessors of cell in the graph, replacing the Ranges it only uses through implicit intersection
+        (A1:A10 in row 5 being A5) by their cell associated to it.
+
+        :param cell: a Cell of the graph
+        :return: generator of Cell
+        """
+        expression = cell.python_expression or ''
+        for parent in self.G.predecessors(cell):
+            if parent.is_range and not parent.range.is_pointer and not cell.is_range:
+                name = parent.address()
+                if "self.eval_ref('%s', ref" % name in expression and "self.eval_ref('%s')" % name not in expression:
+                    address = RangeCore.find_associated_cell((cell.row, cell.col), parent.range)
+                    if address in self.cellmap:
+                        yield self.cellmap[address]
+                        continue
+            yield parent
+
+    def dirty_dependencies(self, cell):
+        """
+        Cells that need to be evaluated before cell, in topological order (each before the cells depending on it).
+
+        Cells only read in a branch of an IF are left out, they are evaluated through eval_ref if the branch is taken.
+
+        :param cell: a Cell of the graph
+        :return: list of Cell, not including cell
+        """
+        if cell not in self.G:
+            return []
+
+        order = []
+        done = set([cell])
+        todo = [(cell, self.unconditional_parents(cell))]
+
+        # iterative depth first search, cells are added once all their parents are
+        while todo:
+            current, parents = todo[-1]
+            for parent in parents:
+                if parent not in done:
+                    done.add(parent)
+                    if self.needs_evaluation(parent):
+                        todo.append((parent, self.unconditional_parents(parent)))
+                        break
+            else:
+                todo.pop()
+                order.append(current)
+
+        return order[:-1]
+
+    def unconditional_parents(self, cell):
+        # parents of cell, without the ones its expression only reads in the branches of an IF
+        expression = cell.python_expression
+        if not expression or ' if ' not in expression:
+            return iter(self.parents(cell))
+
+        if expression not in self.branch_references:
+            self.branch_references[expression] = branch_references(expression)
+        skipped = self.branch_references[expression]
+        return (parent for parent in self.parents(cell) if parent.address() not in skipped)
+
     def cell_evaluate(self, address):
         """
         Evaluate the cell.
@@ -980,12 +1264,57 @@ class Spreadsheet(object):
             return ExcelError('#NULL', 'Cell %s is empty' % address)
 
         # no formula, fixed value
-        if cell.should_eval == 'normal' and not cell.need_update and cell.value is not None or not cell.formula or cell.should_eval == 'never':
+        if not self.needs_evaluation(cell):
             return cell.value if cell.value != '' else None
+
+        # evaluate the dependencies first, each once and in topological order, so that the eval_ref calls made by
+        # the expression find them up to date instead of recursing along the whole dependency chain
+        for dependency in self.dirty_dependencies(cell):
+            if dependency.is_range or dependency.should_eval == 'always': # evaluated when referenced anyway
+                continue
+            if not self.needs_evaluation(dependency): # already evaluated through another cell
+                continue
+            self.compute(dependency, store_errors = True)
+
+        return self.compute(cell)
+
+    def closure(self, cell):
+        """
+        Function evaluating the python_expression of the cell, for the closure backend.
+
+        Expressions that can't be turned into closures are compiled and evaluated like with the string backend.
+
+        :param cell: a Cell with a python_expression
+        :return: a function without arguments
+        """
+        try:
+            return build_closure(self, cell.python_expression, globals())
+        except UnsupportedExpression:
+            if cell.compiled_expression is None:
+                cell.compile()
+            code = cell.compiled_expression
+            return lambda: eval(code, globals(), {"self": self})
+
+    def compute(self, cell, store_errors=False):
+        """
+        Evaluate the expression of the cell, the cells it depends on being evaluated through eval_ref.
+
+        :param cell: a Cell
+        :param store_errors: if True, an ExcelError raised by the expression becomes the value of the cell
+        :return: the new value of the cell
+        """
         try:
             if cell.is_range:
                 for child in cell.range.cells:
                     self.evaluate(child.address())
+            elif self.backend == 'closure' and cell.python_expression:
+                if cell.closure is None:
+                    cell.closure = self.closure(cell)
+                vv = cell.closure()
+                if isinstance(vv, RangeCore):
+                    cell.value = vv.values[0]
+                else:
+                    cell.value = vv if vv != '' else None
             elif cell.compiled_expression != None:
                 vv = eval(cell.compiled_expression)
                 if isinstance(vv, RangeCore): # this should mean that vv is the result of RangeCore.apply_all, but with only one value inside
@@ -1024,7 +1353,10 @@ class Spreadsheet(object):
                         self.history[cell.address()] = {'new': str(cell.value)}
 
         except Exception as e:
-            if str(e).startswith("Problem evalling"):
+            if store_errors and isinstance(e, ExcelError): # like in Excel, the cells reading it get the error
+                cell.value = e
+                cell.need_update = False
+            elif str(e).startswith("Problem evalling"):
                 raise e
             else:
                 raise Exception("Problem evalling: %s for %s, %s" % (e,cell.address(),cell.python_expression))
@@ -1032,7 +1364,7 @@ class Spreadsheet(object):
         return cell.value
 
     def asdict(self):
-        data = json_graph.node_link_data(self.G)
+        data = json_graph.node_link_data(networkx_graph(self))
 
         def cell_to_dict(cell):
             if isinstance(cell.range, RangeCore):
@@ -2,12 +2,17 @@ from __future__ import absolute_import
 
 from openpyxl import *
 from .ast import *
+from .batch import *
 from .Cell import *
+from .closures import *
+from .codegen import *
+from .CompactGraph import *
 from .ExcelCompiler import *
 from .ExcelError import *
 from .excellib import *
 from .Range import *
 from .reader import *
+from .ScenarioRunner import *
 from .serializer import *
 from .Spreadsheet import *
 from .tokenizer import *
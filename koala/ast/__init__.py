@@ -2,14 +2,16 @@ from __future__ import absolute_import
 # cython: profile=True
 
 import collections
+import re
 import six
 
 import networkx
 from networkx.classes.digraph import DiGraph
 from openpyxl.compat import unicode
 
-from koala.utils import uniqueify, flatten, max_dimension, col2num, resolve_range
+from koala.utils import uniqueify, flatten, max_dimension, col2num, resolve_range, split_address, is_reference, shift_reference, shift_formula, relative_formula, formula_references
 from koala.Cell import Cell
+from koala.CompactGraph import CompactGraph
 from koala.Range import parse_cell_address
 from koala.tokenizer import ExcelParser, f_token
 from .astnodes import *
@@ -386,6 +388,210 @@ def cell2code(cell, named_ranges):
     return code,ast
 
 
+# a reference found by a FormulaTemplate, with the same attributes as a RangeNode
+Reference = collections.namedtuple('Reference', ['tvalue', 'tsubtype'])
+
+REF_PLACEHOLDER = '\x00ref\x00'
+
+
+class FormulaTemplate(object):
+    """
+    A formula compiled once in relative form, then instantiated for each cell by offset.
+
+    This is used for shared formulas: all the cells of a group (same `si` in the xlsx)
+    hold the same template. The code is generated for the anchor cell with
+    placeholders instead of its references, which are then shifted for each cell.
+    """
+    def __init__(self, formula, sheet, address):
+        self.formula = formula
+        self.sheet = sheet
+        sh, col, row = split_address(address)
+        self.row = int(row)
+        self.col = col2num(col)
+
+        self.named_ranges = None
+        self.parts = None # code split on placeholders, None if the formula can't be used as a template
+        self.references = None
+
+    def formula_at(self, address):
+        """Formula of the cell at address, as Excel would translate it"""
+        sh, col, row = split_address(address)
+        row_offset = int(row) - self.row
+        col_offset = col2num(col) - self.col
+
+        if row_offset == 0 and col_offset == 0:
+            return self.formula
+        return shift_formula(self.formula, row_offset, col_offset)
+
+    def compile(self, named_ranges):
+        self.named_ranges = named_ranges
+        self.parts = None
+        self.references = None
+
+        # pointer code is rewritten by prepare_pointer, it can't be shared
+        if 'OFFSET' in self.formula or 'INDEX' in self.formula:
+            return
+
+        e = shunting_yard(self.formula, named_ranges, ref = REF_PLACEHOLDER, tokenize_range = False)
+        ast, root = build_ast(e)
+
+        references = []
+        shifted = []
+        for node in ast.nodes():
+            if isinstance(node, RangeNode):
+                shift = node.tsubtype == 'range' and isinstance(node.tvalue, six.string_types) and is_reference(node.tvalue)
+                if shift:
+                    node.placeholder = '\x00%i\x00' % len(references)
+                    shifted.append(node.tvalue)
+                references.append((node.tvalue, node.tsubtype, shift))
+
+        # all the references that are moved around must be found in the formula text
+        # too, otherwise cells sharing the template may not have the same formula
+        if sorted(shifted) != sorted(formula_references(self.formula)):
+            return
+
+        code = root.emit(ast, context = self.sheet)
+        parts = code.split('\x00')
+
+        # some emitters use the raw address instead of the RangeNode output
+        literal = ''.join(parts[::2])
+        for tvalue in shifted:
+            if tvalue.replace('$', '').split('!')[-1] in literal:
+                return
+
+        for i in range(1, len(parts), 2):
+            parts[i] = -1 if parts[i] == 'ref' else int(parts[i])
+
+        self.parts = parts
+        self.references = references
+
+    def instantiate(self, cell, named_ranges = None):
+        """
+        Returns the code and the references of the template for cell, or None if
+        the template can't be used.
+
+        The template is compiled again if named_ranges is not the one it was compiled with.
+        """
+        if named_ranges is not None and named_ranges is not self.named_ranges:
+            self.compile(named_ranges)
+        if self.parts is None:
+            return None
+
+        row_offset = cell.row - self.row
+        col_offset = col2num(cell.col) - self.col
+
+        context = cell.sheet + '!' if cell.sheet else ''
+
+        references = []
+        addresses = []
+        for tvalue, tsubtype, shift in self.references:
+            if shift:
+                tvalue = shift_reference(tvalue, row_offset, col_offset)
+                if tvalue.endswith('#REF!'):
+                    return None
+
+                address = tvalue.replace('$', '')
+                addresses.append((address if '!' in address else context + address).replace("'", "\\'"))
+            else:
+                addresses.append(None)
+            references.append(Reference(tvalue, tsubtype))
+
+        ref = to_str(parse_cell_address(cell.address()))
+
+        code = []
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                code.append(part)
+            elif part == -1:
+                code.append(ref)
+            else:
+                code.append(addresses[part])
+
+        return ''.join(code), references
+
+
+NAME_RE = re.compile(r"[^\W\d][\w.]*", re.UNICODE)
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class FormulaCache(object):
+    """
+    Cache of compiled formulas, keyed on their relative (R1C1) form.
+
+    Formulas copied across many cells (e.g. B2*C2 in every row) are parsed only
+    once: the first copy is compiled into a FormulaTemplate, the following ones
+    are instantiated from it by offset.
+    """
+    def __init__(self, maxsize = 100000):
+        self.maxsize = maxsize
+        self.templates = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, cell, named_ranges):
+        formula = cell.formula
+        # only the names which are named ranges change the generated code
+        names = tuple(sorted(set(name for name in NAME_RE.findall(formula) if name in named_ranges)))
+
+        return (cell.sheet, relative_formula(formula, cell.row, col2num(cell.col)), names)
+
+    def get(self, cell, named_ranges):
+        """Returns the code and the references of cell, or None if it is not cached"""
+        key = self.key(cell, named_ranges)
+
+        template = self.templates.get(key)
+        if template is None:
+            template = FormulaTemplate(cell.formula, cell.sheet, cell.address())
+            template.compile(named_ranges)
+
+            if len(self.templates) >= self.maxsize:
+                self.templates.popitem(last = False)
+            self.templates[key] = template
+
+            compiled = template.instantiate(cell)
+            self.misses += 1
+        else:
+            compiled = template.instantiate(cell)
+            if compiled is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return compiled
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.templates))
+
+    def clear(self):
+        self.templates.clear()
+        self.hits = 0
+        self.misses = 0
+
+formula_cache = FormulaCache()
+
+
+def formula2code(cell, named_ranges):
+    """
+    Generate python code for the given formula cell, along with the cells/ranges it refers to.
+
+    Shared formulas are instantiated from their template, and other formulas are looked up
+    in formula_cache, so that only the first copy of a formula is parsed.
+    """
+    if not cell.is_named_range and cell.sheet:
+        if cell.formula_template is not None:
+            compiled = cell.formula_template.instantiate(cell, named_ranges)
+        else:
+            compiled = formula_cache.get(cell, named_ranges)
+
+        if compiled is not None:
+            return compiled
+
+    code, ast = cell2code(cell, named_ranges)
+
+    return code, [x for x in ast.nodes() if isinstance(x,RangeNode)]
+
+
 def prepare_pointer(code, names, ref_cell = None):
     # if ref_cell is None, it means that the pointer is a named_range
 
@@ -432,6 +638,16 @@ def prepare_pointer(code, names, ref_cell = None):
     }
 
 
+def grow_dimensions(dimensions, cell):
+    # keeps the dimensions given by max_dimension up to date when cell is added to the cellmap
+    if cell.row is None:
+        return
+    for sheet in (cell.sheet, None):
+        if sheet in dimensions:
+            dimensions[sheet][0] = max(dimensions[sheet][0], int(cell.row))
+            dimensions[sheet][1] = max(dimensions[sheet][1], col2num(cell.col))
+
+
 def graph_from_seeds(seeds, cell_source):
     """
     This creates/updates a networkx graph from a list of cells.
@@ -452,11 +668,13 @@ def graph_from_seeds(seeds, cell_source):
     else: # ~ cell_source is a ExcelCompiler
         cellmap = dict([(x.address(),x) for x in seeds])
         cells = cell_source.cells
-        # directed graph
-        G = networkx.DiGraph()
+        # directed graph, filled without networkx for a CompactGraph
+        G = CompactGraph() if getattr(cell_source, 'compact_graph', False) else networkx.DiGraph()
         # match the info in cellmap
         for c in cellmap.values(): G.add_node(c)
 
+    dimensions = {} # sheet -> [rows, cols] of the cells in cellmap, see max_dimension
+
     # cells to analyze: only formulas
     todo = [s for s in seeds if s.formula]
     steps = [i for i,s in enumerate(todo)]
@@ -470,7 +688,7 @@ def graph_from_seeds(seeds, cell_source):
         ###### 1) looking for cell c1 dependencies ####################
         # print 'C1', c1.address()
         # in case a formula, get all cells that are arguments
-        pystr, ast = cell2code(c1, names)
+        pystr, deps = formula2code(c1, names)
         # set the code & compile it (will flag problems sooner rather than later)
         c1.python_expression = pystr.replace('"', "'") # compilation is done later
 
@@ -478,8 +696,6 @@ def graph_from_seeds(seeds, cell_source):
             if c1.address() not in cell_source.named_ranges: # pointers names already treated in ExcelCompiler
                 cell_source.pointers.add(c1.address())
 
-        # get all the cells/ranges this formula refers to
-        deps = [x for x in ast.nodes() if isinstance(x,RangeNode)]
         # remove dupes
         deps = uniqueify(deps)
 
@@ -541,34 +757,24 @@ def graph_from_seeds(seeds, cell_source):
                 else:
                     address = dep_name
 
-                    # get a list of the addresses in this range that are not yet in the graph
-                    range_addresses = list(resolve_range(reference, should_flatten=True)[0])
-                    cellmap_add_addresses = [addr for addr in range_addresses if addr not in cellmap.keys()]
-
-                    if len(cellmap_add_addresses) > 0:
-                        # this means there are cells to be added
-
-                        # get row and col dimensions for the sheet, assuming the whole range is in one sheet
-                        sheet_initial = split_address(cellmap_add_addresses[0])[0]
-                        max_rows, max_cols = max_dimension(cellmap, sheet_initial)
-
-                        # create empty cells that aren't in the cellmap
-                        for addr in cellmap_add_addresses:
-                            sheet_new, col_new, row_new = split_address(addr)
-
-                            # if somehow a new sheet comes up in the range, get the new dimensions
-                            if sheet_new != sheet_initial:
-                                sheet_initial = sheet_new
-                                max_rows, max_cols = max_dimension(cellmap, sheet_new)
-
-                            # add the empty cells
-                            if int(row_new) <= max_rows and int(col2num(col_new)) <= max_cols:
-                                # only add cells within the maximum bounds of the sheet to avoid too many evaluations
-                                # for A:A or 1:1 ranges
-
-                                cell_new = Cell(addr, sheet_new, value="", should_eval='False') # create new cell object
-                                cellmap[addr] = cell_new # add it to the cellmap
-                                G.add_node(cell_new) # add it to the graph
+                    # the addresses of the range, generated on demand
+                    range_addresses = resolve_range(reference, should_flatten=True)[0]
+
+                    # get row and col dimensions for the sheet, the whole range being in one sheet
+                    sheet = range_addresses.sheet[:-1] or None
+                    if sheet not in dimensions:
+                        dimensions[sheet] = list(max_dimension(cellmap, sheet))
+                    max_rows, max_cols = dimensions[sheet]
+
+                    # only add cells within the maximum bounds of the sheet to avoid too many evaluations
+                    # for A:A or 1:1 ranges, which are clipped to them
+                    # create empty cells that aren't in the cellmap
+                    for addr in range_addresses.clip(max_rows, max_cols):
+                        if addr not in cellmap:
+                            cell_new = Cell(addr, sheet, value="", should_eval='False') # create new cell object
+                            cellmap[addr] = cell_new # add it to the cellmap
+                            G.add_node(cell_new) # add it to the graph
+                            if cell_source.cells is not None: # None for a Spreadsheet created empty
                                 cell_source.cells[addr] = cell_new # add it to the cell_source, used in this function
 
                     rng = cell_source.range(reference)
@@ -579,6 +785,8 @@ def graph_from_seeds(seeds, cell_source):
                     virtual_cell = Cell(address, None, value = rng, formula = reference, is_range = True, is_named_range = True )
                     # save the range
                     cellmap[address] = virtual_cell
+                    if hasattr(cell_source, 'whole_ranges'): # ~ cell_source is a Spreadsheet, extending its A:A ranges
+                        cell_source.index_range(virtual_cell)
 
                 # add an edge from the range to the parent
                 G.add_node(virtual_cell)
@@ -641,6 +849,7 @@ def graph_from_seeds(seeds, cell_source):
 
                     # save in the cellmap
                     cellmap[c2.address()] = c2
+                    grow_dimensions(dimensions, c2)
                     # add to the graph
                     G.add_node(c2)
 
@@ -197,6 +197,7 @@ class RangeNode(OperandNode):
         super(RangeNode,self).__init__(args)
         self.ref = ref if ref != '' else 'None' # ref is the address of the reference cell
         self.debug = debug
+        self.placeholder = None # emitted instead of the address when compiling a FormulaTemplate
 
     def get_cells(self):
         return resolve_range(self.tvalue)[0]
@@ -219,7 +220,7 @@ class RangeNode(OperandNode):
             is_a_range = is_range(rng)
 
             if self.tsubtype == 'pointer':
-                my_str = '"' + rng + '"'
+                my_str = '"' + rng.replace("'", "\\'") + '"'
             else:
                 if is_a_range:
                     sh,start,end = split_range(rng)
@@ -231,10 +232,12 @@ class RangeNode(OperandNode):
                             print('WARNING: Unknown address: %s is not a cell/range reference, nor a named range' % to_str(rng))
                         sh = None
 
-                if sh:
-                    my_str = '"' + rng + '"'
+                if self.placeholder is not None:
+                    my_str = '"' + self.placeholder + '"'
+                elif sh: # apostrophes of sheet names are escaped, as the code is written with ' later on
+                    my_str = '"' + rng.replace("'", "\\'") + '"'
                 else:
-                    my_str = '"' + sheet + rng + '"'
+                    my_str = '"' + (sheet + rng).replace("'", "\\'") + '"'
 
         to_eval = True
         # exception for formulas which use the address and not it content as ":" or "OFFSET"
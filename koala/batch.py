@@ -0,0 +1,320 @@
+from __future__ import absolute_import, division
+
+import numbers
+
+import numpy as np
+
+from koala.closures import ClosureBuilder, Static, to_closure
+from koala.codegen import dynamic_cells, topological_order
+from koala.ExcelError import ExcelError
+from koala.excellib import xsum, xmin, xmax, xlog, sqrt, power
+from koala.Range import RangeCore
+from koala.utils import extract_numeric_values
+
+
+def numeric(value):
+    # operand of a vectorized operation, with the conversions of check_value
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'b':
+            return value.astype(int)
+        elif value.dtype.kind in 'iuf':
+            return value
+    elif value is None:
+        return 0
+    elif isinstance(value, numbers.Number):
+        return value
+    raise Exception('%s can\'t be vectorized' % type(value))
+
+def is_bool(value):
+    return isinstance(value, bool) or isinstance(value, np.ndarray) and value.dtype.kind == 'b'
+
+def scalar(value):
+    # numpy scalars are not recognized as ints by excellib
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# errors give non finite values, the scenarios concerned being evaluated again one by one
+VECTOR_OPERATORS = {
+    'multiply': np.multiply,
+    'divide': lambda a, b: np.true_divide(a, b),
+    'add': np.add,
+    'substract': np.subtract,
+    'power': lambda a, b: np.power(np.asarray(a, dtype = float), b),
+    'minus': lambda a, b: np.negative(a),
+    'is_equal': lambda a, b: np.abs(a - b) <= 0.00001,
+    'is_not_equal': np.not_equal,
+    'is_strictly_superior': np.greater,
+    'is_strictly_inferior': np.less,
+    'is_superior_or_equal': lambda a, b: np.greater(a, b) | (np.abs(a - b) <= 0.0001),
+    'is_inferior_or_equal': lambda a, b: np.less(a, b) | (np.abs(a - b) <= 0.0001),
+}
+
+def vector_apply(func, first, second, ref = None):
+    if not isinstance(first, np.ndarray) and not isinstance(second, np.ndarray):
+        return RangeCore.apply(func, first, second, ref)
+    if func in ('is_equal', 'is_not_equal') and (is_bool(first) or is_bool(second)): # booleans are compared as strings
+        raise Exception('Booleans can\'t be vectorized in %s' % func)
+    return VECTOR_OPERATORS[func](numeric(first), numeric(second))
+
+def vector_sum(*args):
+    total = 0
+    for arg in args:
+        total = total + (numeric(arg) if isinstance(arg, np.ndarray) else xsum(arg))
+    return total
+
+def vector_extremum(function, args):
+    result = None
+    for arg in args:
+        for value in ([numeric(arg)] if isinstance(arg, np.ndarray) else extract_numeric_values(arg)):
+            result = value if result is None else function(result, value)
+    return 0 if result is None else result
+
+def vector_power(number, exponent):
+    number = np.asarray(numeric(number), dtype = float)
+    exponent = numeric(exponent)
+    invalid = (number == 0) & (exponent == 0) | (exponent < 1) & (number < 0)
+    return np.where(invalid, np.nan, np.power(number, exponent))
+
+VECTOR_FUNCTIONS = {
+    xsum: vector_sum,
+    xmin: lambda *args: vector_extremum(np.minimum, args),
+    xmax: lambda *args: vector_extremum(np.maximum, args),
+    xlog: lambda a: np.log(numeric(a)),
+    sqrt: lambda a: np.sqrt(numeric(a)),
+    power: vector_power,
+}
+
+
+class VectorBuilder(ClosureBuilder):
+    """
+    Closures computing the values of a cell for all the scenarios at once, the dynamic cells holding arrays.
+
+    Closures raise an Exception when they meet something that can't be vectorized.
+    """
+
+    def __init__(self, spreadsheet, namespace, dynamic, values):
+        super(VectorBuilder, self).__init__(spreadsheet, namespace)
+        self.dynamic = dynamic
+        self.values = values # Cell -> array of values, for the dynamic cells already evaluated
+
+    def visit_IfExp(self, node):
+        test = to_closure(self.visit(node.test))
+        body = to_closure(self.visit(node.body))
+        orelse = to_closure(self.visit(node.orelse))
+
+        def if_exp():
+            condition = test()
+            if isinstance(condition, np.ndarray):
+                return np.where(numeric(condition) != 0, body(), orelse())
+            return body() if condition else orelse()
+        return if_exp
+
+    def call(self, f, args, keywords):
+        if f is RangeCore.apply or f is RangeCore.apply_one or f is RangeCore.apply_all:
+            f = vector_apply
+        elif f in VECTOR_FUNCTIONS:
+            function, vector_function = f, VECTOR_FUNCTIONS[f]
+            def f(*values):
+                if any(isinstance(v, np.ndarray) for v in values):
+                    return vector_function(*values)
+                return function(*values)
+        else:
+            function = f
+            def f(*values, **kwargs):
+                if any(isinstance(v, np.ndarray) for v in list(values) + list(kwargs.values())):
+                    raise Exception('%s can\'t be vectorized' % getattr(function, '__name__', function))
+                return function(*values, **kwargs)
+
+        return super(VectorBuilder, self).call(f, args, keywords)
+
+    def reference(self, args, keywords):
+        if len(args) == 1 and isinstance(args[0], Static):
+            cell = self.spreadsheet.cellmap.get(args[0].value)
+
+            if cell in self.dynamic:
+                if cell.is_range:
+                    ref = dict(keywords).get('ref')
+                    ref = ref.value if isinstance(ref, Static) else None
+                    address = RangeCore.find_associated_cell(ref, cell.range)
+                    if address is None:
+                        raise Exception('Range %s depends on the inputs and can\'t be vectorized' % cell.address())
+                    cell = self.spreadsheet.cellmap[address]
+
+                if cell in self.values:
+                    values = self.values
+                    return lambda: values[cell]
+
+        return super(VectorBuilder, self).reference(args, keywords)
+
+
+def to_array(values):
+    # ndarray of the values of one cell for all scenarios
+    if all(isinstance(v, numbers.Number) for v in values):
+        return np.array(values)
+    array = np.empty(len(values), dtype = object)
+    for i, v in enumerate(values):
+        array[i] = v
+    return array
+
+def broadcast(value, size):
+    return to_array([value] * size)
+
+
+class BatchEvaluator(object):
+    """
+    Evaluates the outputs of a Spreadsheet for many values of its inputs.
+
+    The dynamic cells (depending on the inputs) are evaluated once each, in topological order, holding an array
+    with one value per scenario. Cells that can't be vectorized are evaluated one scenario at a time, as are the
+    scenarios giving non finite values (Excel errors). When pointers (OFFSET, INDEX) depend on the inputs, each
+    scenario goes through set_values and cell_evaluate.
+    """
+
+    def __init__(self, spreadsheet, inputs, outputs, namespace):
+        self.spreadsheet = spreadsheet
+        self.namespace = namespace
+        cellmap = spreadsheet.cellmap
+
+        self.inputs = {}
+        size = None
+        for address, values in inputs.items():
+            if address in spreadsheet.named_ranges and spreadsheet.named_ranges[address] in cellmap:
+                address = spreadsheet.named_ranges[address]
+            if address not in cellmap:
+                raise Exception('Cell %s not in cellmap' % address)
+            if cellmap[address].is_range:
+                raise Exception('Range %s can\'t be used as input, use its cells instead' % address)
+
+            values = np.asarray(values)
+            if values.ndim != 1 or size is not None and len(values) != size:
+                raise Exception('Values of inputs must be 1 dimensional arrays of the same length')
+            size = len(values)
+            self.inputs[address] = values
+
+        self.outputs = list(outputs)
+        for address in self.outputs:
+            if address not in cellmap:
+                raise Exception('Cell %s not in cellmap' % address)
+            if cellmap[address].is_range:
+                raise Exception('Range %s can\'t be used as output, use its cells instead' % address)
+
+        self.size = size or 0
+        self.dynamic = dynamic_cells(spreadsheet, list(self.inputs))
+        self.order = topological_order(spreadsheet, list(self.inputs), self.outputs, self.dynamic)
+
+    def is_pointer(self, cell):
+        return cell.is_range and cell.range.is_pointer \
+            or cell.address() in self.spreadsheet.pointers_to_reset \
+            or cell.should_eval == 'always'
+
+    def evaluate(self):
+        """
+        :return: dict giving an array of values for each output
+        """
+        if any(self.is_pointer(cell) for cell in self.order):
+            return self.evaluate_serial()
+
+        cellmap = self.spreadsheet.cellmap
+        saved = [(cell, cell.value, cell.need_update) for cell in self.order]
+        values = {}
+
+        try:
+            for cell in self.order:
+                address = cell.address()
+                if address in self.inputs:
+                    values[cell] = self.inputs[address]
+                elif cell.is_range:
+                    continue # its cells are evaluated instead
+                elif cell.should_eval == 'never' or not cell.formula: # fixed cells
+                    values[cell] = broadcast(cell.value, self.size)
+                else:
+                    values[cell] = self.evaluate_cell(cell, values)
+        finally:
+            for cell, value, need_update in saved:
+                cell.value = value
+                cell.need_update = need_update
+
+        results = {}
+        for address in self.outputs:
+            cell = cellmap[address]
+            if cell in values:
+                results[address] = values[cell]
+            else:
+                results[address] = broadcast(self.spreadsheet.evaluate(address), self.size)
+        return results
+
+    def evaluate_cell(self, cell, values):
+        try:
+            closure = VectorBuilder(self.spreadsheet, self.namespace, self.dynamic, values).build(cell.python_expression)
+            with np.errstate(all = 'ignore'):
+                result = closure()
+        except Exception:
+            return to_array(self.evaluate_scenarios(cell, values, range(self.size)))
+
+        if not isinstance(result, np.ndarray):
+            if isinstance(result, RangeCore):
+                result = result.values[0]
+            return broadcast(result if result != '' else None, self.size)
+        if result.shape != (self.size,):
+            return to_array(self.evaluate_scenarios(cell, values, range(self.size)))
+        if result.dtype.kind not in 'biuf':
+            return to_array([scalar(v) for v in result])
+
+        if result.dtype.kind == 'f':
+            errors = np.nonzero(~np.isfinite(result))[0]
+            if len(errors):
+                fixed = self.evaluate_scenarios(cell, values, errors)
+                if not all(isinstance(v, numbers.Number) for v in fixed):
+                    result = result.astype(object)
+                for i, v in zip(errors, fixed):
+                    result[i] = v
+        return result
+
+    def evaluate_scenarios(self, cell, values, scenarios):
+        """
+        Values of cell for some of the scenarios, evaluating its expression once per scenario.
+        """
+        G = self.spreadsheet.G
+        sources = []
+        for parent in G.predecessors(cell):
+            if parent.is_range:
+                sources += [c for c in G.predecessors(parent) if c in values]
+            elif parent in values:
+                sources.append(parent)
+
+        results = []
+        for i in scenarios:
+            for source in sources:
+                source.value = scalar(values[source][i])
+                source.need_update = False
+            try:
+                results.append(self.spreadsheet.compute(cell))
+            except Exception as e:
+                results.append(ExcelError('#VALUE!', e))
+        return results
+
+    def evaluate_serial(self):
+        spreadsheet = self.spreadsheet
+        fixed_cells = dict(spreadsheet.fixed_cells)
+        original_values = dict((address, spreadsheet.cellmap[address].value) for address in self.inputs)
+        results = dict((address, []) for address in self.outputs)
+
+        try:
+            for i in range(self.size):
+                spreadsheet.set_values(dict((address, scalar(values[i])) for address, values in self.inputs.items()))
+                for address in self.outputs:
+                    try:
+                        results[address].append(spreadsheet.cell_evaluate(address))
+                    except Exception as e:
+                        results[address].append(ExcelError('#VALUE!', e))
+        finally:
+            spreadsheet.set_values(original_values)
+            for address in original_values:
+                if address not in fixed_cells:
+                    spreadsheet.cellmap[address].should_eval = spreadsheet.fixed_cells.pop(address)
+
+        return dict((address, to_array(values)) for address, values in results.items())
+
+
+def evaluate_batch(self, inputs, outputs, namespace):
+    return BatchEvaluator(self, inputs, outputs, namespace).evaluate()
@@ -0,0 +1,313 @@
+from __future__ import absolute_import, division
+
+import ast
+import operator
+import six
+
+from koala.Range import RangeCore
+from koala.utils import is_range
+
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+}
+
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+
+class UnsupportedExpression(Exception):
+    """Raised for the parts of a python_expression that can't be turned into closures"""
+    pass
+
+
+class Static(object):
+    # marks the nodes that can be computed once, when building the closures
+    def __init__(self, value):
+        self.value = value
+
+
+def const(value):
+    return lambda: value
+
+def to_closure(node):
+    return const(node.value) if isinstance(node, Static) else node
+
+
+class ClosureBuilder(object):
+    """
+    Turns the python_expression of a cell into nested closures, without compile() nor eval().
+
+    Names are resolved once from namespace (the globals the string backend would use), and references
+    to other cells (self.eval_ref with constant arguments) are bound to their address, looked up in the
+    cellmap when evaluating as cells can be replaced.
+    """
+
+    def __init__(self, spreadsheet, namespace):
+        self.spreadsheet = spreadsheet
+        self.namespace = namespace
+
+    def build(self, expression):
+        tree = ast.parse(expression.strip(), mode = 'eval')
+        return to_closure(self.visit(tree.body))
+
+    def visit(self, node):
+        method = getattr(self, 'visit_' + node.__class__.__name__, None)
+        if method is None:
+            raise UnsupportedExpression('Unsupported expression %s' % node.__class__.__name__)
+        return method(node)
+
+    def operator(self, operators, op):
+        if type(op) not in operators:
+            raise UnsupportedExpression('Unsupported operator %s' % op.__class__.__name__)
+        return operators[type(op)]
+
+    # constants, including Python 2 and 3.8+ ast
+    def visit_Num(self, node):
+        return Static(node.n)
+
+    def visit_Str(self, node):
+        return Static(node.s)
+
+    def visit_NameConstant(self, node):
+        return Static(node.value)
+
+    def visit_Constant(self, node):
+        return Static(node.value)
+
+    def visit_Name(self, node):
+        name = node.id
+        if name == 'self':
+            return Static(self.spreadsheet)
+        elif name in ('True', 'False', 'None'): # Python 2
+            return Static({'True': True, 'False': False, 'None': None}[name])
+        elif name in self.namespace:
+            return Static(self.namespace[name])
+        else:
+            def missing():
+                raise NameError("name '%s' is not defined" % name)
+            return missing
+
+    def visit_Attribute(self, node):
+        value = self.visit(node.value)
+        attr = node.attr
+
+        if isinstance(value, Static) and (value.value is not self.spreadsheet or callable(getattr(type(value.value), attr, None))):
+            return Static(getattr(value.value, attr))
+        else: # attributes of the Spreadsheet can change, not its methods
+            value = to_closure(value)
+            return lambda: getattr(value(), attr)
+
+    def visit_Tuple(self, node):
+        return self.sequence(node, tuple)
+
+    def visit_List(self, node):
+        return self.sequence(node, list)
+
+    def sequence(self, node, kind):
+        items = [self.visit(e) for e in node.elts]
+        if all(isinstance(item, Static) for item in items) and kind is tuple:
+            return Static(tuple(item.value for item in items))
+        items = [to_closure(item) for item in items]
+        return lambda: kind([item() for item in items])
+
+    def visit_UnaryOp(self, node):
+        function = self.operator(UNARY_OPERATORS, node.op)
+        operand = self.visit(node.operand)
+        if isinstance(operand, Static):
+            try: # negative numbers
+                return Static(function(operand.value))
+            except Exception:
+                pass
+        operand = to_closure(operand)
+        return lambda: function(operand())
+
+    def visit_BinOp(self, node):
+        function = self.operator(BINARY_OPERATORS, node.op)
+        left = to_closure(self.visit(node.left))
+        right = to_closure(self.visit(node.right))
+        return lambda: function(left(), right())
+
+    def visit_Compare(self, node):
+        left = to_closure(self.visit(node.left))
+        functions = [self.operator(COMPARE_OPERATORS, op) for op in node.ops]
+        comparators = [to_closure(self.visit(c)) for c in node.comparators]
+
+        def compare():
+            a = left()
+            for function, comparator in zip(functions, comparators):
+                b = comparator()
+                if not function(a, b):
+                    return False
+                a = b
+            return True
+        return compare
+
+    def visit_BoolOp(self, node):
+        values = [to_closure(self.visit(v)) for v in node.values]
+        if isinstance(node.op, ast.And):
+            def bool_op():
+                for value in values:
+                    result = value()
+                    if not result:
+                        return result
+                return result
+        else:
+            def bool_op():
+                for value in values:
+                    result = value()
+                    if result:
+                        return result
+                return result
+        return bool_op
+
+    def visit_IfExp(self, node):
+        test = to_closure(self.visit(node.test))
+        body = to_closure(self.visit(node.body))
+        orelse = to_closure(self.visit(node.orelse))
+        return lambda: body() if test() else orelse()
+
+    def visit_Subscript(self, node):
+        value = to_closure(self.visit(node.value))
+        index = node.slice.value if isinstance(node.slice, ast.Index) else node.slice # ast.Index disappeared in 3.9
+        index = to_closure(self.visit(index))
+        return lambda: value()[index()]
+
+    def visit_Call(self, node):
+        function = self.visit(node.func)
+        args = [self.visit(a) for a in node.args]
+        keywords = [(k.arg, self.visit(k.value)) for k in node.keywords]
+
+        if isinstance(function, Static):
+            if function.value == self.spreadsheet.eval_ref:
+                reference = self.reference(args, keywords)
+                if reference is not None:
+                    return reference
+            return self.call(function.value, args, keywords)
+        else:
+            function = to_closure(function)
+            args = [to_closure(a) for a in args]
+            keywords = [(k, to_closure(v)) for k, v in keywords]
+            return lambda: function()(*[a() for a in args], **dict((k, v()) for k, v in keywords))
+
+    def call(self, f, args, keywords):
+        # the most frequent shapes get their own closure, to avoid building argument lists
+        if keywords:
+            args = [to_closure(a) for a in args]
+            keywords = [(k, to_closure(v)) for k, v in keywords]
+            return lambda: f(*[a() for a in args], **dict((k, v()) for k, v in keywords))
+
+        constant = [isinstance(a, Static) for a in args]
+        if len(args) == 4 and constant[0] and constant[3]: # RangeCore.apply(func, first, second, ref)
+            func, ref = args[0].value, args[3].value
+            first, second = to_closure(args[1]), to_closure(args[2])
+            return lambda: f(func, first(), second(), ref)
+
+        args = [to_closure(a) for a in args]
+        if len(args) == 0:
+            return lambda: f()
+        elif len(args) == 1:
+            a, = args
+            return lambda: f(a())
+        elif len(args) == 2:
+            a, b = args
+            return lambda: f(a(), b())
+        elif len(args) == 3:
+            a, b, c = args
+            return lambda: f(a(), b(), c())
+        else:
+            return lambda: f(*[a() for a in args])
+
+    def reference(self, args, keywords):
+        """
+        Closure of self.eval_ref(address, ref = ref) bound to the address of the referenced Cell, or None if it can
+        only be resolved when evaluating.
+        """
+        keywords = dict(keywords)
+        if len(args) != 1 or set(keywords) - set(['ref']):
+            return None
+        if not all(isinstance(a, Static) for a in args + list(keywords.values())):
+            return None
+
+        address = args[0].value
+        ref = keywords['ref'].value if 'ref' in keywords else None
+        spreadsheet = self.spreadsheet
+        cell = spreadsheet.cellmap.get(address)
+
+        if cell is None:
+            return None
+        elif cell.is_range:
+            if cell.range.is_pointer:
+                return None
+            associated_address = RangeCore.find_associated_cell(ref, cell.range)
+            if associated_address is None or associated_address not in spreadsheet.cellmap:
+                return None
+            cell_address = associated_address
+        elif not (address in spreadsheet.named_ranges or not is_range(address)):
+            return None
+        else:
+            cell_address = address
+
+        needs_evaluation = spreadsheet.needs_evaluation
+        cell_evaluate = spreadsheet.cell_evaluate
+        eval_ref = spreadsheet.eval_ref
+
+        def evaluate_reference():
+            cell = spreadsheet.cellmap.get(cell_address)
+            if cell is None: # removed since
+                return eval_ref(address, ref = ref)
+            if needs_evaluation(cell):
+                return cell_evaluate(cell_address)
+            value = cell.value
+            return value if value != '' else None
+        return evaluate_reference
+
+
+def branch_references(expression):
+    """
+    Addresses read by the python_expression only in some branches of its conditional expressions (the IFs of the
+    formula), which might not be evaluated.
+
+    :return: set of addresses
+    """
+    def references(node):
+        # (addresses always read, addresses read depending on conditions)
+        if isinstance(node, ast.IfExp):
+            test, body, orelse = references(node.test), references(node.body), references(node.orelse)
+            always = test[0] | (body[0] & orelse[0]) # read in both branches
+            return always, (test[1] | body[0] | body[1] | orelse[0] | orelse[1]) - always
+
+        always, sometimes = set(), set()
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'eval_ref' and node.args:
+            address = getattr(node.args[0], 'value', getattr(node.args[0], 's', None)) # ast.Str before 3.8
+            if isinstance(address, six.string_types):
+                always.add(address)
+        for child in ast.iter_child_nodes(node):
+            child_always, child_sometimes = references(child)
+            always |= child_always
+            sometimes |= child_sometimes
+        return always, sometimes - always
+
+    always, sometimes = references(ast.parse(expression.strip(), mode = 'eval').body)
+    return sometimes - always
+
+
+def build_closure(spreadsheet, expression, namespace):
+    return ClosureBuilder(spreadsheet, namespace).build(expression)
@@ -0,0 +1,279 @@
+from __future__ import absolute_import, division, print_function
+
+import re
+import math
+from ast import literal_eval
+
+import numpy as np
+from openpyxl.compat import unicode
+
+from koala.ExcelError import ExcelError
+from koala.Range import RangeCore
+
+# self.eval_ref('Sheet1!A1', ref = (1, 'B')), as emitted by the ast nodes, apostrophes of sheet names being escaped
+EVAL_REF_RE = re.compile(r"self\.eval_ref\(('(?:[^'\\]|\\.)*')(?:, ref = (None|\(\d+, '[A-Z]+'\)))?\)")
+
+MODULE = '''# -*- coding: utf-8 -*-
+# Generated by koala, do not edit.
+from __future__ import division
+
+from koala.excellib import *
+from koala.CellBase import CellBase
+from koala.Range import RangeCore
+from koala.ExcelError import ExcelError
+
+INPUTS = %s
+OUTPUTS = %s
+
+
+class _Cell(CellBase):
+    __slots__ = ['_value']
+
+    def __init__(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self.value_changed()
+
+def _range(addresses, values, nrows, ncols):
+    # Ranges of a Spreadsheet hold cells, not values
+    return RangeCore(addresses, cellmap = dict(zip(addresses, [_Cell(v) for v in values])), nrows = nrows, ncols = ncols)
+
+def _with(values, indexes, new_values):
+    # copy of the constant values of a Range depending on inputs, with new_values at indexes
+    values = list(values)
+    for index, value in zip(indexes, new_values):
+        values[index] = value
+    return values
+
+def _value(value):
+    # same conversion as Spreadsheet.cell_evaluate
+    if isinstance(value, RangeCore):
+        return value.values[0]
+    return value if value != '' else None
+
+'''
+
+
+def dynamic_cells(spreadsheet, inputs):
+    """
+    Cells impacted by the inputs, pointers being reset by any cell_set_value.
+
+    :param spreadsheet: a Spreadsheet
+    :param inputs: list of addresses
+    :return: set of Cell
+    """
+    G = spreadsheet.G
+    cellmap = spreadsheet.cellmap
+    todo = [cellmap[address] for address in inputs]
+    todo += [cellmap[address] for address in spreadsheet.pointers_to_reset if address in cellmap]
+    dynamic = set(todo)
+    while todo:
+        cell = todo.pop()
+        for child in G.successors(cell):
+            if child not in dynamic:
+                dynamic.add(child)
+                todo.append(child)
+    return dynamic
+
+
+def topological_order(spreadsheet, inputs, outputs, dynamic):
+    """
+    Dynamic cells needed by the outputs, each after its parents. The parents of inputs are not included.
+
+    :param spreadsheet: a Spreadsheet
+    :param inputs: list of addresses
+    :param outputs: list of addresses
+    :param dynamic: set of Cell, as given by dynamic_cells
+    :return: list of Cell
+    """
+    G = spreadsheet.G
+    cellmap = spreadsheet.cellmap
+    inputs = set(cellmap[address] for address in inputs)
+    order = []
+    done = set()
+
+    for address in outputs:
+        cell = cellmap[address]
+        if cell not in dynamic or cell in done:
+            continue
+        done.add(cell)
+        todo = [(cell, iter([] if cell in inputs else G.predecessors(cell)))]
+
+        while todo:
+            current, parents = todo[-1]
+            for parent in parents:
+                if parent in dynamic and parent not in done:
+                    done.add(parent)
+                    todo.append((parent, iter([] if parent in inputs else G.predecessors(parent))))
+                    break
+            else:
+                todo.pop()
+                order.append(current)
+
+    return order
+
+
+class ModuleWriter(object):
+    """
+    Writes the cells needed to compute outputs from inputs as a standalone Python module.
+
+    Cells that don't depend on inputs are evaluated once and written as constants. The others become local
+    variables of an evaluate() function, computed in topological order.
+    """
+
+    def __init__(self, spreadsheet, inputs, outputs):
+        self.spreadsheet = spreadsheet
+        self.cellmap = spreadsheet.cellmap
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+        for address in self.inputs + self.outputs:
+            if address not in self.cellmap:
+                raise Exception('Cell %s not in cellmap' % address)
+        for address in self.inputs:
+            if self.cellmap[address].is_range:
+                raise Exception('Range %s can\'t be used as input, use its cells instead' % address)
+
+        self.constants = [] # module level definitions
+        self.constant_names = {}
+        self.variables = {} # Cell -> local variable name
+        self.dynamic = dynamic_cells(spreadsheet, self.inputs)
+
+    def constant(self, value):
+        """
+        Python source of a constant value, RangeCore objects being defined at module level.
+        """
+        if isinstance(value, np.generic):
+            value = value.item()
+
+        if value is None or isinstance(value, (bool, int, unicode, str)):
+            return repr(value)
+        elif isinstance(value, float):
+            return repr(value) if not (math.isinf(value) or math.isnan(value)) else "float('%r')" % value
+        elif isinstance(value, ExcelError):
+            info = value.info if value.info is None or isinstance(value.info, (unicode, str)) else str(value.info)
+            return 'ExcelError(%s, %s)' % (repr(value.value), repr(info))
+        elif isinstance(value, list):
+            return '[%s]' % ', '.join([self.constant(v) for v in value])
+        elif isinstance(value, RangeCore):
+            source = '_range(%s, %s, %s, %s)' % (
+                repr(value.addresses), self.constant(value.values), value.nrows, value.ncols)
+            if source not in self.constant_names:
+                name = 'K%i' % len(self.constants)
+                self.constant_names[source] = name
+                self.constants.append('%s = %s' % (name, source))
+            return self.constant_names[source]
+        else:
+            try: # long in Python 2
+                if value == int(value):
+                    return repr(value)
+            except (TypeError, ValueError):
+                pass
+            raise Exception('Can\'t export value %s of type %s' % (value, type(value)))
+
+    def reference(self, address, ref):
+        # Python source of self.eval_ref(address, ref = ref)
+        spreadsheet = self.spreadsheet
+        cell = self.cellmap.get(address)
+
+        if cell is None or cell not in self.dynamic:
+            return self.constant(spreadsheet.eval_ref(address, ref = ref))
+
+        if cell.is_range:
+            associated_address = RangeCore.find_associated_cell(ref, cell.range)
+            if associated_address:
+                associated_cell = self.cellmap[associated_address]
+                if associated_cell in self.dynamic:
+                    return self.variables[associated_cell]
+                else:
+                    return self.constant(spreadsheet.evaluate(associated_address))
+
+        return self.variables[cell]
+
+    def expression(self, cell):
+        def replace(match):
+            ref = literal_eval(match.group(2)) if match.group(2) else None
+            return self.reference(literal_eval(match.group(1)), ref)
+
+        if cell.is_range:
+            values = []
+            indexes = []
+            variables = []
+            for index, address in enumerate(cell.range.addresses):
+                c = self.cellmap[address]
+                if c in self.dynamic:
+                    values.append('None')
+                    indexes.append(index)
+                    variables.append(self.variables[c])
+                else:
+                    values.append(self.constant(c.value))
+
+            # built in each call of evaluate(), which can run in several threads
+            index = len(self.constants)
+            self.constants.append('A%i = %s' % (index, repr(cell.range.addresses)))
+            self.constants.append('V%i = [%s]' % (index, ', '.join(values)))
+            return '_range(A%i, _with(V%i, %s, (%s,)), %s, %s)' % (
+                index, index, repr(tuple(indexes)), ', '.join(variables), cell.range.nrows, cell.range.ncols)
+        elif cell.python_expression is None:
+            return '0'
+
+        expression = EVAL_REF_RE.sub(replace, cell.python_expression)
+        if 'self.' in expression:
+            raise Exception('Cell %s uses pointers (OFFSET, INDEX) that depend on inputs, which can\'t be exported: %s'
+                % (cell.address(), cell.formula))
+        return '_value(%s)' % expression
+
+    def source(self):
+        spreadsheet = self.spreadsheet
+        inputs = set(self.cellmap[address] for address in self.inputs)
+        order = topological_order(spreadsheet, self.inputs, self.outputs, self.dynamic)
+
+        for cell in order:
+            if cell in inputs:
+                continue
+            if cell.is_range and cell.range.is_pointer or cell.address() in spreadsheet.pointers_to_reset:
+                raise Exception('Cell %s uses pointers (OFFSET, INDEX) that depend on inputs, which can\'t be exported: %s'
+                    % (cell.address(), cell.formula))
+
+        body = []
+        for index, cell in enumerate(order):
+            name = 'v%i' % index
+            if cell in inputs:
+                default = spreadsheet.evaluate(cell.address())
+                body.append('%s = get(%s, %s) # %s' % (name, repr(cell.address()), self.constant(default), cell.address()))
+            else:
+                body.append('%s = %s # %s' % (name, self.expression(cell), cell.address()))
+            self.variables[cell] = name
+
+        results = []
+        for address in self.outputs:
+            cell = self.cellmap[address]
+            if cell in self.dynamic:
+                result = self.variables[cell] + ('.values' if cell.is_range else '')
+            else:
+                result = self.constant(spreadsheet.evaluate(address))
+            results.append('%s: %s' % (repr(address), result))
+
+        lines = [MODULE % (repr(self.inputs), repr(self.outputs))]
+        lines += [c + '\n' for c in self.constants]
+        lines.append('def evaluate(inputs = {}):\n')
+        lines.append('    """\n    Values of OUTPUTS, from a dict giving the values of (some of) INPUTS.\n    """\n')
+        lines.append('    get = inputs.get\n')
+        lines += ['    %s\n' % line for line in body]
+        lines.append('    return {%s}\n' % ', '.join(results))
+
+        return ''.join(lines)
+
+
+def export_module(self, fname, inputs, outputs):
+    source = ModuleWriter(self, inputs, outputs).source()
+
+    with open(fname, 'wb') as outfile:
+        outfile.write(source.encode('utf-8'))
@@ -21,9 +21,10 @@ from dateutil.relativedelta import relativedelta
 from openpyxl.compat import unicode
 
 from koala.utils import *
-from koala.Range import RangeCore as Range
+from koala.Range import RangeCore as Range, value_kind, EMPTY, NUMBER, BOOLEAN, TEXT
 from koala.ExcelError import *
 from functools import reduce
+from bisect import bisect_left, bisect_right
 
 ######################################################################################
 # A dictionary that maps excel function names onto python equivalents. You should
@@ -202,15 +203,41 @@ def counta(range):
         return len([x for x in range.values if x != None])
 
 
+def _criteria_masks(ranges, criteria, length=None):
+    # values matching all criteria, by default on the common length of the ranges
+    masks = [range.criteria_mask(criterion) for range, criterion in zip(ranges, criteria)]
+    if length is None:
+        length = min(len(mask) for mask in masks)
+
+    result = np.ones(length, dtype = bool)
+    for mask in masks:
+        mask = mask[:length]
+        result[len(mask):] = False
+        result[:len(mask)] &= mask
+
+    return result
+
+
+def _criteria_rows(ranges, criteria, length=None):
+    # sorted rows matching all criteria, from the GroupIndex of the ranges when criteria compare values for equality
+    group_index = Range.group_index(ranges)
+    rows = group_index.rows(criteria) if group_index is not None else None
+
+    if rows is None:
+        return np.flatnonzero(_criteria_masks(ranges, criteria, length)).tolist()
+    elif length is not None:
+        return rows[:bisect_left(rows, length)]
+    else:
+        return rows
+
+
 def countif(range, criteria): # Excel reference: https://support.office.com/en-us/article/COUNTIF-function-e0de10c6-f885-4e71-abb4-1f464816df34
 
     # WARNING:
     # - wildcards not supported
     # - support of strings with >, <, <=, =>, <> not provided
 
-    valid = find_corresponding_index(range.values, criteria)
-
-    return len(valid)
+    return len(_criteria_rows([range], [criteria]))
 
 
 def countifs(*args): # Excel reference: https://support.office.com/en-us/article/COUNTIFS-function-dda3dc6e-f74e-4aee-88bc-aa8c2a866842
@@ -223,52 +250,8 @@ def countifs(*args): # Excel reference: https://support.office.com/en-us/article
 
 
     if l >= 2:
-        indexes = find_corresponding_index(args[0].values, args[1]) # find indexes that match first layer of countif
-
-        remaining_ranges = [elem for i, elem in enumerate(arg_list[2:]) if i % 2 == 0] # get only ranges
-        remaining_criteria = [elem for i, elem in enumerate(arg_list[2:]) if i % 2 == 1] # get only criteria
-
-        # verif that all Ranges are associated COULDNT MAKE THIS WORK CORRECTLY BECAUSE OF RECURSION
-        # association_type = None
-
-        # temp = [args[0]] + remaining_ranges
-
-        # for index, range in enumerate(temp): # THIS IS SHIT, but works ok
-        #     if type(range) == Range and index < len(temp) - 1:
-        #         asso_type = range.is_associated(temp[index + 1])
-
-        #         print 'asso', asso_type
-        #         if association_type is None:
-        #             association_type = asso_type
-        #         elif associated_type != asso_type:
-        #             association_type = None
-        #             break
-
-        # print 'ASSO', association_type
-
-        # if association_type is None:
-        #     return ValueError('All items must be Ranges and associated')
-
-        filtered_remaining_ranges = []
-
-        for range in remaining_ranges: # filter items in remaining_ranges that match valid indexes from first countif layer
-            filtered_remaining_cells = []
-            filtered_remaining_range = []
-
-            for index, item in enumerate(range.values):
-                if index in indexes:
-                    filtered_remaining_cells.append(range.addresses[index]) # reconstructing cells from indexes
-                    filtered_remaining_range.append(item) # reconstructing values from indexes
-
-            # WARNING HERE
-            filtered_remaining_ranges.append(Range(filtered_remaining_cells, filtered_remaining_range))
-
-        new_tuple = ()
-
-        for index, range in enumerate(filtered_remaining_ranges): # rebuild the tuple that will be the argument of next layer
-            new_tuple += (range, remaining_criteria[index])
-
-        return min(countifs(*new_tuple), len(indexes)) # only consider the minimum number across all layer responses
+        # values matching all criteria, the ranges being compared on their common length
+        return len(_criteria_rows(arg_list[0::2], arg_list[1::2]))
 
     else:
         return float('inf')
@@ -477,6 +460,33 @@ def linest(*args, **kwargs):  # Excel reference: https://support.office.com/en-u
     return coefs
 
 
+def _lookup_key(value):
+    # Excel's order for approximate lookups: numbers, then text, then booleans, the empty values being left out
+    kind = value_kind(value)
+    if kind == EMPTY:
+        return None
+    elif kind == NUMBER:
+        return (0, value)
+    elif kind == TEXT:
+        return (1, value.lower())
+    elif kind == BOOLEAN:
+        return (2, value)
+    else: # ExcelErrors, dates...
+        return (3, 0)
+
+
+def _count_descending(keys, key):
+    # number of keys bigger than or equal to key, keys being sorted descending
+    low, high = 0, len(keys)
+    while low < high:
+        middle = (low + high) // 2
+        if keys[middle] >= key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
 def lookup(value, lookup_range, result_range = None):  # Excel reference: https://support.office.com/en-us/article/LOOKUP-function-446d94af-663b-451d-8251-369d5e3864cb
 
     # TODO
@@ -485,6 +495,23 @@ def lookup(value, lookup_range, result_range = None):  # Excel reference: https:
 
     # TODO: note, may return the last equal value
 
+    if result_range is None:
+        result_range = lookup_range
+
+    lookup_keys = lookup_range.lookup_keys(_lookup_key)
+    if lookup_keys.ascending and len(lookup_keys.keys) == len(lookup_range) and (not lookup_keys.keys or lookup_keys.keys[-1][0] == 0):
+        # only sorted numbers, the first bigger value is found by bisection
+        i = bisect_right(lookup_keys.keys, (0, value))
+
+        if i == 0:
+            return ExcelError('#VALUE!', 'No numeric data found in the lookup range')
+        elif len(lookup_range) == 1:
+            return ExcelError('#VALUE!', 'All values in the lookup range are bigger than %s' % value)
+        elif result_range.nrows == 1 or result_range.ncols == 1:
+            return result_range.get(i)
+        else:
+            return result_range.values[i - 1]
+
     # index of the last numeric value
     lastnum = -1
     for i,v in enumerate(lookup_range.values):
@@ -494,7 +521,7 @@ def lookup(value, lookup_range, result_range = None):  # Excel reference: https:
             else:
                 lastnum = i
 
-    output_range = result_range.values if result_range is not None else lookup_range.values
+    output_range = result_range.values
 
     if lastnum < 0:
         return ExcelError('#VALUE!', 'No numeric data found in the lookup range')
@@ -509,6 +536,19 @@ def lookup(value, lookup_range, result_range = None):  # Excel reference: https:
                 return output_range[i-1]
 
 
+# keys of the Range.lookup_index used by match, the None values being left out as in range_values
+
+def _match_number_key(value):
+    # non numbers never equal a float, but count in the positions
+    if value is None:
+        return None
+    return float(value) if is_number(value) else value
+
+
+def _match_text_key(value):
+    return str(value).lower() if value is not None else None
+
+
 def match(lookup_value, lookup_range, match_type=1):  # Excel reference: https://support.office.com/en-us/article/MATCH-function-e8dffd45-c762-47d6-bf89-533f4a37673a
 
     if not isinstance(lookup_range, Range):
@@ -523,31 +563,18 @@ def match(lookup_value, lookup_range, match_type=1):  # Excel reference: https:/
             value = 0
 
         return value;
-    def type_convert_float(value):
-        if is_number(value):
-            value = float(value)
-        else:
-            value = None
-
-        return value
 
     lookup_value = type_convert(lookup_value)
 
-    range_values = [x for x in lookup_range.values if x is not None] # filter None values to avoid asc/desc order errors
-    range_length = len(range_values)
+    if match_type != 0: # None values are left out to avoid asc/desc order errors
+        lookup_keys = lookup_range.lookup_keys(_lookup_key)
 
     if match_type == 1:
         # Verify ascending sort
+        if not lookup_keys.ascending:
+            return ExcelError('#VALUE!', 'for match_type 1, lookup_range must be sorted ascending')
 
-        posMax = -1
-        for i in range(range_length):
-            current = type_convert(range_values[i])
-
-            if i < range_length - 1:
-                if current > type_convert(range_values[i + 1]):
-                    return ExcelError('#VALUE!', 'for match_type 1, lookup_range must be sorted ascending')
-            if current <= lookup_value:
-                posMax = i
+        posMax = bisect_right(lookup_keys.keys, _lookup_key(lookup_value)) - 1
         if posMax == -1:
             return ExcelError('#VALUE!','no result in lookup_range for match_type 1')
         return posMax +1 #Excel starts at 1
@@ -557,23 +584,19 @@ def match(lookup_value, lookup_range, match_type=1):  # Excel reference: https:/
         try:
             if is_number(lookup_value):
                 lookup_value = float(lookup_value)
-                output = [type_convert_float(x) for x in range_values].index(lookup_value) + 1
+                output = lookup_range.lookup_index(_match_number_key)[lookup_value] + 1
             else:
-                output = [str(x).lower() for x in range_values].index(lookup_value) + 1
+                output = lookup_range.lookup_index(_match_text_key)[lookup_value] + 1
             return output
         except:
             return ExcelError('#VALUE!', '%s not found' % lookup_value)
 
     elif match_type == -1:
         # Verify descending sort
-        posMin = -1
-        for i in range((range_length)):
-            current = type_convert(range_values[i])
-
-            if i is not range_length-1 and current < type_convert(range_values[i+1]):
-               return ExcelError('#VALUE!','for match_type -1, lookup_range must be sorted descending')
-            if current >= lookup_value:
-               posMin = i
+        if not lookup_keys.descending:
+            return ExcelError('#VALUE!','for match_type -1, lookup_range must be sorted descending')
+
+        posMin = _count_descending(lookup_keys.keys, _lookup_key(lookup_value)) - 1
         if posMin == -1:
             return ExcelError('#VALUE!', 'no result in lookup_range for match_type -1')
         return posMin +1  # Excel starts at 1
@@ -801,19 +824,16 @@ def sumif(range, criteria, sum_range = None): # Excel reference: https://support
     if isinstance(criteria, Range) and not isinstance(criteria , (str, bool)): # ugly...
         return 0
 
-    indexes = find_corresponding_index(range.values, criteria)
+    rows = _criteria_rows([range], [criteria])
 
     if sum_range:
         if not isinstance(sum_range, Range):
             return TypeError('%s must be a Range' % str(sum_range))
 
-        def f(x):
-            return sum_range.values[x] if x < sum_range.length else 0
-
-        return sum(map(f, indexes))
+        return sum(sum_range.values_at(rows))
 
     else:
-        return sum([range.values[x] for x in indexes])
+        return sum(range.values_at(rows))
 
 
 def sumifs(*args):
@@ -829,26 +849,15 @@ def sumifs(*args):
         return TypeError('At least one criteria and criteria range should be provided.')
     if int(nb_criteria) != nb_criteria:
         return TypeError('Number of criteria an criteria ranges should be equal.')
-    nb_criteria = int(nb_criteria)
 
     # separate arguments
     sum_range = args[0]
     criteria_ranges = args[1::2]
-    criteria = args[2::2]
-    index = list(range(0, len(sum_range)))
+    criteria = [str(criterion) for criterion in args[2::2]]
 
-    for i in range(nb_criteria):
+    rows = _criteria_rows(criteria_ranges, criteria, len(sum_range))
 
-        criteria_range = criteria_ranges[i]
-        criterion = str(criteria[i])
-
-        index_tmp = find_corresponding_index(criteria_range.values, criterion)
-        index = np.intersect1d(index, index_tmp)
-
-    sum_select = [sum_range.values[i] for i in index]
-    res = sum(sum_select)
-
-    return res
+    return sum(sum_range.values_at(rows))
 
 
 def sumproduct(*ranges): # Excel reference: https://support.office.com/en-us/article/SUMPRODUCT-function-16753e75-9f68-4874-94ac-4d2145a2fd2e
@@ -858,6 +867,12 @@ def sumproduct(*ranges): # Excel reference: https://support.office.com/en-us/art
         if len(r.values) == 0:
             return 0
 
+    arrays = [r.as_array() for r in range_list]
+    if all((kinds == NUMBER).all() for _, kinds in arrays) and len(set(len(kinds) for _, kinds in arrays)) == 1:
+        # only numbers: multiply the arrays, with python numbers unless they are all floats
+        products = reduce(np.multiply, [a if a.dtype.kind == 'f' else a.astype(object) for a, _ in arrays])
+        return reduce(lambda X, Y: X + Y, products.tolist())
+
     for range in range_list:
         for item in range.values:
             # If there is an ExcelError inside a Range, sumproduct should output an ExcelError
@@ -998,19 +1013,30 @@ def vlookup(lookup_value, table_array, col_index_num, range_lookup = True): # ht
     result_column = table_array.get(0, col_index_num)
 
     if not range_lookup:
-        if lookup_value not in first_column.values:
+        i = first_column.lookup_index().get(lookup_value)
+        if i is None:
             return ExcelError('#N/A', 'lookup_value not in first column of table_array')
         else:
-            i = first_column.values.index(lookup_value)
             ref = first_column.order[i]
     else:
         i = None
-        for v in first_column.values:
-            if lookup_value >= v:
-                i = first_column.values.index(v)
+        lookup_keys = first_column.lookup_keys(_lookup_key)
+        key = _lookup_key(lookup_value)
+
+        if lookup_keys.ascending and key is not None:
+            # last key smaller than or equal to lookup_value, at its first occurrence
+            last = bisect_right(lookup_keys.keys, key) - 1
+            if last >= 0:
+                i = lookup_keys.positions[bisect_left(lookup_keys.keys, lookup_keys.keys[last])]
                 ref = first_column.order[i]
-            else:
-                break
+        else:
+            values = first_column.values
+            for v in values:
+                if lookup_value >= v:
+                    i = values.index(v)
+                    ref = first_column.order[i]
+                else:
+                    break
 
         if i is None:
             return ExcelError('#N/A', 'lookup_value smaller than all values of table_array')
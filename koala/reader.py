@@ -5,7 +5,6 @@ import re
 import os
 import json
 
-from openpyxl.formula.translate import Translator
 from openpyxl.cell.text import Text
 from openpyxl.utils.indexed_list import IndexedList
 from openpyxl.xml.functions import iterparse, fromstring
@@ -31,8 +30,13 @@ with open('%s/functions.json' % curfile, 'r') as file:
     existing = json.load(file)
 
 from zipfile import ZipFile, ZIP_DEFLATED, BadZipfile
+from multiprocessing import Pool
+from collections import OrderedDict
+
+from six import string_types
 
 from koala.Cell import Cell
+from koala.ast import FormulaTemplate
 from koala.utils import CELL_REF_RE, col2num, safe_iterator
 
 FLOAT_REGEX = re.compile(r"\.|[E-e]")
@@ -101,132 +105,311 @@ def read_named_ranges(archive):
 
     return dict
 
-def read_cells(archive, ignore_sheets = [], ignore_hidden = False):
-    global debug
+def read_shared_strings(archive):
+    """Read the shared string table of a workbook, if any"""
+    cts = dict(read_content_types(archive))
+
+    strings_path = cts.get(SHARED_STRINGS) # source: https://bitbucket.org/openpyxl/openpyxl/src/93604327bce7aac5e8270674579af76d390e09c0/openpyxl/reader/excel.py?at=default&fileviewer=file-view-default
+    if strings_path is not None:
+        if strings_path.startswith("/"):
+            strings_path = strings_path[1:]
+        return read_string_table(archive.read(strings_path))
+    else:
+        return []
 
+def read_cells(archive, ignore_sheets = [], ignore_hidden = False, stream = False, workers = None, lazy = False):
     # print('___### Reading Cells from XLSX ###___')
 
     cells = {}
 
-    functions = set()
+    shared_strings = read_shared_strings(archive)
 
-    cts = dict(read_content_types(archive))
+    sheets = [sheet for sheet in detect_worksheets(archive) if sheet['title'] not in ignore_sheets]
 
-    strings_path = cts.get(SHARED_STRINGS) # source: https://bitbucket.org/openpyxl/openpyxl/src/93604327bce7aac5e8270674579af76d390e09c0/openpyxl/reader/excel.py?at=default&fileviewer=file-view-default
-    if strings_path is not None:
-        if strings_path.startswith("/"):
-            strings_path = strings_path[1:]
-        shared_strings = read_string_table(archive.read(strings_path))
+    if lazy:
+        return LazyCells(archive, sheets, shared_strings, ignore_hidden, stream)
+    elif workers is not None and workers > 1 and len(sheets) > 1:
+        for sheet_cells in _read_sheets_in_pool(archive, sheets, shared_strings, ignore_hidden, stream, workers):
+            cells.update(sheet_cells)
     else:
-        shared_strings = []
+        for sheet in sheets:
+            cells.update(read_sheet_cells(archive, sheet, shared_strings, ignore_hidden, stream))
 
-    for sheet in detect_worksheets(archive):
-        sheet_name = sheet['title']
+    return cells
 
-        function_map = {}
+class LazyCells(dict):
+    """
+    Cells of a workbook, where each sheet is only read the first time one of its cells is looked up.
 
-        if sheet_name in ignore_sheets: continue
+    Operations which need all the cells (iteration, len, keys(), ...) read all the remaining sheets.
+    The archive must stay readable until all the needed sheets have been read.
+    """
 
-        root = fromstring(archive.read(sheet['path'])) # it is necessary to use cElementTree from xml module, otherwise root.findall doesn't work as it should
+    def __init__(self, archive, sheets, shared_strings, ignore_hidden = False, stream = False):
+        super(LazyCells, self).__init__()
+        self.archive = archive
+        self.shared_strings = shared_strings
+        self.ignore_hidden = ignore_hidden
+        self.stream = stream
+        self.unread_sheets = OrderedDict((sheet['title'], sheet) for sheet in sheets)
+
+    def read_sheet(self, sheet_name):
+        sheet = self.unread_sheets.pop(sheet_name, None)
+        if sheet is not None:
+            dict.update(self, read_sheet_cells(self.archive, sheet, self.shared_strings, self.ignore_hidden, self.stream))
+
+    def read_all(self):
+        for sheet_name in list(self.unread_sheets.keys()):
+            self.read_sheet(sheet_name)
+
+    def _read_sheet_of(self, address):
+        if self.unread_sheets and isinstance(address, string_types) and '!' in address:
+            self.read_sheet(address.split('!')[0])
+
+    def __missing__(self, address):
+        if self.unread_sheets:
+            self._read_sheet_of(address)
+            if dict.__contains__(self, address):
+                return dict.__getitem__(self, address)
+        raise KeyError(address)
+
+    def __contains__(self, address):
+        self._read_sheet_of(address)
+        return dict.__contains__(self, address)
+
+    def get(self, address, default = None):
+        self._read_sheet_of(address)
+        return dict.get(self, address, default)
+
+    def __setitem__(self, address, cell):
+        self._read_sheet_of(address)
+        dict.__setitem__(self, address, cell)
+
+    def __delitem__(self, address):
+        self._read_sheet_of(address)
+        dict.__delitem__(self, address)
+
+    def pop(self, address, *args):
+        self._read_sheet_of(address)
+        return dict.pop(self, address, *args)
+
+    def setdefault(self, address, default = None):
+        self._read_sheet_of(address)
+        return dict.setdefault(self, address, default)
+
+    def update(self, *args, **kwargs):
+        for address, cell in dict(*args, **kwargs).items():
+            self[address] = cell
+
+    def __iter__(self):
+        self.read_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.read_all()
+        return dict.__len__(self)
+
+    def __bool__(self):
+        return len(self.unread_sheets) > 0 or dict.__len__(self) > 0
+
+    __nonzero__ = __bool__
+
+    def keys(self):
+        self.read_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.read_all()
+        return dict.values(self)
+
+    def items(self):
+        self.read_all()
+        return dict.items(self)
+
+    def copy(self):
+        self.read_all()
+        return dict(self)
+
+    def __reduce__(self):
+        # the archive can't be pickled, pickle all the cells instead
+        self.read_all()
+        return (dict, (dict(self),))
+
+def _read_sheets_in_pool(archive, sheets, shared_strings, ignore_hidden, stream, workers):
+    """
+    Parse sheets in a process pool, one task per sheet.
 
-        hidden_cols = False
-        nb_hidden = 0
+    The shared strings are sent once to each worker. Workers reopen the
+    archive when it comes from a file on disk, otherwise the raw XML of the
+    sheet is sent along with the task.
+    """
+    source = archive.filename if archive.filename is not None and os.path.isfile(archive.filename) else None
 
-        if ignore_hidden:
-            hidden_col_min = None
-            hidden_col_max = None
+    jobs = []
+    for sheet in sheets:
+        # biggest sheets first, so that they don't end up alone at the end
+        size = archive.getinfo(sheet['path']).file_size
+        xml_source = archive.read(sheet['path']) if source is None else None
+        jobs.append((size, (source, xml_source, sheet, ignore_hidden, stream)))
+    jobs = [job for size, job in sorted(jobs, key = lambda job: -job[0])]
 
-            for col in root.findall('.//{%s}cols/*' % SHEET_MAIN_NS):
-                if 'hidden' in col.attrib and col.attrib['hidden'] == '1':
-                    hidden_cols = True
-                    hidden_col_min = int(col.attrib['min'])
-                    hidden_col_max = int(col.attrib['max'])
+    pool = Pool(min(workers, len(jobs)), initializer = _init_sheet_worker, initargs = (list(shared_strings),))
+    try:
+        return pool.map(_read_sheet_job, jobs, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
 
-        for c in root.findall('.//{%s}c/*/..' % SHEET_MAIN_NS):
-            cell_data_type = c.get('t', 'n') # if no type assigned, assign 'number'
-            cell_address = c.attrib['r']
+_worker_shared_strings = None
 
-            skip = False
+def _init_sheet_worker(shared_strings):
+    global _worker_shared_strings
+    _worker_shared_strings = shared_strings
 
-            if hidden_cols:
-                found = re.search(CELL_REF_RE, cell_address)
-                col = col2num(found.group(1))
+def _read_sheet_job(job):
+    source, xml_source, sheet, ignore_hidden, stream = job
 
-                if col >= hidden_col_min and col <= hidden_col_max:
-                    nb_hidden += 1
-                    skip = True
+    if xml_source is not None:
+        if stream:
+            return _stream_sheet_cells(BytesIO(xml_source), sheet['title'], _worker_shared_strings, ignore_hidden)
+        else:
+            return _parse_sheet_cells(xml_source, sheet['title'], _worker_shared_strings, ignore_hidden)
+    else:
+        archive = read_archive(source)
+        try:
+            return read_sheet_cells(archive, sheet, _worker_shared_strings, ignore_hidden, stream)
+        finally:
+            archive.close()
 
-            if not skip:
-                cell = {'a': '%s!%s' % (sheet_name, cell_address), 'f': None, 'v': None}
-                if debug:
-                    print('Cell', cell['a'])
-                for child in c:
-                    child_data_type = child.get('t', 'n') # if no type assigned, assign 'number'
-
-                    if child.tag == '{%s}f' % SHEET_MAIN_NS :
-                        if 'ref' in child.attrib: # the first cell of a shared formula has a 'ref' attribute
-                            if debug:
-                                print('*** Found definition of shared formula ***', child.text, child.attrib['ref'])
-                            if "si" in child.attrib:
-                                function_map[child.attrib['si']] = (child.attrib['ref'], Translator(str('=' + child.text), cell_address)) # translator of openpyxl needs a unicode argument that starts with '='
-                            # else:
-                            #     print "Encountered cell with ref but not si: ", sheet_name, child.attrib['ref']
-                        if child_data_type == 'shared':
-                            if debug:
-                                print('*** Found child %s of shared formula %s ***' % (cell_address, child.attrib['si']))
-
-                            ref = function_map[child.attrib['si']][0]
-                            formula = function_map[child.attrib['si']][1]
-
-                            translated = formula.translate_formula(cell_address)
-                            cell['f'] = translated[1:] # we need to get rid of the '='
-
-                        else:
-                            cell['f'] = child.text
-
-                    elif child.tag == '{%s}v' % SHEET_MAIN_NS :
-                        if cell_data_type == 's' or cell_data_type == 'str': # value is a string
-                            try: # if it fails, it means that cell content is a string calculated from a formula
-                                cell['v'] = shared_strings[int(child.text)]
-                            except:
-                                cell['v'] = child.text
-                        elif cell_data_type == 'b':
-                            cell['v'] = bool(int(child.text))
-                        elif cell_data_type == 'n':
-                            cell['v'] = _cast_number(child.text)
-
-                    elif child.text is None:
-                        continue
-
-                if cell['f'] is not None:
-
-                    pattern = re.compile(r"([A-Z][A-Z0-9]*)\(")
-                    found = re.findall(pattern, cell['f'])
-
-                    map(lambda x: functions.add(x), found)
-
-                if cell['f'] is not None or cell['v'] is not None:
-                    should_eval = 'always' if cell['f'] is not None and 'OFFSET' in cell['f'] else 'normal'
-
-                    # cleaned_formula = cell['f']
-                    cleaned_formula = cell['f'].replace(", ", ",") if cell['f'] is not None else None
-                    if "!" in cell_address:
-                        cells[cell_address] = Cell(cell_address, sheet_name, value = cell['v'], formula = cleaned_formula, should_eval=should_eval)
-                    else:
-                        cells[sheet_name + "!" + cell_address] = Cell(cell_address, sheet_name, value = cell['v'], formula = cleaned_formula, should_eval=should_eval)
-
-        # if nb_hidden > 0:
-            # print('Ignored %i hidden cells in sheet %s' % (nb_hidden, sheet_name))
-
-    # print('Nb of different functions %i' % len(functions))
-    # print(functions)
-
-    # for f in functions:
-    #     if f not in existing:
-    #         print('== Missing function: %s' % f)
+def read_sheet_cells(archive, sheet, shared_strings, ignore_hidden = False, stream = False):
+    """
+    Read the cells of a single worksheet.
+
+    With stream = True, the sheet is parsed incrementally: each <c> element is
+    turned into a Cell as soon as it is closed and parsed rows are freed right
+    away, so memory grows with the size of a row instead of the whole sheet.
+    """
+    if stream:
+        return _stream_sheet_cells(archive.open(sheet['path']), sheet['title'], shared_strings, ignore_hidden)
+    else:
+        return _parse_sheet_cells(archive.read(sheet['path']), sheet['title'], shared_strings, ignore_hidden)
+
+def _parse_sheet_cells(xml_source, sheet_name, shared_strings, ignore_hidden):
+    cells = {}
+    function_map = {}
+
+    root = fromstring(xml_source) # it is necessary to use cElementTree from xml module, otherwise root.findall doesn't work as it should
+
+    hidden_cols = None
+
+    if ignore_hidden:
+        for col in root.findall('.//{%s}cols/*' % SHEET_MAIN_NS):
+            hidden_cols = _hidden_col_bounds(col, hidden_cols)
+
+    for c in root.findall('.//{%s}c/*/..' % SHEET_MAIN_NS):
+        _read_cell(c, sheet_name, shared_strings, function_map, hidden_cols, cells)
+
+    return cells
+
+def _stream_sheet_cells(xml_source, sheet_name, shared_strings, ignore_hidden):
+    cells = {}
+    function_map = {}
+
+    hidden_cols = None
+    sheet_data = None
+
+    for event, element in iterparse(xml_source, events = ('start', 'end')):
+        if event == 'start':
+            if element.tag == '{%s}sheetData' % SHEET_MAIN_NS:
+                sheet_data = element
+
+        elif element.tag == '{%s}c' % SHEET_MAIN_NS:
+            if len(element) > 0:
+                _read_cell(element, sheet_name, shared_strings, function_map, hidden_cols, cells)
+
+        elif element.tag == '{%s}row' % SHEET_MAIN_NS:
+            # cells of the row have all been read, free them
+            element.clear()
+            if sheet_data is not None:
+                sheet_data.clear()
+
+        elif element.tag == '{%s}col' % SHEET_MAIN_NS:
+            if ignore_hidden:
+                hidden_cols = _hidden_col_bounds(element, hidden_cols)
 
     return cells
 
+def _hidden_col_bounds(col, hidden_cols):
+    if 'hidden' in col.attrib and col.attrib['hidden'] == '1':
+        return (int(col.attrib['min']), int(col.attrib['max']))
+    return hidden_cols
+
+def _read_cell(c, sheet_name, shared_strings, function_map, hidden_cols, cells):
+    cell_data_type = c.get('t', 'n') # if no type assigned, assign 'number'
+    cell_address = c.attrib['r']
+
+    if hidden_cols is not None:
+        found = re.search(CELL_REF_RE, cell_address)
+        col = col2num(found.group(1))
+
+        if col >= hidden_cols[0] and col <= hidden_cols[1]:
+            return
+
+    cell = {'a': '%s!%s' % (sheet_name, cell_address), 'f': None, 'v': None, 't': None}
+    if debug:
+        print('Cell', cell['a'])
+    for child in c:
+        child_data_type = child.get('t', 'n') # if no type assigned, assign 'number'
+
+        if child.tag == '{%s}f' % SHEET_MAIN_NS :
+            if 'ref' in child.attrib: # the first cell of a shared formula has a 'ref' attribute
+                if debug:
+                    print('*** Found definition of shared formula ***', child.text, child.attrib['ref'])
+                if "si" in child.attrib:
+                    # the whole group is compiled once from this template
+                    function_map[child.attrib['si']] = (child.attrib['ref'], FormulaTemplate(child.text.replace(", ", ","), sheet_name, cell_address))
+                # else:
+                #     print "Encountered cell with ref but not si: ", sheet_name, child.attrib['ref']
+            if child_data_type == 'shared':
+                if debug:
+                    print('*** Found child %s of shared formula %s ***' % (cell_address, child.attrib['si']))
+
+                ref = function_map[child.attrib['si']][0]
+                template = function_map[child.attrib['si']][1]
+
+                cell['f'] = template.formula_at(cell_address)
+                cell['t'] = template
+
+            else:
+                cell['f'] = child.text
+
+        elif child.tag == '{%s}v' % SHEET_MAIN_NS :
+            if cell_data_type == 's' or cell_data_type == 'str': # value is a string
+                try: # if it fails, it means that cell content is a string calculated from a formula
+                    cell['v'] = shared_strings[int(child.text)]
+                except:
+                    cell['v'] = child.text
+            elif cell_data_type == 'b':
+                cell['v'] = bool(int(child.text))
+            elif cell_data_type == 'n':
+                cell['v'] = _cast_number(child.text)
+
+        elif child.text is None:
+            continue
+
+    if cell['f'] is not None or cell['v'] is not None:
+        should_eval = 'always' if cell['f'] is not None and 'OFFSET' in cell['f'] else 'normal'
+
+        # cleaned_formula = cell['f']
+        cleaned_formula = cell['f'].replace(", ", ",") if cell['f'] is not None else None
+        new_cell = Cell(cell_address, sheet_name, value = cell['v'], formula = cleaned_formula, should_eval=should_eval)
+        new_cell.formula_template = cell['t']
+
+        if "!" in cell_address:
+            cells[cell_address] = new_cell
+        else:
+            cells[sheet_name + "!" + cell_address] = new_cell
+
 
 def read_rels(archive):
     """Read relationships for a workbook"""
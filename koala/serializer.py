@@ -1,7 +1,10 @@
 from __future__ import absolute_import, print_function
 
+import os
 import json
 import gzip
+import hashlib
+import tempfile
 import networkx
 
 from networkx.classes.digraph import DiGraph
@@ -10,6 +13,7 @@ from networkx.drawing.nx_pydot import write_dot
 from openpyxl.compat import unicode
 
 from koala.Cell import Cell
+from koala.CompactGraph import CompactGraph
 from koala.Range import RangeCore, RangeFactory
 
 SEP = ";;"
@@ -89,7 +93,7 @@ def dump(self, fname):
 
     outfile.close()
 
-def load(fname):
+def load(fname, compact_graph = False, compile = True):
 
     def clean_bool(string):
         if string == "0":
@@ -114,7 +118,6 @@ def load(fname):
 
     mode = "node0"
     nodes = []
-    edges = []
     pointers = set()
     outputs = None
     inputs = None
@@ -135,6 +138,9 @@ def load(fname):
             continue
         elif line == "edges":   
             cellmap = {n.address(): n for n in nodes}
+            # the edges are added one by one, a CompactGraph records them without a list of pairs
+            G = CompactGraph() if compact_graph else DiGraph()
+            G.add_nodes_from(nodes)
             mode = "edges"
             continue
         elif line == "outputs":
@@ -174,11 +180,12 @@ def load(fname):
                 if formula:
                     if 'OFFSET' in formula or 'INDEX' in formula:
                         pointers.add(address)
-                    cell.compile()
+                    if compile:
+                        cell.compile()
                 nodes.append(cell)
         elif mode == "edges":
             source, target = line.split(SEP)
-            edges.append((cellmap[source], cellmap[target]))
+            G.add_edge(cellmap[source], cellmap[target])
         elif mode == "outputs":
             outputs = line.split(SEP)
         elif mode == "inputs":
@@ -187,14 +194,87 @@ def load(fname):
             k,v = line.split(SEP)
             named_ranges[k] = v
 
-    G = DiGraph()
-    G.add_nodes_from(nodes)
-    G.add_edges_from(edges)
-
-    print("Graph loading done, %s nodes, %s edges, %s cellmap entries" % (len(G.nodes()),len(G.edges()),len(cellmap)))
+    print("Graph loading done, %s nodes, %s edges, %s cellmap entries" % (len(G),G.number_of_edges(),len(cellmap)))
 
     return (G, cellmap, named_ranges, pointers, outputs, inputs)
 
+########### cache of compiled workbooks #################
+CACHE_VERSION = 1 # to be bumped whenever the dump format changes
+CACHE_SUFFIX = '.koala.gz'
+CACHE_MAX_SIZE = 1 << 30 # bytes
+
+def workbook_hash(file, **options):
+    """
+    Hash of the xlsx content together with the compile options, used as cache key.
+    """
+    h = hashlib.sha256()
+    if hasattr(file, 'read'):   # file-like object
+        position = file.tell()
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            h.update(chunk)
+        file.seek(position)
+    else:
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    h.update(json.dumps([CACHE_VERSION, options], sort_keys = True).encode('utf-8'))
+    return h.hexdigest()
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + CACHE_SUFFIX)
+
+def cache_store(self, fname):
+    # dump next to the final file and rename, so that concurrent readers never see a partial dump
+    directory = os.path.dirname(fname)
+    fd, tmp = tempfile.mkstemp(suffix = '.tmp', dir = directory)
+    os.close(fd)
+    try:
+        dump(self, tmp)
+        if hasattr(os, 'replace'):
+            os.replace(tmp, fname)
+        else:
+            try:
+                os.rename(tmp, fname)
+            except OSError: # on Windows, when fname was stored meanwhile by another process
+                if not os.path.exists(fname):
+                    raise
+                os.remove(tmp)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def cache_touch(fname):
+    # entries are evicted by modification time, a hit makes an entry the most recent
+    os.utime(fname, None)
+
+def cache_evict(cache_dir, max_size, keep = None):
+    """
+    Remove the least recently used entries of cache_dir until its size is below max_size bytes.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(CACHE_SUFFIX):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError: # removed by another process
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
 ########### based on json #################
 def dump_json(self, fname):
     data = self.asdict()
@@ -238,18 +318,22 @@ def load_json(fname):
 
 
 ########### based on dot #################
+def networkx_graph(self):
+    return self.G.to_networkx() if isinstance(self.G, CompactGraph) else self.G
+
 def export_to_dot(self,fname):
-    write_dot(self.G,fname)
+    write_dot(networkx_graph(self),fname)
 
 
 ########### plotting #################
 def plot_graph(self):
     import matplotlib.pyplot as plt
 
-    pos=networkx.spring_layout(self.G,iterations=2000)
+    G = networkx_graph(self)
+    pos=networkx.spring_layout(G,iterations=2000)
     #pos=networkx.spectral_layout(G)
     #pos = networkx.random_layout(G)
-    networkx.draw_networkx_nodes(self.G, pos)
-    networkx.draw_networkx_edges(self.G, pos, arrows=True)
-    networkx.draw_networkx_labels(self.G, pos)
+    networkx.draw_networkx_nodes(G, pos)
+    networkx.draw_networkx_edges(G, pos, arrows=True)
+    networkx.draw_networkx_labels(G, pos)
     plt.show()
@@ -41,6 +41,14 @@ def is_range(address):
     return address.find(':') > 0
 
 
+def is_whole_range(address):
+    # A:A or 1:1 like ranges, that are clipped to the used area of their sheet
+    if not is_range(address):
+        return False
+    sh, start, end = split_range(address.replace('$', ''))
+    return (start.isalpha() and end.isalpha()) or (start.isdigit() and end.isdigit())
+
+
 split_range_cache = {}
 
 def split_range(rng):
@@ -127,6 +135,118 @@ def max_dimension(cellmap, sheet = None):
     return (rows, cols)
 
 
+class RangeAddresses(object):
+    """
+    Addresses of a rectangle of cells, row by row, generated on demand.
+
+    Behaves like the list of the addresses, which would hold 2**20 strings for A:A.
+    """
+
+    def __init__(self, sheet, start_row, start_col, nrows, ncols):
+        """
+        :param sheet: prefix of the addresses, e.g. 'Sheet1!' or ''
+        :param start_row: row of the first cell
+        :param start_col: column index of the first cell
+        """
+        self.sheet = sheet
+        self.start_row = start_row
+        self.start_col = start_col
+        self.nrows = nrows
+        self.ncols = ncols
+
+    def __len__(self):
+        return self.nrows * self.ncols
+
+    def key(self, index):
+        # (row, col) of the cell at index, like parse_cell_address
+        return (self.start_row + index // self.ncols, num2col(self.start_col + index % self.ncols))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('RangeAddresses index out of range')
+
+        row, col = self.key(index)
+        return '%s%s%s' % (self.sheet, col, row)
+
+    def __iter__(self):
+        return (address for address, _ in self.items())
+
+    def items(self):
+        """
+        :return: generator of (address, (row, col)), without parsing the addresses
+        """
+        cols = [num2col(col) for col in range(self.start_col, self.start_col + self.ncols)]
+        for row in range(self.start_row, self.start_row + self.nrows):
+            for col in cols:
+                yield ('%s%s%s' % (self.sheet, col, row), (row, col))
+
+    def select(self, cellmap):
+        """
+        Addresses which are in cellmap, going through cellmap instead of the rectangle when it is smaller.
+
+        :return: list of (address, (row, col)), row by row
+        """
+        # going through a LazyCells would read all its sheets
+        if type(cellmap) is not dict or len(cellmap) >= len(self):
+            return [item for item in self.items() if item[0] in cellmap]
+
+        indexes = []
+        for address in cellmap:
+            try:
+                indexes.append(self.index(address))
+            except ValueError:
+                pass
+        indexes.sort()
+        return [(self[index], self.key(index)) for index in indexes]
+
+    def clip(self, max_rows, max_cols):
+        """
+        Part of the rectangle within the first max_rows rows and max_cols columns, e.g. the used area of a sheet.
+        """
+        return RangeAddresses(
+            self.sheet, self.start_row, self.start_col,
+            max(0, min(self.nrows, max_rows - self.start_row + 1)),
+            max(0, min(self.ncols, max_cols - self.start_col + 1)))
+
+    def index(self, address):
+        found = CELL_REF_RE.match(address[len(self.sheet):]) if address.startswith(self.sheet) and address.find(':') < 0 else None
+        if found is not None:
+            row = int(found.group(2).replace('$', '')) - self.start_row
+            col = col2num(found.group(1).replace('$', '')) - self.start_col
+            if 0 <= row < self.nrows and 0 <= col < self.ncols:
+                return row * self.ncols + col
+        raise ValueError('%s is not in range' % address)
+
+    def __contains__(self, address):
+        try:
+            self.index(address)
+            return True
+        except Exception:
+            return False
+
+    def __eq__(self, other):
+        if isinstance(other, RangeAddresses):
+            return (self.sheet, self.start_row, self.start_col, self.nrows, self.ncols) == \
+                (other.sheet, other.start_row, other.start_col, other.nrows, other.ncols)
+        elif isinstance(other, (list, tuple)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'RangeAddresses(%r, %r, %r, %r, %r)' % (self.sheet, self.start_row, self.start_col, self.nrows, self.ncols)
+
+
 resolve_range_cache = {}
 
 
@@ -209,20 +329,19 @@ def resolve_range(rng, should_flatten = False, sheet=''):
         #     else:
         #         return B.tolist(), nb_row, nb_col
 
-        # single column
-        if  start_col == end_col:
-            nrows = end_row - start_row + 1
-            data = [ "%s%s%s" % (s,c,r) for (s,c,r) in zip([sheet]*nrows,[start_col]*nrows,list(range(start_row,end_row+1)))]
+        nrows = end_row - start_row + 1
+        ncols = end_col_idx - start_col_idx + 1
 
-            output = data,len(data),1
+        # flat addresses, generated when needed
+        if should_flatten:
+            output = RangeAddresses(sheet, start_row, start_col_idx, nrows, ncols), nrows, ncols
 
-        # single row
-        elif start_row == end_row:
-            ncols = end_col_idx - start_col_idx + 1
-            data = [ "%s%s%s" % (s,num2col(c),r) for (s,c,r) in zip([sheet]*ncols,list(range(start_col_idx,end_col_idx+1)),[start_row]*ncols)]
-            output = data,1,len(data)
+        # single column or row
+        elif start_col == end_col or start_row == end_row:
+            output = list(RangeAddresses(sheet, start_row, start_col_idx, nrows, ncols)), nrows, ncols
 
         # rectangular range
+
         else:
             cells = []
             for r in range(start_row,end_row+1):
@@ -232,12 +351,7 @@ def resolve_range(rng, should_flatten = False, sheet=''):
 
                 cells.append(row)
 
-            if should_flatten:
-                # flatten into one list
-                l = list(flatten(cells, only_lists = True))
-                output = l,len(cells), len(cells[0])
-            else:
-                output = cells, len(cells), len(cells[0])
+            output = cells, len(cells), len(cells[0])
 
         resolve_range_cache[key] = output
         return output
@@ -283,6 +397,122 @@ def num2col(num):
         return s
 
 
+# references as they appear in formulas, used to move formulas around by offset
+CELL_PART = r"\$?[A-Z]{1,3}\$?[1-9][0-9]*"
+ADDRESS_PART = r"(?:%s(?::%s)?|\$?[A-Z]{1,3}:\$?[A-Z]{1,3}|\$?[1-9][0-9]*:\$?[1-9][0-9]*)" % (CELL_PART, CELL_PART)
+ADDRESS_RE = re.compile(r"%s$" % ADDRESS_PART)
+ADDRESS_ITEM_RE = re.compile(r"(\$?)([A-Z]*)(\$?)([0-9]*)$")
+FORMULA_REFERENCE_RE = re.compile(
+    r'("(?:[^"]|"")*")' # string literals are left untouched
+    r"|((?:'(?:[^']|'')+'|[^\W\d][\w.]*)!)?" # optional sheet name
+    r"(?<![\w.$])(%s)(?![\w.(!$])" % ADDRESS_PART, re.UNICODE)
+
+MAX_ROW = 2**20
+MAX_COL = 16384 # XFD
+
+
+def is_reference(reference):
+    """Tells if reference is a cell, range, column or row reference, with an optional sheet name"""
+    return ADDRESS_RE.match(reference.split('!')[-1]) is not None
+
+
+def shift_reference(reference, row_offset, col_offset):
+    """
+    Moves reference by row_offset rows and col_offset columns, like Excel does
+    when a formula is copied. Absolute ($) parts are kept as they are.
+
+    Returns None if reference is not a cell/range reference, and (sheet!)#REF! if it
+    falls outside of the sheet.
+    """
+    if '!' in reference:
+        sheet, address = reference.rsplit('!', 1)
+        sheet += '!'
+    else:
+        sheet, address = '', reference
+
+    if ADDRESS_RE.match(address) is None:
+        return None
+
+    items = []
+    for item in address.split(':'):
+        col_abs, col, row_abs, row = ADDRESS_ITEM_RE.match(item).groups()
+
+        if col:
+            if not col_abs:
+                col_idx = col2num(col) + col_offset
+                if col_idx < 1 or col_idx > MAX_COL:
+                    return sheet + '#REF!'
+                col = num2col(col_idx)
+        if row:
+            if not row_abs:
+                row_idx = int(row) + row_offset
+                if row_idx < 1 or row_idx > MAX_ROW:
+                    return sheet + '#REF!'
+                row = str(row_idx)
+
+        items.append(col_abs + col + row_abs + row)
+
+    return sheet + ':'.join(items)
+
+
+def shift_formula(formula, row_offset, col_offset):
+    """Moves all the relative references of formula by row_offset rows and col_offset columns"""
+
+    def shift(match):
+        if match.group(1) is not None:
+            return match.group(1)
+
+        # like the Translator of openpyxl, the sheet is kept in front of #REF!
+        return (match.group(2) or '') + shift_reference(match.group(3), row_offset, col_offset)
+
+    return FORMULA_REFERENCE_RE.sub(shift, formula)
+
+
+def relative_formula(formula, row, col):
+    """
+    Rewrites the references of formula relatively to the cell at (row, col), in R1C1 style.
+
+    Two cells have the same relative formula if and only if one formula is the
+    copy of the other, e.g. B2*C2 in D2 and B3*C3 in D3 both give R[0]C[-2]*R[0]C[-1].
+    """
+
+    def relative(match):
+        if match.group(1) is not None:
+            return match.group(1)
+
+        items = []
+        for item in match.group(3).split(':'):
+            col_abs, c, row_abs, r = ADDRESS_ITEM_RE.match(item).groups()
+
+            item = ''
+            if r:
+                item += 'R' + r if row_abs else 'R[%i]' % (int(r) - row)
+            if c:
+                item += 'C%i' % col2num(c) if col_abs else 'C[%i]' % (col2num(c) - col)
+            items.append(item)
+
+        return (match.group(2) or '') + ':'.join(items)
+
+    return FORMULA_REFERENCE_RE.sub(relative, formula)
+
+
+def formula_references(formula):
+    """Lists the cell/range references of formula, with unquoted sheet names"""
+    references = []
+
+    for match in FORMULA_REFERENCE_RE.finditer(formula):
+        if match.group(1) is None:
+            sheet = match.group(2)
+            if sheet is None:
+                references.append(match.group(3))
+            else:
+                if sheet.startswith("'"):
+                    sheet = sheet[1:-2].replace("''", "'") + '!'
+                references.append(sheet + match.group(3))
+
+    return references
+
+
 def address2index(a):
     sh,c,r = split_address(a)
     return (col2num(c),int(r))
@@ -498,81 +728,149 @@ def int_from_date(date):
 
     return float(delta.days) + (float(delta.seconds) / 86400)
 
-def criteria_parser(criteria):
-    if is_number(criteria):
-        def check(x):
+CRITERIA_RE = re.compile(r"(<=|>=|<>|<|>|=)?(.*)$", re.DOTALL)
+WILDCARD_RE = re.compile(r"~([*?~])|([*?])")
+
+# comparisons of criteria, for single values as well as NumPy arrays
+criteria_func_dict = {
+    "<": lambda x, value: x < value,
+    ">": lambda x, value: x > value,
+    ">=": lambda x, value: x >= value,
+    "<=": lambda x, value: x <= value,
+    "<>": lambda x, value: x != value,
+    "=": lambda x, value: x == value,
+}
+
+
+class Criteria(object):
+    """
+    Predicate of a criteria of the *IF functions, such as 10, '>=10', 'abc' or 'a*c'. Text is compared without case
+    and may hold Excel wildcards: * for any characters, ? for any character and ~ to escape them.
+
+    Calling it checks a single value, numbers_mask and texts_mask check NumPy arrays of values.
+    """
+
+    def __init__(self, criteria):
+        self.number = None  # criteria given as a number
+        self.operator = None
+        self.value = None  # float compared to numbers, or lowercase text
+        self.pattern = None  # compiled regex when the text holds wildcards
+
+        if is_number(criteria):
+            self.number = float(criteria)
+        elif isinstance(criteria, string_types):
+            operator, value = CRITERIA_RE.match(criteria).groups()
+            self.operator = operator or ''
+
+            if operator and is_number(value):
+                self.value = float(value)
+            elif self.operator in ('', '=', '<>'):
+                self.value, self.pattern = parse_wildcards(value.lower())
+            else:
+                self.value = value.lower()
+        else:
+            raise Exception('Could\'t parse criteria %s' % criteria)
+
+    def __call__(self, x):
+        if self.number is not None:
             try:
-                x = float(x)
+                return float(x) == self.number
             except:
                 return False
-            return x == float(criteria) #and type(x) == type(criteria)
-    elif type(criteria) == str:
-        search = re.search('(\W*)(.*)', criteria.lower()).group
-        operator = search(1)
-        value = search(2)
-        value = float(value) if is_number(value) else str(value)
-
-        if operator == '<':
-            def check(x):
-                if not is_number(x):
-                    return False # Excel returns False when a string is compared with a value
-                return x < value
-        elif operator == '>':
-            def check(x):
-                if not is_number(x):
-                    return False # Excel returns False when a string is compared with a value
-                return x > value
-        elif operator == '>=':
-            def check(x):
-                if not is_number(x):
-                    return False # Excel returns False when a string is compared with a value
-                return x >= value
-        elif operator == '<=':
-            def check(x):
-                if not is_number(x):
-                    return False # Excel returns False when a string is compared with a value
-                return x <= value
-        elif operator == '<>':
-            def check(x):
-                if not is_number(x):
-                    return False # Excel returns False when a string is compared with a value
-                return x != value
-        elif operator == '=' and is_number(value):
-            def check(x):
-                if not is_number(x):
-                    return False # Excel returns False when a string is compared with a value
-                return x == value
-        elif operator == '=':
-            def check(x):
-                return str(x).lower() == str(value)
+        elif isinstance(self.value, float):
+            if not is_number(x):
+                return False # Excel returns False when a string is compared with a value
+            elif isinstance(x, string_types):
+                return self.operator == '<>'
+            return criteria_func_dict[self.operator](x, self.value)
+        elif self.pattern is not None:
+            # wildcards only match text
+            matched = isinstance(x, string_types) and self.pattern.match(x.lower()) is not None
+            return matched != (self.operator == '<>')
+        elif self.operator in ('', '=', '<>'):
+            return (criteria_text(x) == self.value) != (self.operator == '<>')
+        elif isinstance(x, string_types):
+            return criteria_func_dict[self.operator](x.lower(), self.value)
         else:
-            def check(x):
-                return str(x).lower() == criteria.lower()
-    else:
-        raise Exception('Could\'t parse criteria %s' % criteria)
+            return False
+
+    @property
+    def on_texts(self):
+        # whether texts_mask checks text values
+        return self.number is None and not isinstance(self.value, float)
+
+    def numbers_mask(self, numbers):
+        """
+        :param numbers: NumPy array of numbers, booleans excluded
+        :return: matching numbers, None if they have to be checked one by one
+        """
+        if self.number is not None:
+            return numbers == self.number
+        elif isinstance(self.value, float):
+            return criteria_func_dict[self.operator](numbers, self.value)
+        elif self.pattern is not None:
+            return [self.operator == '<>'] * len(numbers)
+        else:
+            return None
+
+    def texts_mask(self, texts):
+        """
+        :param texts: NumPy array of lowercase text values, see on_texts
+        :return: matching texts
+        """
+        if self.pattern is not None:
+            match = self.pattern.match
+            return [(match(text) is None) == (self.operator == '<>') for text in texts]
+        elif self.operator == '':
+            return texts == self.value
+        else:
+            return criteria_func_dict[self.operator](texts, self.value)
 
-    return check
 
+def criteria_text(x):
+    # text compared to text criteria, empty cells being ''
+    return '' if x is None else str(x).lower()
 
-def find_corresponding_index(list, criteria):
-    t = tuple(list)
-    return _find_corresponding_index(t, criteria)
 
+def parse_wildcards(text):
+    # 'a*b?' => ('a*b?', regex), 'a~*b' => ('a*b', None)
+    parts = []
+    has_wildcards = False
+    position = 0
+    for found in WILDCARD_RE.finditer(text):
+        parts.append(re.escape(text[position:found.start()]))
+        if found.group(1):
+            parts.append(re.escape(found.group(1)))
+        else:
+            parts.append('.*' if found.group(2) == '*' else '.')
+            has_wildcards = True
+        position = found.end()
+    parts.append(re.escape(text[position:]))
 
-@lru_cache(maxsize=1024)
-def _find_corresponding_index(l, criteria):
+    if has_wildcards:
+        return text, re.compile(''.join(parts) + r'\Z', re.DOTALL)
+    else:
+        return WILDCARD_RE.sub(lambda found: found.group(1), text), None
 
-    # parse criteria
-    check = criteria_parser(criteria)
 
-    # valid = []
+def criteria_parser(criteria):
+    # Criteria are compiled once for each criteria value
+    try:
+        return _criteria_parser(criteria)
+    except TypeError: # unhashable criteria
+        return Criteria(criteria)
 
-    valid = [index for index, item in enumerate(l) if check(item)]
-    # for index, item in enumerate(list):
-    #     if check(item):
-    #         valid.append(index)
 
-    return valid
+@lru_cache(maxsize=1024)
+def _criteria_parser(criteria):
+    return Criteria(criteria)
+
+
+def find_corresponding_index(list, criteria):
+    # the *IF functions of excellib use RangeCore.criteria_mask, cached along with the Range
+    check = criteria_parser(criteria)
+
+    return [index for index, item in enumerate(list) if check(item)]
 
 
 def check_length(range1, range2):
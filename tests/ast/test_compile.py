@@ -2,7 +2,8 @@
 import sys
 import unittest
 
-from koala import Cell, cell2code, RangeCore
+from koala import Cell, cell2code, RangeCore, FormulaTemplate, FormulaCache
+from koala.ast import RangeNode
 
 
 class Test_cell2code(unittest.TestCase):
@@ -72,3 +73,93 @@ class Test_cell2code(unittest.TestCase):
 
         RangeCore
         assert eval(code) == u"hello \"world'"
+
+
+class Test_FormulaTemplate(unittest.TestCase):
+    formulas = [
+        "A1+B2*$C$3",
+        "SUM(A1:A3)+Sheet2!$B1",
+        "VLOOKUP(A1,$B$1:C3,2,FALSE)",
+        "SUMIF(A1:A4,\">2\",B$1:B$4)",
+        "IF(A1>2,\"yes\",C1)",
+        "'Sheet with space'!A1-MyName",
+        "SUM(A:A)+SUM(2:2)",
+    ]
+
+    def assertSameCode(self, formula, anchor, address):
+        template = FormulaTemplate(formula, 'Sheet1', anchor)
+        cell = Cell(address = address, sheet = 'Sheet1', formula = template.formula_at(address))
+
+        code, references = template.instantiate(cell, {'MyName': 'Sheet1!A1'})
+        expected_code, ast = cell2code(cell, {'MyName': 'Sheet1!A1'})
+        expected_references = [(x.tvalue, x.tsubtype) for x in ast.nodes() if isinstance(x, RangeNode)]
+
+        self.assertEqual(code, expected_code)
+        self.assertEqual([tuple(r) for r in references], expected_references)
+
+    def test_same_code(self):
+        for formula in self.formulas:
+            for address in ['D5', 'D6', 'F5', 'AA100']:
+                self.assertSameCode(formula, 'D5', address)
+
+    def test_formula_at(self):
+        template = FormulaTemplate('G1 + 10 * L1 + $A$1', 'Sheet1', 'G1')
+
+        self.assertEqual(template.formula_at('G1'), 'G1 + 10 * L1 + $A$1')
+        self.assertEqual(template.formula_at('G2'), 'G2 + 10 * L2 + $A$1')
+        self.assertEqual(template.formula_at('H3'), 'H3 + 10 * M3 + $A$1')
+
+    def test_not_a_template(self):
+        cell = Cell(address = 'B1', sheet = 'Sheet1', formula = 'OFFSET(A1,1,1)')
+        template = FormulaTemplate('OFFSET(A1,1,1)', 'Sheet1', 'B1')
+
+        self.assertEqual(template.instantiate(cell, {}), None)
+
+        # the range address is written as is in the code of IF with a range
+        cell = Cell(address = 'B1', sheet = 'Sheet1', formula = 'IF(A1:A3>2,1,0)')
+        template = FormulaTemplate('IF(A1:A3>2,1,0)', 'Sheet1', 'B1')
+
+        self.assertEqual(template.instantiate(cell, {}), None)
+
+
+class Test_FormulaCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = FormulaCache()
+
+    def test_relative_copies(self):
+        names = {'MyName': 'Sheet1!A1'}
+
+        for row in range(1, 6):
+            cell = Cell(address = 'D%i' % row, sheet = 'Sheet1', formula = 'B%i*C%i+$A$1+MyName' % (row, row))
+            code, references = self.cache.get(cell, names)
+            expected_code, ast = cell2code(cell, names)
+
+            self.assertEqual(code, expected_code)
+
+        self.assertEqual(self.cache.cache_info().hits, 4)
+        self.assertEqual(self.cache.cache_info().misses, 1)
+        self.assertEqual(self.cache.cache_info().currsize, 1)
+
+    def test_different_formulas(self):
+        # same text but not the same relative formula
+        self.cache.get(Cell(address = 'D1', sheet = 'Sheet1', formula = 'B1*C1'), {})
+        self.cache.get(Cell(address = 'D2', sheet = 'Sheet1', formula = 'B1*C1'), {})
+        # same relative formula on another sheet
+        self.cache.get(Cell(address = 'D2', sheet = 'Sheet2', formula = 'B2*C2'), {})
+        # a named range changes the code
+        self.cache.get(Cell(address = 'D1', sheet = 'Sheet1', formula = 'B1*C1+Rate'), {})
+        self.cache.get(Cell(address = 'D2', sheet = 'Sheet1', formula = 'B2*C2+Rate'), {'Rate': 'Sheet1!A1'})
+
+        self.assertEqual(self.cache.cache_info().hits, 0)
+        self.assertEqual(self.cache.cache_info().misses, 5)
+
+    def test_maxsize(self):
+        cache = FormulaCache(maxsize = 2)
+
+        for i in range(1, 5):
+            cache.get(Cell(address = 'D1', sheet = 'Sheet1', formula = 'B1*%i' % i), {})
+
+        self.assertEqual(cache.cache_info().currsize, 2)
+
+        cache.clear()
+        self.assertEqual(cache.cache_info(), (0, 0, 2, 0))
@@ -1,7 +1,10 @@
 from __future__ import print_function
+import time
 import unittest
 
-from koala.Range import RangeFactory
+from koala.Cell import Cell
+from koala.ExcelError import ExcelError
+from koala.Range import RangeFactory, GroupIndex, EMPTY, NUMBER, BOOLEAN, TEXT, OTHER
 
 Range = RangeFactory()
 
@@ -25,6 +28,160 @@ class Test_Excel(unittest.TestCase):
         range.values = [33, 44, 55]
         self.assertEqual(range.values, [33, 44, 55])
 
+    def test_position(self):
+        range = Range('A1:B2', [1, 2, 3, 4])
+
+        self.assertEqual(range.position((2, 'A')), 2)
+        self.assertEqual(range.position((3, 'A')), None)
+        self.assertEqual(Range.find_associated_cell((2, 'C'), Range('A1:A3', [1, 2, 3])), 'A2')
+
+    def test_as_array(self):
+        range = Range('A1:A6', [1, 2.5, None, True, 'a', ExcelError('#N/A')])
+        numbers, kinds = range.as_array()
+
+        self.assertEqual(numbers.tolist(), [1, 2.5, 0, 0, 0, 0])
+        self.assertEqual(kinds.tolist(), [NUMBER, NUMBER, EMPTY, BOOLEAN, TEXT, OTHER])
+
+        range.values = [3, 4, 5, 6, 7, 8]
+        self.assertEqual(range.as_array()[0].tolist(), [3, 4, 5, 6, 7, 8])
+
+    def test_version(self):
+        cellmap = dict((address, Cell(address, value = i)) for i, address in enumerate(['Sheet1!A1', 'Sheet1!A2']))
+        range = RangeFactory(cellmap)('Sheet1!A1:A2')
+        same_range = RangeFactory(cellmap)('Sheet1!A1:A2')
+        version = range.version
+        self.assertEqual(range.values, [0, 1])
+
+        cellmap['Sheet1!A2'].value = 10
+        self.assertNotEqual(range.version, version)
+        self.assertEqual(same_range.version, range.version)
+        self.assertEqual(range.values, [0, 10])
+        self.assertEqual(range.as_array()[0].tolist(), [0, 10])
+
+    def test_version_of_large_range(self):
+        # building a Range is linear in its size, its cells hashing a short key
+        durations = []
+        for size in [2000, 32000]:
+            cellmap = dict(('Sheet1!A%i' % row, Cell('Sheet1!A%i' % row, value = row)) for row in range(1, size + 1))
+            start = time.time()
+            large_range = RangeFactory(cellmap)('Sheet1!A1:A%i' % size)
+            durations.append(time.time() - start)
+            self.assertIsNotNone(large_range.version)
+        self.assertLess(durations[1], 40 * durations[0] + 1)
+
+    def test_cached_views(self):
+        addresses = ['Sheet1!A1', 'Sheet1!B1', 'Sheet1!A2', 'Sheet1!B2']
+        cellmap = dict((address, Cell(address, value = i)) for i, address in enumerate(addresses))
+        range = RangeFactory(cellmap)('Sheet1!A1:B2')
+        column = range.get(0, 2)
+        self.assertEqual(column.values, [1, 3])
+
+        Range.cache_clear()
+        self.assertIs(range.get(0, 2), column)
+        self.assertEqual(range.values, [0, 1, 2, 3])
+        self.assertEqual(tuple(Range.cache_info()), (3, 0))
+
+        cellmap['Sheet1!B2'].value = 10
+        self.assertEqual(range.get(0, 2).values, [1, 10])
+        self.assertEqual(range.values, [0, 1, 2, 10])
+        self.assertEqual(Range.cache_info().misses, 3)
+
+    def test_shared_values(self):
+        cellmap = dict((address, Cell(address, value = i)) for i, address in enumerate(['Sheet1!A1', 'Sheet1!A2']))
+        range = RangeFactory(cellmap)('Sheet1!A1:A2')
+        values = range.values
+        values[0] = 10
+        self.assertEqual((type(values), range.values, range.values_at([0])), (list, [0, 1], [0]))
+        self.assertIs(range.criteria_mask(0), range.criteria_mask(0))  # built from the shared values
+
+        range.values = [10, 1]
+        self.assertEqual(range.values, [10, 1])
+
+    def test_append(self):
+        addresses = ['Sheet1!A%i' % row for row in range(1, 5)]
+        cellmap = dict((address, Cell(address, value = i)) for i, address in enumerate(addresses))
+        column = RangeFactory(cellmap)('Sheet1!A1:A3')
+        column.position((1, 'A'))
+        doubled = Range.apply_all('multiply', column, 2)
+
+        column.append([('Sheet1!A4', (4, 'A'))])
+        self.assertEqual((column.length, column.values, column.position((4, 'A'))), (4, [0, 1, 2, 3], 3))
+        # the Ranges built from column keep their cells
+        self.assertEqual((doubled.addresses, doubled.values), (addresses[:3], [0, 2, 4]))
+        self.assertEqual((doubled.values_at([2]), doubled.position((4, 'A'))), ([4], None))
+
+    def test_filter(self):
+        range = Range('A1:A3', [1, 2, 3])
+        bool_range = Range('B1:B3', [True, False, True])
+        self.assertIs(Range.filter(range, bool_range), Range.filter(range, bool_range))
+        self.assertEqual(Range.filter(range, bool_range).values, [1, 3])
+
+        bool_range.values = [False, True, True]
+        self.assertEqual(Range.filter(range, bool_range).values, [2, 3])
+        self.assertEqual(range.subset([0, 2, 5]).addresses, ['A1', 'A3'])
+
+    def test_lookup_index(self):
+        range = Range('A1:A4', [1, 'a', None, 1.0])
+        self.assertEqual(range.lookup_index(), {1: 0, 'a': 1, None: 2})
+        self.assertIs(range.lookup_index(), range.lookup_index())
+        self.assertEqual(range.lookup_index(lambda value: value), {1: 0, 'a': 1})
+
+        range.values = [2, 'a', None, 1.0]
+        self.assertEqual(range.lookup_index()[1], 3)
+
+    def test_lookup_keys(self):
+        range = Range('A1:A4', [1, None, 3, 2])
+        lookup_keys = range.lookup_keys(lambda value: value)
+        self.assertEqual((lookup_keys.keys, lookup_keys.positions), ([1, 3, 2], [0, 2, 3]))
+        self.assertEqual((lookup_keys.ascending, lookup_keys.descending), (False, False))
+
+        range.values = [1, None, 3, 4]
+        self.assertTrue(range.lookup_keys(lambda value: value).ascending)
+
+    def test_criteria_mask(self):
+        range = Range('A1:A6', [1, 'b', 'A', None, True, 3.5])
+        self.assertEqual(range.criteria_mask(1).tolist(), [True, False, False, False, True, False])
+        self.assertEqual(range.criteria_mask('>=1').tolist(), [True, False, False, False, True, True])
+        self.assertEqual(range.criteria_mask('a').tolist(), [False, False, True, False, False, False])
+        self.assertIs(range.criteria_mask('a'), range.criteria_mask('a'))
+
+        range.values = ['a', 'b', 'A', None, True, 3.5]
+        self.assertEqual(range.criteria_mask('a').tolist(), [True, False, True, False, False, False])
+        self.assertEqual(range.criteria_mask('<>a').tolist(), [False, True, False, True, True, True])
+        self.assertEqual(range.criteria_mask('?').tolist(), [True, True, True, False, False, False])
+
+    def test_bounded_views(self):
+        # a view per criteria, only the last used ones are kept
+        column = Range('A1:A3', [1, 2, 3])
+        first = column.criteria_mask('>0')
+        for i in range(1, 10 * Range.bounded_views):
+            column.criteria_mask('>%i' % i)
+        self.assertIsNot(column.criteria_mask('>0'), first)
+
+        misses = []
+        for repeat in range(2):
+            for i in range(Range.bounded_views):
+                column.criteria_mask('>%i' % i)
+                column.subset([i])
+            misses.append(Range.cache_info().misses)
+        self.assertEqual(misses[1], misses[0])
+
+    def test_group_index(self):
+        range1 = Range('A1:A4', ['a', 'A', 'b', 'a'])
+        range2 = Range('B1:B4', [1, 1.0, '1', True])
+        group_index = GroupIndex([range1, range2])
+
+        self.assertEqual(group_index.rows(['a', 1]), [0, 1, 3])
+        self.assertEqual(group_index.rows(['=a', '=1']), [0, 1, 3])
+        self.assertEqual(group_index.rows(['b', '1']), [2])
+        self.assertEqual(group_index.rows(['a', '>0']), None)
+        self.assertEqual(group_index.rows(['*', '1']), [0, 1, 2, 3])
+
+        self.assertEqual(Range.group_index([range1, range2]), None) # built when used again
+        self.assertIsInstance(Range.group_index([range1, range2]), GroupIndex)
+        range2.values = [2, 1.0, '1', True]
+        self.assertEqual(Range.group_index([range1, range2]), None)
+
     def test_range_sizes(self):
         range = Range('D1:F2', [1, 2, 3, 4, 5, 6])
 
@@ -104,6 +261,18 @@ class Test_Excel(unittest.TestCase):
 
         self.assertEqual(Range.apply_all('add', range1, range2, (1, 'C')).values, [4, 13, 4])
 
+    def test_apply_all_vectorized(self):
+        range1 = Range('A1:A3', [1.5, None, 3])
+        range2 = Range('B1:B3', [2, 4, 0])
+
+        product = Range.apply_all('multiply', range1, range2)
+        self.assertEqual(product.values, [3, 0, 0])
+        self.assertEqual(product.addresses, ['A1', 'A2', 'A3'])
+        self.assertEqual(product.as_array()[0].tolist(), [3, 0, 0]) # kept for the next operation
+        self.assertEqual(Range.apply_all('is_strictly_superior', product, 1).values, [True, False, False])
+        self.assertIsInstance(Range.apply_all('divide', range1, range2).values[2], ExcelError)
+        self.assertEqual(Range.apply_all('add', Range('A1:A2', ['a', 1]), 1).values, ['a1', 2]) # not vectorized
+
     # SUBSTRACT
     def test_substract_one(self):
         range1 = Range('A1:A3', [1, 10, 3])
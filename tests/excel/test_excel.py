@@ -1,8 +1,11 @@
 import os.path
 import sys
+import shutil
+import tempfile
 import unittest
 
 from koala.reader import read_archive, read_cells
+from koala.serializer import cache_store
 from koala import ExcelCompiler, Spreadsheet
 
 
@@ -34,6 +37,77 @@ class Test_SharedFormula(unittest.TestCase):
         self.assertTrue(nb_int == 21 and nb_float == 3 and nb_bool == 2 and nb_str == 10)
 
 
+class ReaderTestCase(unittest.TestCase):
+
+    def assertSameCells(self, cells, other_cells):
+        self.assertEqual(sorted(cells.keys()), sorted(other_cells.keys()))
+        for address, cell in cells.items():
+            other = other_cells[address]
+            self.assertEqual(cell.address(), other.address())
+            self.assertEqual(cell.value, other.value)
+            self.assertEqual(type(cell.value), type(other.value))
+            self.assertEqual(cell.formula, other.formula)
+            self.assertEqual(cell.should_eval, other.should_eval)
+
+
+class Test_StreamingReader(ReaderTestCase):
+
+    def setUp(self):
+        file_name = os.path.abspath("./tests/files/SharedFormula.xlsx")
+        self.archive = read_archive(file_name)
+
+    def test_same_cells(self):
+        self.assertSameCells(read_cells(self.archive), read_cells(self.archive, stream = True))
+
+    def test_same_cells_ignore_hidden(self):
+        self.assertSameCells(
+            read_cells(self.archive, ignore_hidden = True),
+            read_cells(self.archive, ignore_hidden = True, stream = True))
+
+
+class Test_ParallelReader(ReaderTestCase):
+
+    def setUp(self):
+        self.file_name = os.path.abspath("./tests/files/EmptyCellInRange.xlsx")
+        self.archive = read_archive(self.file_name)
+
+    def test_same_cells(self):
+        self.assertSameCells(read_cells(self.archive), read_cells(self.archive, workers = 2))
+
+    def test_same_cells_from_file_object(self):
+        with open(self.file_name, 'rb') as file:
+            archive = read_archive(file)
+            self.assertSameCells(read_cells(self.archive), read_cells(archive, workers = 2, stream = True))
+
+    def test_spreadsheet(self):
+        sp = Spreadsheet(self.file_name, workers = 2)
+        self.assertEqual(sp.evaluate('Sumifs!B1'), 10)
+
+
+class Test_LazyLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.file_name = os.path.abspath("./tests/ast/basic_evaluation.xlsx")
+
+    def test_unreached_sheets(self):
+        sp = Spreadsheet(self.file_name, outputs = ['Sheet1!D1'], lazy = True)
+        self.assertEqual(sorted(sp.cells.unread_sheets), ['Sheet with space', 'Sheet2'])
+
+        sp = Spreadsheet(self.file_name, outputs = ['Sheet2!B2'], lazy = True)
+        self.assertEqual(list(sp.cells.unread_sheets), ['Sheet with space'])
+
+    def test_evaluation(self):
+        sp = Spreadsheet(self.file_name, outputs = ['Sheet2!B2'], lazy = True)
+        sp.cell_set_value('Sheet1!B2', 1000)
+        self.assertEqual(sp.evaluate('Sheet2!B2'), 1000)
+
+    def test_read_all(self):
+        sp = Spreadsheet(self.file_name, outputs = ['Sheet1!D1'], lazy = True)
+        cells = read_cells(read_archive(self.file_name))
+        self.assertTrue(set(cells.keys()) <= set(sp.cells.keys()))
+        self.assertEqual(len(sp.cells.unread_sheets), 0)
+
+
 class Test_NamedRanges(unittest.TestCase):
     
 
@@ -179,6 +253,125 @@ class Test_Dump(unittest.TestCase):
         self.assertTrue(graph.evaluate('RESULT') == 187)
 
 
+class Test_CompiledCache(unittest.TestCase):
+
+    def setUp(self):
+        self.file_name = os.path.abspath("./tests/ast/basic_evaluation.xlsx")
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def entries(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_hit(self):
+        sp = Spreadsheet.from_file(self.file_name, cache_dir = self.cache_dir, outputs = ['Sheet1!D1'])
+        self.assertEqual(len(self.entries()), 1)
+
+        cached = Spreadsheet.from_file(self.file_name, cache_dir = self.cache_dir, outputs = ['Sheet1!D1'])
+        self.assertEqual(len(self.entries()), 1)
+        self.assertEqual(sorted(cached.cellmap.keys()), sorted(sp.cellmap.keys()))
+
+        cached.cell_set_value('Sheet1!A1', 10)
+        self.assertEqual(cached.evaluate('Sheet1!D1'), 20)
+
+    def test_options_in_key(self):
+        Spreadsheet.from_file(self.file_name, cache_dir = self.cache_dir, outputs = ['Sheet1!D1'])
+        Spreadsheet.from_file(self.file_name, cache_dir = self.cache_dir, outputs = ['Sheet1!D2'])
+        self.assertEqual(len(self.entries()), 2)
+
+    def test_eviction(self):
+        Spreadsheet.from_file(self.file_name, cache_dir = self.cache_dir, outputs = ['Sheet1!D1'])
+        first = self.entries()
+        Spreadsheet.from_file(self.file_name, cache_dir = self.cache_dir, outputs = ['Sheet1!D2'], max_cache_size = 0)
+        entries = self.entries()
+        self.assertEqual(len(entries), 1)
+        self.assertNotEqual(entries, first)
+
+    def test_store_over_entry(self):
+        # e.g. stored meanwhile by another process
+        sp = Spreadsheet.from_file(self.file_name, cache_dir = self.cache_dir, outputs = ['Sheet1!D1'])
+        entries = self.entries()
+        cache_store(sp, os.path.join(self.cache_dir, entries[0]))
+        self.assertEqual(self.entries(), entries)
+
+
+class Test_ExportModule(unittest.TestCase):
+
+    def setUp(self):
+        self.sp = Spreadsheet("./tests/ast/basic_evaluation.xlsx")
+        self.inputs = ['Sheet1!A1', 'Sheet1!B1', 'Sheet1!H22']
+        self.outputs = ['Sheet1!D1', 'Sheet1!F1', 'Sheet1!G9', 'Sheet1!A39', 'Sheet1!N22', 'Sheet1!P1', 'Liste']
+        self.directory = tempfile.mkdtemp()
+        self.fname = os.path.join(self.directory, 'model.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self):
+        module = {}
+        with open(self.fname, 'rb') as f:
+            exec(compile(f.read(), self.fname, 'exec'), module)
+        return module
+
+    def test_same_values(self):
+        self.sp.export_module(self.fname, self.inputs, self.outputs)
+        module = self.load()
+        self.assertEqual(module['INPUTS'], self.inputs)
+
+        for values in [{}, {'Sheet1!A1': 3, 'Sheet1!B1': 20}, {'Sheet1!A1': 0, 'Sheet1!H22': 5}]:
+            sp = Spreadsheet("./tests/ast/basic_evaluation.xlsx")
+            for address, value in values.items():
+                sp.cell_set_value(address, value)
+            results = module['evaluate'](values)
+            for address in self.outputs:
+                self.assertEqual(results[address], sp.evaluate(address))
+
+    def test_constants(self):
+        self.sp.export_module(self.fname, ['Sheet1!A1'], self.outputs)
+        with open(self.fname, 'rb') as f:
+            source = f.read().decode('utf-8')
+        self.assertNotIn('Sheet1!H22', source) # only needed by N22, that doesn't depend on A1
+        self.assertEqual(self.load()['evaluate']()['Sheet1!N22'], 40)
+
+    def test_pointers(self):
+        with self.assertRaises(Exception):
+            self.sp.export_module(self.fname, ['Sheet1!A2'], ['Sheet1!I17'])
+
+    def test_quoted_sheet_name(self):
+        sp = Spreadsheet()
+        sp.cell_add("O'Brien!A1", value = 1)
+        sp.cell_add("O'Brien!A2", value = 2)
+        sp.cell_add('Sheet1!A1', formula = "=SUM('O''Brien'!A1:A2)*'O''Brien'!A2")
+        self.assertEqual(sp.evaluate('Sheet1!A1'), 6)
+
+        sp.export_module(self.fname, ["O'Brien!A1"], ['Sheet1!A1'])
+        with open(self.fname, 'rb') as f:
+            source = f.read().decode('utf-8')
+        self.assertIn('_range(', source.split('def evaluate')[1]) # the range depends on the input
+
+        evaluate = self.load()['evaluate']
+        self.assertEqual(evaluate()['Sheet1!A1'], 6)
+        self.assertEqual(evaluate({"O'Brien!A1": 5})['Sheet1!A1'], 14)
+        self.assertEqual(evaluate()['Sheet1!A1'], 6)
+
+    def test_range_output(self):
+        sp = Spreadsheet()
+        sp.cell_add('Sheet1!A1', value = 1)
+        sp.cell_add('Sheet1!A2', value = 2)
+        sp.cell_add('Sheet1!B1', formula = '=SUM(Sheet1!A1:A2)')
+        sp.export_module(self.fname, ['Sheet1!A1'], ['Sheet1!A1:A2', 'Sheet1!B1'])
+        evaluate = self.load()['evaluate']
+
+        # each call has its own Ranges
+        results = evaluate({'Sheet1!A1': 5})
+        self.assertEqual(results, {'Sheet1!A1:A2': [5, 2], 'Sheet1!B1': 7})
+        results['Sheet1!A1:A2'].append(3)
+        self.assertEqual(evaluate(), {'Sheet1!A1:A2': [1, 2], 'Sheet1!B1': 3})
+        self.assertEqual(results['Sheet1!A1:A2'], [5, 2, 3])
+
+
 class Test_DumpJson(unittest.TestCase):
 
 
@@ -6,7 +6,8 @@ import unittest
 
 from koala.excellib import *
 from koala.ExcelError import ExcelError
-from koala.Range import RangeCore
+from koala.Range import RangeCore, RangeFactory
+from koala.Cell import Cell
 
 
 # https://support.office.com/en-ie/article/power-function-d3f2908b-56f4-4c3f-895a-07fb519c362a
@@ -171,6 +172,32 @@ class Test_Lookup(unittest.TestCase):
         range = Range('A1:A3', [1, 2, 3])
         self.assertEqual(lookup(2, range), 2)
 
+    def test_lookup_unsorted(self):
+        range = Range('A1:A4', [1, 3, 2, 4])
+        self.assertEqual(lookup(2.5, range), 1)
+        self.assertEqual(lookup(2.5, Range('A1:A4', [1, 2, 3, 4])), 2)
+
+
+class Test_Vlookup(unittest.TestCase):
+    def test_exact_lookup(self):
+        values = [1, 'one', 2, 'two', 2.0, 'two again', 'c', 'three']
+        addresses = ['Sheet1!%s%s' % (col, row) for row in range(1, 5) for col in 'AB']
+        table = RangeFactory(dict((address, Cell(address, value = value)) for address, value in zip(addresses, values)))('Sheet1!A1:B4')
+
+        self.assertEqual(vlookup(2, table, 2, False), 'two')
+        self.assertEqual(vlookup('c', table, 2, False), 'three')
+        self.assertIsInstance(vlookup('C', table, 2, False), ExcelError)
+
+    def test_approximate_lookup(self):
+        values = [1, 'one', 2, 'two', 2.0, 'two again', 'c', 'three']
+        addresses = ['Sheet1!%s%s' % (col, row) for row in range(1, 5) for col in 'AB']
+        table = RangeFactory(dict((address, Cell(address, value = value)) for address, value in zip(addresses, values)))('Sheet1!A1:B4')
+
+        # Numbers are sorted before text
+        self.assertEqual(vlookup(2.5, table, 2), 'two')
+        self.assertEqual(vlookup('D', table, 2), 'three')
+        self.assertIsInstance(vlookup(0, table, 2), ExcelError)
+
 
 class Test_Average(unittest.TestCase):
     def test_average(self):
@@ -387,6 +414,22 @@ class Test_SumIfs(unittest.TestCase):
         self.assertEqual(sumifs(sum_range, criteria_range1, '=B', criteria_range2, '>1'), 5)
         self.assertEqual(sumifs(sum_range, criteria_range1, 'B', criteria_range2, '<3'), 2)
 
+    def test_summary_block(self):
+        sum_range = Range('A1:A6', [1, 2, 3, 4, 5, 6])
+        criteria_range1 = Range('B1:B6', ['A', 'B', 'a', 'B', 'A', None])
+        criteria_range2 = Range('C1:C6', [1, 2, '1', 1.0, True, 2])
+
+        # the same ranges with different criteria, answered by their GroupIndex after the first one
+        expected = {('A', 1): 9, ('=a', '=1'): 6, ('B', 1): 4, ('B', '=2'): 2, ('=', 2): 6, ('C', 1): 0}
+        for criteria, result in expected.items():
+            self.assertEqual(sumifs(sum_range, criteria_range1, criteria[0], criteria_range2, criteria[1]), result)
+        self.assertIsNot(Range.group_index([criteria_range1, criteria_range2]), None)
+
+        sum_range.values = [10, 2, 3, 4, 5, 6]
+        self.assertEqual(sumifs(sum_range, criteria_range1, 'A', criteria_range2, 1), 18)
+        criteria_range2.values = [2, 2, '1', 1.0, True, 2]
+        self.assertEqual(sumifs(sum_range, criteria_range1, 'A', criteria_range2, 1), 8)
+
 
 class Test_IsNa(unittest.TestCase):
     # This function might need more solid testing
@@ -584,6 +627,14 @@ class Test_Countif(unittest.TestCase):
 
         self.assertEqual(countif(range, 'e'), 2)
 
+    def test_countif_with_wildcards(self):
+        range = Range('A1:A5', ['apple', 'Apricot', 'banana', 'a*', 7])
+
+        self.assertEqual(countif(range, 'a*'), 3)
+        self.assertEqual(countif(range, 'a~*'), 1)
+        self.assertEqual(countif(range, 'b?nana'), 1)
+        self.assertEqual(countif(range, '<>a*'), 2)
+
     def test_countif_regular(self):
         range = Range('A1:A4', [7, 25, 13, 25])
 
@@ -609,6 +660,17 @@ class Test_Countifs(unittest.TestCase): # more tests might be welcomed
 
         self.assertEqual(countifs(range1, 25, range2, ">100"), 1)
 
+    def test_countifs_mixed_values(self):
+        range1 = Range('A1:A5', ['a', 25, 'A', True, 25])
+        range2 = Range('B1:B5', [100, 102, 201, 20, 'b'])
+
+        self.assertEqual(countifs(range1, 'a', range2, ">100"), 1)
+        self.assertEqual(countifs(range1, 25, range2, "<>100"), 1)
+        self.assertEqual(countifs(range1, 'true', range2, 20), 1)
+
+        range2.values = [100, 102, 201, 20, 300]
+        self.assertEqual(countifs(range1, 25, range2, ">100"), 2)
+
 
 class Test_Mod(unittest.TestCase):
     @unittest.skip('This test fails.')
@@ -711,6 +773,27 @@ class Test_Match(unittest.TestCase):
         self.assertEqual(match('3.3', range, 0), 4)
         self.assertEqual(match(3.3, range, 0), 4)
 
+    def test_mixed_types_in_ascending_mode(self):
+        range = Range('A1:A5', [1, None, 3, 'a', True])
+        # Numbers come before text, then booleans, empty values being left out
+        self.assertEqual(match(2, range), 1)
+        self.assertEqual(match('B', range), 3)
+        self.assertEqual(match(False, range), 3)
+        self.assertEqual(match(True, range, 1), 4)
+
+        range.values = [1, None, 3, 'a', 0]
+        self.assertIsInstance(match(2, range), ExcelError)
+
+    def test_exact_mode_with_empty_values(self):
+        range = Range('A1:A4', [None, 'aab', None, 3])
+        # Empty values are left out
+        self.assertEqual(match('AAB', range, 0), 1)
+        self.assertEqual(match(3, range, 0), 2)
+        self.assertIsInstance(match(4, range, 0), ExcelError)
+
+        range.values = [None, 'aab', None, 4]
+        self.assertEqual(match(4, range, 0), 2)
+
     @unittest.skip('This test fails.')
     def test_string_in_exact_mode_not_found(self):
         range = Range('A1:A3', ['aab', 'a', 'rars'])
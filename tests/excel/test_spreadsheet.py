@@ -1,8 +1,13 @@
 import io
 import sys
+import time
 import unittest
 
+import numpy as np
+
 from koala.Spreadsheet import *
+from koala.CompactGraph import CompactGraph
+from koala.ScenarioRunner import ScenarioRunner
 sys.setrecursionlimit(3000)
 
 class Test_Spreadsheet(unittest.TestCase):
@@ -54,3 +59,414 @@ class Test_Spreadsheet(unittest.TestCase):
         sp2.cell_set_value('Sheet1!B8', value=600)
         self.assertNotEqual(sp1.cell_evaluate('Sheet1!B7'), sp2.cell_evaluate('Sheet1!B7'))
         self.assertNotEqual(sp1.cell_evaluate('Sheet1!B8'), sp2.cell_evaluate('Sheet1!B8'))
+
+    def test_long_chain(self):
+        # deeper than the recursion limit
+        spreadsheet = Spreadsheet()
+        spreadsheet.cell_add('Sheet1!A1', value=1)
+        for i in range(2, 4001):
+            spreadsheet.cell_add('Sheet1!A%i' % i, formula='=Sheet1!A%i+1' % (i - 1))
+
+        self.assertEqual(spreadsheet.dirty_dependencies(spreadsheet.cellmap['Sheet1!A4'])[0].address(), 'Sheet1!A2')
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!A4000'), 4000)
+        self.assertEqual(spreadsheet.dirty_dependencies(spreadsheet.cellmap['Sheet1!A4000']), [])
+
+        spreadsheet.cell_set_value('Sheet1!A1', 10) # resets the whole chain
+        self.assertTrue(spreadsheet.cellmap['Sheet1!A4000'].need_update)
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!A4000'), 4009)
+
+    def test_branch_not_taken(self):
+        spreadsheet = Spreadsheet()
+        spreadsheet.cell_add('Sheet1!A1', value=1)
+        spreadsheet.cell_add('Sheet1!A2', formula='=Sheet1!A1*2')
+        spreadsheet.cell_add('Sheet1!A3', formula='=Sheet1!A1*3')
+        spreadsheet.cell_add('Sheet1!A4', formula='=IF(Sheet1!A1>0,Sheet1!A2,Sheet1!A3)')
+
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!A4'), 2)
+        self.assertTrue(spreadsheet.cellmap['Sheet1!A3'].need_update)
+
+        spreadsheet.cell_set_value('Sheet1!A1', -1) # the other branch, evaluated when read
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!A4'), -3)
+
+    def test_error_in_dependency(self):
+        spreadsheet = Spreadsheet()
+        for i in range(1, 4):
+            spreadsheet.cell_add('Sheet1!A%i' % i, value=i)
+        spreadsheet.cell_add('Sheet1!B5', formula='=Sheet1!A1:A3*Sheet1!A1:A2') # raises #VALUE!, different sizes
+        spreadsheet.cell_add('Sheet1!B6', formula='=IFERROR(Sheet1!B5,10)')
+
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!B6'), 10)
+        # the error is the value of B5, which is not evaluated again
+        self.assertEqual(spreadsheet.cellmap['Sheet1!B5'].value.value, '#VALUE!')
+        self.assertFalse(spreadsheet.cellmap['Sheet1!B5'].need_update)
+
+        # other exceptions are raised, they are not Excel errors
+        spreadsheet.cell_add('Sheet1!C1', formula='=Sheet1!A1+1')
+        spreadsheet.cell_add('Sheet1!C2', formula='=IFERROR(Sheet1!C1,10)')
+        spreadsheet.cellmap['Sheet1!C1'].python_expression = 'undefined_fn()'
+        spreadsheet.cellmap['Sheet1!C1'].compile()
+        with self.assertRaises(Exception) as raised:
+            spreadsheet.cell_evaluate('Sheet1!C2')
+        self.assertIn("Problem evalling: name 'undefined_fn' is not defined for Sheet1!C1", str(raised.exception))
+        self.assertTrue(spreadsheet.cellmap['Sheet1!C1'].need_update)
+
+    def test_evaluated_once(self):
+        # a formula reading many dirty cells is evaluated once, after them
+        durations = []
+        for n in (20, 200):
+            spreadsheet = Spreadsheet()
+            spreadsheet.cell_add('Sheet1!A1', value=1)
+            for i in range(1, n + 1):
+                spreadsheet.cell_add('Sheet1!B%i' % i, formula='=Sheet1!A1*%i' % i)
+            references = ['Sheet1!B%i' % i for i in range(1, n + 1)]
+            spreadsheet.cell_add('Sheet1!C1', formula='=%s' % '+'.join(
+                'SUM(%s)' % ','.join(references[i:i + 100]) for i in range(0, n, 100)))
+
+            computed = []
+            compute = spreadsheet.compute
+            spreadsheet.compute = lambda cell, **kwargs: computed.append(cell) or compute(cell, **kwargs)
+
+            start = time.time()
+            for value in range(20):
+                spreadsheet.cell_set_value('Sheet1!A1', value)
+                self.assertEqual(spreadsheet.cell_evaluate('Sheet1!C1'), value * n * (n + 1) // 2)
+            durations.append(time.time() - start)
+            self.assertEqual(len(computed), 20 * (n + 1))
+
+        self.assertLess(durations[1], 20 * durations[0] + 1)
+
+    def test_implicit_intersection(self):
+        spreadsheet = Spreadsheet()
+        for i in range(1, 6):
+            spreadsheet.cell_add('Sheet1!A%i' % i, value=i)
+        spreadsheet.cell_add('Sheet1!B3', formula='=Sheet1!A1:A5*2')
+        spreadsheet.cell_add('Sheet1!B4', formula='=Sheet1!A1:A5+SUM(Sheet1!A1:A5)')
+
+        self.assertEqual([c.address() for c in spreadsheet.parents(spreadsheet.cellmap['Sheet1!B3'])], ['Sheet1!A3'])
+        self.assertEqual([c.address() for c in spreadsheet.parents(spreadsheet.cellmap['Sheet1!B4'])], ['Sheet1!A1:A5'])
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!B3'), 6)
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!B4'), 19)
+
+    def test_whole_column(self):
+        spreadsheet = Spreadsheet()
+        for i in range(1, 4):
+            spreadsheet.cell_add('Sheet1!A%i' % i, value=i)
+        spreadsheet.cell_add('Sheet1!B1', formula='=SUM(Sheet1!A:A)')
+
+        self.assertEqual(spreadsheet.cellmap['Sheet1!A:A'].range.addresses, ['Sheet1!A1', 'Sheet1!A2', 'Sheet1!A3'])
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!B1'), 6)
+
+        spreadsheet.cell_add('Sheet1!A6', value=10) # grows the used area of the sheet
+        self.assertEqual(len(spreadsheet.cellmap['Sheet1!A:A'].range.addresses), 6)
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!B1'), 16)
+
+        spreadsheet.cell_add('Sheet1!C8', value=1)
+        self.assertEqual(spreadsheet.cellmap['Sheet1!A:A'].range.addresses[-1], 'Sheet1!A8')
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!B1'), 16)
+
+    def test_whole_row(self):
+        spreadsheet = Spreadsheet()
+        spreadsheet.cell_add('Sheet1!A1', value=1)
+        spreadsheet.cell_add('Sheet1!B1', value=2)
+        spreadsheet.cell_add('Sheet1!A2', formula='=SUM(Sheet1!1:1)')
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!A2'), 3)
+
+        spreadsheet.cell_add('Sheet1!D1', value=4) # with an empty C1
+        self.assertEqual(spreadsheet.cellmap['Sheet1!1:1'].range.addresses, ['Sheet1!A1', 'Sheet1!B1', 'Sheet1!C1', 'Sheet1!D1'])
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!A2'), 7)
+
+    def test_grow_whole_column(self):
+        # adding a cell appends to A:A instead of building it again
+        durations = []
+        for n in (500, 4000):
+            spreadsheet = Spreadsheet()
+            spreadsheet.cell_add('Sheet1!A1', value=1)
+            spreadsheet.cell_add('Sheet1!B1', formula='=SUM(Sheet1!A:A)')
+            start = time.time()
+            for i in range(2, n + 1):
+                spreadsheet.cell_add('Sheet1!A%i' % i, value=i)
+            durations.append(time.time() - start)
+            self.assertEqual(spreadsheet.cell_evaluate('Sheet1!B1'), n * (n + 1) // 2)
+
+        self.assertLess(durations[1], 20 * durations[0] + 1)
+
+    def test_set_values(self):
+        file_name = os.path.abspath("./tests/ast/basic_evaluation.xlsx")
+        sp1 = Spreadsheet(file_name)
+        sp2 = Spreadsheet(file_name)
+        outputs = ['Sheet1!D1', 'Sheet1!G1', 'Sheet1!H1', 'Sheet1!L22', 'Sheet1!H16']
+
+        for address in outputs: # evaluated before being reset
+            self.assertEqual(sp1.cell_evaluate(address), sp2.cell_evaluate(address))
+
+        values = {'Sheet1!A1': 10, 'Sheet1!B1': 20, 'Sheet1!H22': 3, 'Sheet1!A22': 2}
+        for address, value in values.items():
+            sp1.cell_set_value(address, value)
+        sp2.set_values(values)
+
+        self.assertEqual(sp2.fixed_cells, sp1.fixed_cells)
+        for address in outputs:
+            self.assertEqual(sp2.cell_evaluate(address), sp1.cell_evaluate(address))
+
+    def test_batch(self):
+        spreadsheet = Spreadsheet()
+        spreadsheet.cell_add('Sheet1!A1', value=1)
+        spreadsheet.cell_add('Sheet1!A2', value=2)
+        spreadsheet.cell_add('Sheet1!A3', formula='=SUM(Sheet1!A1, Sheet1!A2)')
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!A3'), 3)
+
+        with spreadsheet.batch():
+            spreadsheet.cell_set_value('Sheet1!A1', 10)
+            with spreadsheet.batch():
+                spreadsheet.cell_set_value('Sheet1!A2', None)
+            self.assertFalse(spreadsheet.cellmap['Sheet1!A3'].need_update) # reset when leaving the batch
+
+        self.assertEqual(spreadsheet.cell_evaluate('Sheet1!A3'), 10)
+
+
+    def test_reset_shared_cells(self):
+        spreadsheet = Spreadsheet()
+        spreadsheet.cell_add('Sheet1!Z1', value=1)
+        spreadsheet.cell_add('Sheet1!Z2', formula='=Sheet1!Z1*2')
+        spreadsheet.cell_add('Sheet1!Y1', value=1)
+        spreadsheet.cell_add('Sheet1!Y2', formula='=Sheet1!Y1*2')
+        for value in range(1, 5):
+            spreadsheet.cell_set_value('Sheet1!Z1', value)
+            self.assertEqual(spreadsheet.cell_evaluate('Sheet1!Z2'), 2 * value)
+
+        # the reset sweeps of a Spreadsheet sharing the cells must not be mistaken for the ones already done
+        shared = Spreadsheet()
+        shared.build_spreadsheet(spreadsheet.G, spreadsheet.cellmap, spreadsheet.named_ranges)
+        for value in [5, 6, 6]:
+            shared.cell_set_value('Sheet1!Y1', value)
+            self.assertEqual(shared.cell_evaluate('Sheet1!Y2'), 2 * value)
+        shared.cell_set_value('Sheet1!Z1', 100)
+        self.assertEqual(shared.cell_evaluate('Sheet1!Z2'), 200)
+
+
+class Test_CompactGraph(unittest.TestCase):
+    def setUp(self):
+        self.file_name = os.path.abspath("./tests/ast/basic_evaluation.xlsx")
+
+    def test_same_graph(self):
+        sp = Spreadsheet(self.file_name)
+        G = CompactGraph.from_networkx(sp.G)
+
+        self.assertEqual(len(G), len(sp.G))
+        self.assertEqual(G.number_of_edges(), len(sp.G.edges()))
+        for cell in sp.G.nodes():
+            self.assertEqual(set(G.successors(cell)), set(sp.G.successors(cell)))
+            self.assertEqual(set(G.predecessors(cell)), set(sp.G.predecessors(cell)))
+
+        self.assertEqual(set(G.to_networkx().edges()), set(sp.G.edges()))
+
+    def test_add_edge(self):
+        a, b, c = Cell('Sheet1!A1'), Cell('Sheet1!A2'), Cell('Sheet1!A3')
+        G = CompactGraph([a, b], [(a, b), (a, b)])
+        self.assertEqual(G.number_of_edges(), 1)
+
+        G.add_edge(a, b)
+        G.add_edge(c, b)
+        self.assertEqual(G.number_of_edges(), 2)
+        self.assertEqual(set(G.predecessors(b)), set([a, c]))
+
+        G.compact()
+        self.assertEqual(G.number_of_edges(), 2)
+        self.assertEqual(set(G.predecessors(b)), set([a, c]))
+        self.assertEqual(list(G.successors(c)), [b])
+
+    def test_built_without_networkx(self):
+        a, b, c = Cell('Sheet1!A1'), Cell('Sheet1!A2'), Cell('Sheet1!A3')
+        G = CompactGraph()
+        G.add_edge(a, b)
+        G.add_edge(c, b)
+        G.add_edge(a, b)
+        self.assertEqual(G.number_of_edges(), 2)
+        self.assertEqual(set(G.predecessors(b)), set([a, c]))
+        self.assertEqual(list(G.successors(b)), [])
+
+        # the graph of a Spreadsheet is built as a CompactGraph from the start
+        sp = Spreadsheet(self.file_name, outputs = ['Sheet1!G1'])
+        compact = Spreadsheet(self.file_name, compact_graph = True, outputs = ['Sheet1!G1'])
+        self.assertIsInstance(compact.G, CompactGraph)
+        self.assertEqual(compact.G.number_of_edges(), sp.G.number_of_edges())
+        self.assertEqual(compact.cell_evaluate('Sheet1!G1'), sp.cell_evaluate('Sheet1!G1'))
+
+    def test_evaluation(self):
+        sp = Spreadsheet(self.file_name)
+        compact = Spreadsheet(self.file_name, compact_graph = True)
+        self.assertIsInstance(compact.G, CompactGraph)
+
+        for spreadsheet in [sp, compact]:
+            spreadsheet.cell_set_value('Sheet1!A1', 10)
+            spreadsheet.cell_set_value('Sheet1!B1', 20)
+            spreadsheet.cell_add('Sheet1!P4', formula = 'A1 + 10')
+
+        for address in ['Sheet1!D1', 'Sheet1!F1', 'Sheet1!G1', 'Sheet1!P4']:
+            self.assertEqual(compact.cell_evaluate(address), sp.cell_evaluate(address))
+        self.assertEqual(compact.cell_evaluate('Sheet1!P4'), 20)
+
+    def test_dump(self):
+        sp = Spreadsheet(self.file_name)
+        sp.dump("dump.txt.gz")
+        loaded = Spreadsheet.load("dump.txt.gz", compact_graph = True)
+        self.assertIsInstance(loaded.G, CompactGraph)
+
+        loaded.cell_set_value('Sheet1!B1', 20)
+        self.assertEqual(loaded.cell_evaluate('Sheet1!G1'), 41)
+
+
+class Test_ClosureBackend(unittest.TestCase):
+    def setUp(self):
+        self.file_name = os.path.abspath("./tests/ast/basic_evaluation.xlsx")
+
+    def test_evaluation(self):
+        sp = Spreadsheet(self.file_name)
+        closures = Spreadsheet(self.file_name, backend = 'closure')
+
+        for spreadsheet in [sp, closures]:
+            spreadsheet.cell_set_value('Sheet1!A1', 10)
+            spreadsheet.cell_set_value('Sheet1!B1', 20)
+            spreadsheet.cell_add('Sheet1!P4', formula = 'IF(A1 > 5, A1 + 10, 0)')
+
+        for address in ['Sheet1!D1', 'Sheet1!F1', 'Sheet1!G1', 'Sheet1!P4']:
+            self.assertEqual(closures.cell_evaluate(address), sp.cell_evaluate(address))
+        self.assertEqual(closures.cell_evaluate('Sheet1!P4'), 20)
+
+        closures.cell_set_formula('Sheet1!P4', 'A1 * 2')
+        self.assertEqual(closures.cell_evaluate('Sheet1!P4'), 20)
+
+    def test_closure(self):
+        sp = Spreadsheet(backend = 'closure')
+        sp.cell_add('Sheet1!A1', value = 1)
+        sp.cell_add('Sheet1!A2', value = 2)
+        sp.cell_add('Sheet1!A3', formula = '=SUM(Sheet1!A1, Sheet1!A2) * -2')
+        self.assertEqual(sp.cell_evaluate('Sheet1!A3'), -6)
+
+        cell = sp.cellmap['Sheet1!A3']
+        self.assertIsNotNone(cell.closure)
+        self.assertEqual(cell.closure(), -6)
+
+    def test_load(self):
+        sp = Spreadsheet(self.file_name)
+        sp.dump("dump.txt.gz")
+        loaded = Spreadsheet.load("dump.txt.gz", backend = 'closure')
+        self.assertIsNone(loaded.cellmap['Sheet1!G1'].compiled_expression)
+
+        loaded.cell_set_value('Sheet1!B1', 20)
+        self.assertEqual(loaded.cell_evaluate('Sheet1!G1'), 41)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(Exception):
+            Spreadsheet(backend = 'bytecode')
+
+
+    def test_replaced_cell(self):
+        sp = Spreadsheet(backend = 'closure')
+        sp.cell_add('Sheet1!A1', value = 1)
+        sp.cell_add('Sheet1!A2', formula = '=Sheet1!A1*2')
+        self.assertEqual(sp.cell_evaluate('Sheet1!A2'), 2)
+
+        sp.cellmap['Sheet1!A1'] = Cell('Sheet1!A1', value = 5) # read by the closure of A2
+        sp.cell_reset('Sheet1!A2')
+        self.assertEqual(sp.cell_evaluate('Sheet1!A2'), 10)
+
+    def test_unsupported_expression(self):
+        sp = Spreadsheet(backend = 'closure')
+        sp.cell_add('Sheet1!A1', value = 1)
+        cell = sp.cellmap['Sheet1!A1']
+        cell.python_expression = '[x * 2 for x in (1, 2)][1]'
+
+        with self.assertRaises(UnsupportedExpression):
+            build_closure(sp, cell.python_expression, {})
+        self.assertEqual(sp.closure(cell)(), 4) # evaluated like with the string backend
+
+
+class Test_EvaluateBatch(unittest.TestCase):
+    def setUp(self):
+        self.file_name = os.path.abspath("./tests/ast/basic_evaluation.xlsx")
+
+    def assertSameAsSerial(self, sp, inputs, outputs):
+        results = sp.evaluate_batch(inputs, outputs)
+        size = len(list(inputs.values())[0])
+
+        for i in range(size):
+            for address, values in inputs.items():
+                sp.cell_set_value(address, values[i])
+            for address in outputs:
+                self.assertEqual(results[address][i], sp.cell_evaluate(address))
+
+    def test_evaluation(self):
+        sp = Spreadsheet(self.file_name)
+        inputs = {'Sheet1!A1': [1, 2, 3, 4], 'Sheet1!B1': [5., 0., -1., 20.]}
+        outputs = ['Sheet1!D1', 'Sheet1!F1', 'Sheet1!G1', 'Sheet1!H1', 'Sheet1!A41']
+        self.assertSameAsSerial(sp, inputs, outputs)
+
+    def test_unchanged(self):
+        sp = Spreadsheet(self.file_name)
+        before = sp.cell_evaluate('Sheet1!D1')
+        b1 = sp.cell_evaluate('Sheet1!B1')
+        results = sp.evaluate_batch({'Sheet1!A1': np.arange(100)}, ['Sheet1!D1'])
+
+        self.assertEqual(list(results['Sheet1!D1'][:3]), [b1, 1 + b1, 2 + b1])
+        self.assertEqual(sp.cell_evaluate('Sheet1!D1'), before)
+        self.assertNotIn('Sheet1!A1', sp.fixed_cells)
+
+    def test_errors(self):
+        sp = Spreadsheet()
+        sp.cell_add('Sheet1!A1', value = 1)
+        sp.cell_add('Sheet1!A2', formula = '=10 / Sheet1!A1')
+        sp.cell_add('Sheet1!A3', formula = '=IF(Sheet1!A1 = 0, 0, 10 / Sheet1!A1)')
+
+        results = sp.evaluate_batch({'Sheet1!A1': [1, 0, 5]}, ['Sheet1!A2', 'Sheet1!A3'])
+        self.assertEqual(results['Sheet1!A2'][0], 10)
+        self.assertIsInstance(results['Sheet1!A2'][1], ExcelError)
+        self.assertEqual(results['Sheet1!A2'][2], 2)
+        self.assertEqual(list(results['Sheet1!A3']), [10, 0, 2])
+
+    def test_pointers(self):
+        sp = Spreadsheet(self.file_name)
+        self.assertSameAsSerial(sp, {'Sheet1!A22': [1, 2, 3]}, ['Sheet1!H16'])
+
+    def test_wrong_inputs(self):
+        sp = Spreadsheet(self.file_name)
+        with self.assertRaises(Exception):
+            sp.evaluate_batch({'Sheet1!A1': [1, 2], 'Sheet1!B1': [1, 2, 3]}, ['Sheet1!D1'])
+        with self.assertRaises(Exception):
+            sp.evaluate_batch({'Sheet1!A1:A3': [1, 2]}, ['Sheet1!D1'])
+
+
+class Test_ScenarioRunner(unittest.TestCase):
+    def setUp(self):
+        self.file_name = os.path.abspath("./tests/ast/basic_evaluation.xlsx")
+        self.scenarios = [{'Sheet1!A1': i} if i % 2 else {'Sheet1!B1': i} for i in range(10)]
+        self.outputs = ['Sheet1!D1', 'Sheet1!G1']
+
+    def expected(self):
+        results = []
+        for scenario in self.scenarios:
+            sp = Spreadsheet(self.file_name)
+            for address, value in scenario.items():
+                sp.cell_set_value(address, value)
+            results.append(dict((address, sp.cell_evaluate(address)) for address in self.outputs))
+        return results
+
+    def test_serial(self):
+        sp = Spreadsheet(self.file_name)
+        before = sp.cell_evaluate('Sheet1!D1')
+
+        results = list(ScenarioRunner(sp, workers = 1, chunksize = 3).run(self.scenarios, self.outputs))
+        self.assertEqual(results, self.expected())
+        self.assertEqual(sp.cell_evaluate('Sheet1!D1'), before)
+        self.assertEqual(sp.fixed_cells, {})
+
+    def test_pool(self):
+        sp = Spreadsheet(self.file_name)
+        runner = ScenarioRunner(sp, workers = 2, chunksize = 3)
+        expected = self.expected()
+
+        self.assertEqual(list(runner.run(self.scenarios, self.outputs)), expected)
+
+        results = sorted(runner.run(self.scenarios, self.outputs, ordered = False), key = lambda r: r[0])
+        self.assertEqual([index for index, result in results], list(range(10)))
+        self.assertEqual([result for index, result in results], expected)
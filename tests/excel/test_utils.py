@@ -5,6 +5,9 @@ import pyximport; pyximport.install()
 import unittest
 
 from koala.excellib import *
+from koala.Cell import Cell
+
+from openpyxl.formula.translate import Translator, TranslatorError
 
 
 class Test_criteria_parser(unittest.TestCase):
@@ -67,6 +70,61 @@ class Test_criteria_parser(unittest.TestCase):
         self.assertEqual(criteria_parser('=A')('B'), False)
         self.assertEqual(criteria_parser('=A')(1), False)
 
+    def test_parser_not_equal_strings(self):
+        self.assertEqual(criteria_parser('<>A')('a'), False)
+        self.assertEqual(criteria_parser('<>A')('B'), True)
+        self.assertEqual(criteria_parser('<>A')(1), True)
+        self.assertEqual(criteria_parser('<>')(None), False)
+        self.assertEqual(criteria_parser('<>')('A'), True)
+
+    def test_parser_negative_numeric(self):
+        self.assertEqual(criteria_parser('>=-3')(-3), True)
+        self.assertEqual(criteria_parser('>=-3')(-4), False)
+
+    def test_parser_wildcards(self):
+        self.assertEqual(criteria_parser('a*')('Abc'), True)
+        self.assertEqual(criteria_parser('a*')('bac'), False)
+        self.assertEqual(criteria_parser('a?c')('abc'), True)
+        self.assertEqual(criteria_parser('a?c')('abbc'), False)
+        self.assertEqual(criteria_parser('*')(1), False)
+        self.assertEqual(criteria_parser('=*c')('abc'), True)
+        self.assertEqual(criteria_parser('<>*c')('abc'), False)
+        self.assertEqual(criteria_parser('<>*c')(1), True)
+
+    def test_parser_escaped_wildcards(self):
+        self.assertEqual(criteria_parser('a~*')('a*'), True)
+        self.assertEqual(criteria_parser('a~*')('ab'), False)
+        self.assertEqual(criteria_parser('a~?')('a?'), True)
+        self.assertEqual(criteria_parser('a~~')('a~'), True)
+        self.assertEqual(criteria_parser('a~')('a~'), True)
+
+    def test_parser_cache(self):
+        self.assertIs(criteria_parser('a*'), criteria_parser('a*'))
+        self.assertIsNot(criteria_parser('1'), criteria_parser(1))
+
+
+class Test_shift_formula(unittest.TestCase):
+    class RefTranslator(Translator):
+        # writes #REF! where the Translator raises, as Excel does
+        @classmethod
+        def translate_range(cls, range_str, rdelta, cdelta):
+            try:
+                return super(Test_shift_formula.RefTranslator, cls).translate_range(range_str, rdelta, cdelta)
+            except TranslatorError:
+                return cls.strip_ws_name(range_str)[0] + '#REF!'
+
+    def assertSameAsTranslator(self, formula, origin, destination, row_offset, col_offset):
+        expected = self.RefTranslator('=' + formula, origin).translate_formula(destination)
+        self.assertEqual('=' + shift_formula(formula, row_offset, col_offset), expected)
+
+    def test_shift(self):
+        self.assertSameAsTranslator("B1*Sheet2!A2:B3+'My Sheet'!$A2", 'C3', 'D4', 1, 1)
+
+    def test_off_grid(self):
+        self.assertSameAsTranslator('Sheet2!A1+1', 'C3', 'C2', -1, 0)
+        self.assertSameAsTranslator("'My Sheet'!B2+A2", 'C3', 'B3', 0, -1)
+        self.assertEqual(shift_formula('Sheet2!A1+B2', -1, 0), 'Sheet2!#REF!+B1')
+
 
 class Test_split_address(unittest.TestCase):
     def test_parser(self):
@@ -84,4 +142,18 @@ class Test_resolve_range(unittest.TestCase):
         self.assertEqual(resolve_range('Sheet1!A:A')[1::], (2**20, 1))
         self.assertEqual(resolve_range('Sheet1!A:B')[1::], (2**20, 2))
         self.assertEqual(resolve_range('Sheet1!1:1')[1::], (1, 2**14))
-        self.assertEqual(resolve_range('Sheet1!1:2')[1::], (2, 2**14))
\ No newline at end of file
+        self.assertEqual(resolve_range('Sheet1!1:2')[1::], (2, 2**14))
+
+    def test_lazy_addresses(self):
+        addresses = resolve_range('Sheet1!A1:B3', should_flatten = True)[0]
+        self.assertIsInstance(addresses, RangeAddresses)
+        self.assertEqual(addresses, ['Sheet1!A1', 'Sheet1!B1', 'Sheet1!A2', 'Sheet1!B2', 'Sheet1!A3', 'Sheet1!B3'])
+        self.assertEqual((addresses[3], addresses[-1], addresses[1:3]), ('Sheet1!B2', 'Sheet1!B3', ['Sheet1!B1', 'Sheet1!A2']))
+        self.assertEqual(addresses.index('Sheet1!A3'), 4)
+        self.assertNotIn('Sheet1!C1', addresses)
+        self.assertEqual(addresses.select({'Sheet1!B3': 1, 'Sheet1!A2': 2, 'Sheet1!A2:B3': 3}), [('Sheet1!A2', (2, 'A')), ('Sheet1!B3', (3, 'B'))])
+
+        self.assertEqual(type(resolve_range('Sheet1!A1:A3')[0]), list)
+        column = resolve_range('Sheet1!A:A', should_flatten = True)[0]
+        self.assertEqual((len(column), column[2**20 - 1]), (2**20, 'Sheet1!A1048576'))
+        self.assertEqual(Range('Sheet1!A:A', cellmap = {'Sheet1!A5': Cell('Sheet1!A5', value = 1)}).values, [1])